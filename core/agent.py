@@ -1,11 +1,15 @@
 from typing import Dict, Any, List, Optional
-import json
+import asyncio
+import hashlib
+import orjson
+from cachetools import LFUCache
 from datetime import datetime
-from sqlalchemy.orm import Session
+from sqlalchemy.ext.asyncio import AsyncSession
 
 # 導入配置和日誌
 from utils.config import OPENAI_API_KEY
 from utils.logger import logger
+from utils.keyword_matcher import KeywordMatcher
 
 # 導入核心模型
 from core.models import ConversationContext, Tool
@@ -21,6 +25,7 @@ from core.handlers import (
 # 導入服務
 from services.filter_service import ChatHistoryFilterService
 from services.analysis_service import (
+    INTENT_MODEL,
     IntentAnalysisService, 
     SentimentAnalysisService, 
     EntityExtractionService, 
@@ -30,6 +35,55 @@ from services.proactive_questioning_service import ProactiveQuestioningService
 from services.user_profile_db_service import UserProfileDBService
 from tools.search_tools import SearchParamsExtractor, EventSearchService
 
+# 興趣類別關鍵字（依優先順序）
+_ACTIVITY_KEYWORDS = (
+    ("音樂", frozenset({"音樂", "演唱會", "音樂會", "演出", "表演", "歌手", "樂團"})),
+    ("藝術", frozenset({"藝術", "展覽", "美術", "畫展", "藝文", "博物館", "畫廊"})),
+    ("運動", frozenset({"運動", "健身", "瑜伽", "跑步", "球類", "游泳", "登山"})),
+    ("美食", frozenset({"美食", "餐廳", "料理", "烹飪", "品酒", "咖啡", "甜點"})),
+    ("學習", frozenset({"學習", "課程", "講座", "工作坊", "研習", "教學"})),
+    ("親子", frozenset({"親子", "兒童", "家庭", "小孩", "孩子"})),
+    ("戶外", frozenset({"戶外", "野餐", "露營", "踏青", "自然", "郊遊"})),
+    ("社交", frozenset({"社交", "聚會", "交友", "派對", "聯誼"})),
+)
+
+# 模組載入時預先編譯興趣比對器
+_INTEREST_MATCHER = KeywordMatcher(
+    (keyword, category) for category, keywords in _ACTIVITY_KEYWORDS for keyword in keywords
+)
+
+# 意圖分析快取：相同訊息與相同近期對話直接沿用先前的意圖，避免重複呼叫 LLM
+INTENT_CACHE = LFUCache(maxsize=4096)
+
+# 工具定義固定不變，模組載入時建立一次，各 Agent 共用
+_TOOLS = (
+    Tool(
+        name="search_events",
+        description="搜尋活動",
+        parameters={
+            "type": "object",
+            "properties": {
+                "query": {"type": "string", "description": "搜尋關鍵字"},
+                "city": {"type": "string", "description": "城市"},
+                "from": {"type": "integer", "description": "開始時間戳"},
+                "to": {"type": "integer", "description": "結束時間戳"}
+            }
+        },
+        category="search"
+    ),
+    Tool(
+        name="analyze_intent",
+        description="分析用戶意圖",
+        parameters={
+            "type": "object",
+            "properties": {
+                "message": {"type": "string", "description": "用戶訊息"}
+            }
+        },
+        category="analysis"
+    ),
+)
+
 class Agent:
     """簡化的智能代理核心類，具備主動式提問功能和資料庫支援"""
     
@@ -49,42 +103,38 @@ class Agent:
         self.recommendation_handler = RecommendationHandler(self)
         self.conversation_handler = ConversationHandler(self)
         
+        # 意圖分派表：統一以 (訊息, 聊天歷史, 請求上下文) 呼叫，未知意圖交由一般問題處理
+        self._intent_dispatch = {
+            "search_events": lambda m, h, ctx: self.search_handler.handle_search_events(
+                m, h, ctx["page"], ctx["search_params"]
+            ),
+            "greeting": lambda m, h, ctx: self.conversation_handler.handle_greeting(m, h),
+            "goodbye": lambda m, h, ctx: self.conversation_handler.handle_goodbye(m, h),
+            "help": lambda m, h, ctx: self.conversation_handler.handle_help(m, h),
+            "analyze_trends": lambda m, h, ctx: self.analysis_handler.handle_analyze_trends(m, h),
+            "analyze_statistics": lambda m, h, ctx: self.analysis_handler.handle_analyze_statistics(m, h),
+            "get_recommendations": lambda m, h, ctx: self.recommendation_handler.handle_get_recommendations(
+                m, h, ctx["user_profile"]
+            ),
+            "compare_events": lambda m, h, ctx: self.recommendation_handler.handle_compare_events(m, h),
+            "analyze_geographic": lambda m, h, ctx: self.analysis_handler.handle_analyze_geographic(m, h),
+            "generate_report": lambda m, h, ctx: self.analysis_handler.handle_generate_report(m, h),
+            "get_event_details": lambda m, h, ctx: self.search_handler.handle_get_event_details(m, h),
+        }
+        self._default_dispatch = lambda m, h, ctx: self._handle_general_question(
+            m, h, ctx["user_profile"], ctx["conversation_stage"]
+        )
+        
         logger.info(f"Agent initialized successfully with session_id: {session_id}")
     
     def _initialize_tools(self) -> List[Tool]:
         """初始化工具列表"""
-        return [
-            Tool(
-                name="search_events",
-                description="搜尋活動",
-                parameters={
-                    "type": "object",
-                    "properties": {
-                        "query": {"type": "string", "description": "搜尋關鍵字"},
-                        "city": {"type": "string", "description": "城市"},
-                        "from": {"type": "integer", "description": "開始時間戳"},
-                        "to": {"type": "integer", "description": "結束時間戳"}
-                    }
-                },
-                category="search"
-            ),
-            Tool(
-                name="analyze_intent",
-                description="分析用戶意圖",
-                parameters={
-                    "type": "object",
-                    "properties": {
-                        "message": {"type": "string", "description": "用戶訊息"}
-                    }
-                },
-                category="analysis"
-            )
-        ]
+        return list(_TOOLS)
     
     async def process_message(
         self, 
         message: str, 
-        db: Session,
+        db: AsyncSession,
         chat_history: List[Dict[str, Any]] = None, 
         page: int = 1, 
         search_params: Dict[str, Any] = None
@@ -105,66 +155,74 @@ class Agent:
             # 更新對話上下文
             self.context.conversation_history = chat_history or []
             
-            # 分析用戶畫像（使用資料庫）
-            user_profile = await self.user_profile_service.analyze_user_from_conversation(
-                db, self.session_id, chat_history
-            )
+            # 對話上下文只序列化一次，供後續各服務共用
+            context_snapshot = self.context.model_dump(exclude_none=True)
             
-            # 分析對話階段
-            conversation_stage = await self.proactive_service.analyze_conversation_stage(
-                chat_history or [], self.context.dict()
+            # 並行分析用戶畫像（使用資料庫）、對話階段與用戶意圖，三者互不相依
+            user_profile, conversation_stage, intent = await asyncio.gather(
+                self.user_profile_service.analyze_user_from_conversation(
+                    db, self.session_id, chat_history
+                ),
+                self.proactive_service.analyze_conversation_stage(
+                    chat_history or [], context_snapshot
+                ),
+                self._analyze_intent_cached(message, chat_history),
+                return_exceptions=True
             )
             
+            # 任一分析失敗時使用預設值，不影響後續流程
+            if isinstance(user_profile, Exception):
+                logger.error(f"Error analyzing user profile: {str(user_profile)}")
+                user_profile = {}
+            if isinstance(conversation_stage, Exception):
+                logger.error(f"Error analyzing conversation stage: {str(conversation_stage)}")
+                conversation_stage = "exploring"
+            if isinstance(intent, Exception):
+                logger.error(f"Error analyzing user intent: {str(intent)}")
+                intent = "other"
+            
             logger.info(f"Conversation stage: {conversation_stage}")
-                
-            # 分析用戶意圖
-            intent = await IntentAnalysisService.analyze_user_intent(message, chat_history)
             self.context.user_intent = intent
+            context_snapshot["user_intent"] = intent
             
             # 根據意圖使用對應的處理器處理訊息
-            if intent == "search_events":
-                response = await self.search_handler.handle_search_events(message, chat_history, page, search_params)
-            elif intent == "greeting":
-                response = await self.conversation_handler.handle_greeting(message, chat_history)
-            elif intent == "goodbye":
-                response = await self.conversation_handler.handle_goodbye(message, chat_history)
-            elif intent == "help":
-                response = await self.conversation_handler.handle_help(message, chat_history)
-            elif intent == "analyze_trends":
-                response = await self.analysis_handler.handle_analyze_trends(message, chat_history)
-            elif intent == "analyze_statistics":
-                response = await self.analysis_handler.handle_analyze_statistics(message, chat_history)
-            elif intent == "get_recommendations":
-                response = await self.recommendation_handler.handle_get_recommendations(message, chat_history, user_profile)
-            elif intent == "compare_events":
-                response = await self.recommendation_handler.handle_compare_events(message, chat_history)
-            elif intent == "analyze_geographic":
-                response = await self.analysis_handler.handle_analyze_geographic(message, chat_history)
-            elif intent == "generate_report":
-                response = await self.analysis_handler.handle_generate_report(message, chat_history)
-            elif intent == "get_event_details":
-                response = await self.search_handler.handle_get_event_details(message, chat_history)
-            else:
-                response = await self._handle_general_question(message, chat_history, user_profile, conversation_stage)
+            handler = self._intent_dispatch.get(intent, self._default_dispatch)
+            response = await handler(message, chat_history, {
+                "page": page,
+                "search_params": search_params,
+                "user_profile": user_profile,
+                "conversation_stage": conversation_stage
+            })
             
-            # 檢查是否需要主動提問
-            should_ask, reason = await self.proactive_service.should_ask_proactive_question(
-                message, response.get("message", ""), self.context.dict()
+            # 立即在背景更新用戶畫像（基於這次互動），與主動提問的生成重疊執行
+            update_task = asyncio.create_task(
+                self._update_user_profile_from_interaction(db, message, response, intent)
             )
             
-            if should_ask:
-                logger.info(f"Adding proactive question. Reason: {reason}")
-                proactive_questions = await self.proactive_service.generate_proactive_questions(
-                    self.context.dict(), user_profile, conversation_stage
+            try:
+                # 檢查是否需要主動提問
+                should_ask, reason = await self.proactive_service.should_ask_proactive_question(
+                    message, response.get("message", ""), context_snapshot
                 )
                 
-                # 將主動式問題添加到回應中
-                response = await self._enhance_response_with_proactive_questions(
-                    response, proactive_questions
-                )
-            
-            # 更新用戶畫像（基於這次互動）
-            await self._update_user_profile_from_interaction(db, message, response, intent)
+                if should_ask:
+                    logger.info(f"Adding proactive question. Reason: {reason}")
+                    proactive_questions = await self.proactive_service.generate_proactive_questions(
+                        context_snapshot, user_profile, conversation_stage
+                    )
+                
+                    # 將主動式問題添加到回應中
+                    response = await self._enhance_response_with_proactive_questions(
+                        response, proactive_questions
+                    )
+                
+                # 等待用戶畫像更新完成，再讀取最新畫像
+                await update_task
+            finally:
+                # 出錯或請求被取消時，背景更新仍在使用本次請求的資料庫 session，離開前先取消並等待其結束
+                if not update_task.done():
+                    update_task.cancel()
+                    await asyncio.gather(update_task, return_exceptions=True)
             
             # 獲取最新的用戶畫像並添加到回應中
             try:
@@ -172,10 +230,7 @@ class Agent:
                 if updated_profile:
                     response["user_profile_summary"] = {
                         "visit_count": updated_profile.get("visit_count", 1),
-                        "interests": [
-                            interest.get("interest") if isinstance(interest, dict) else interest 
-                            for interest in updated_profile.get("interests", [])
-                        ][:5],  # 只返回前5個興趣
+                        "interests": updated_profile.get("interest_names", [])[:5],  # 只返回前5個興趣
                         "activity_preferences": updated_profile.get("activity_preferences", {}),
                         "personality_traits": updated_profile.get("personality_traits", {}),
                         "last_activity": updated_profile.get("last_activity"),
@@ -195,13 +250,42 @@ class Agent:
                 "success": False
             }
 
+    async def _analyze_intent_cached(
+        self,
+        message: str,
+        chat_history: List[Dict[str, Any]] = None
+    ) -> str:
+        """分析用戶意圖，以（正規化訊息、最近三輪對話、模型）為鍵進行快取"""
+        history_tail = orjson.dumps((chat_history or [])[-3:], option=orjson.OPT_SORT_KEYS, default=str)
+        key = (
+            message.strip().lower(),
+            hashlib.blake2b(history_tail, digest_size=8).digest(),
+            INTENT_MODEL
+        )
+        
+        intent = INTENT_CACHE.get(key)
+        if intent is None:
+            intent, from_model = await IntentAnalysisService.resolve_user_intent(message, chat_history)
+            # 只快取模型判斷的意圖；連線失敗時的關鍵詞猜測不寫入，恢復後重新分析
+            if from_model:
+                INTENT_CACHE[key] = intent
+        else:
+            logger.info(f"Intent cache hit: {intent}")
+        return intent
+
     async def direct_search_events(
         self,
         page: int = 1,
-        search_params: Optional[Dict[str, Any]] = None
+        search_params: Optional[Dict[str, Any]] = None,
+        after_start_time: Optional[int] = None,
+        include_total: bool = True,
+        after_ids: Optional[List[str]] = None
     ) -> Dict[str, Any]:
         """直接搜尋活動，不需要處理訊息"""
-        return await self.search_handler.direct_search_events(page, search_params)
+        return await self.search_handler.direct_search_events(
+            page, search_params,
+            after_start_time=after_start_time, include_total=include_total, after_ids=after_ids
+        )
 
     async def _handle_general_question(
         self, 
@@ -220,27 +304,26 @@ class Agent:
     ) -> Dict[str, Any]:
         """增強回應，添加主動式問題"""
         try:
-            enhanced_response = original_response.copy()
+            # 呼叫端不再使用原回應，直接就地修改，避免複製大型的活動資料
+            enhanced_response = original_response
             
             if proactive_questions and proactive_questions.get("questions"):
                 # 添加主動式問題到回應中
                 enhanced_response["proactive_questions"] = proactive_questions
                 
-                # 在訊息末尾添加主動式問題
-                original_message = enhanced_response.get("message", "")
-                
-                # 添加分隔線和主動式問題
-                enhanced_response["message"] = original_message + "\n\n---\n\n"
-                enhanced_response["message"] += "💡 **我還可以幫您：**\n\n"
+                # 在訊息末尾添加分隔線和主動式問題
+                parts = [enhanced_response.get("message", ""), "\n\n---\n\n", "💡 **我還可以幫您：**\n\n"]
                 
                 for i, question in enumerate(proactive_questions["questions"][:3], 1):
-                    enhanced_response["message"] += f"{i}. {question}\n"
+                    parts.append(f"{i}. {question}\n")
                 
                 # 添加後續建議
                 if proactive_questions.get("follow_up_suggestions"):
-                    enhanced_response["message"] += "\n🔍 **相關建議：**\n"
+                    parts.append("\n🔍 **相關建議：**\n")
                     for suggestion in proactive_questions["follow_up_suggestions"][:2]:
-                        enhanced_response["message"] += f"• {suggestion}\n"
+                        parts.append(f"• {suggestion}\n")
+                
+                enhanced_response["message"] = "".join(parts)
             
             return enhanced_response
             
@@ -250,7 +333,7 @@ class Agent:
 
     async def _update_user_profile_from_interaction(
         self, 
-        db: Session,
+        db: AsyncSession,
         user_message: str, 
         agent_response: Dict[str, Any], 
         intent: str
@@ -260,32 +343,39 @@ class Agent:
             # 提取用戶興趣
             interests = await self._extract_interests_from_message(user_message)
             
+            # 收集所有畫像更新後依序執行；興趣與偏好各以單次批次寫入
+            # （同一個 AsyncSession 不能同時執行多個操作，因此不並行送出）
+            update_tasks = []
             if interests:
-                # 更新用戶興趣到資料庫
-                for interest in interests:
-                    await self.user_profile_service.update_user_interest(
-                        db, self.session_id, interest, confidence=0.7, source="conversation"
-                    )
-                logger.info(f"Updated user interests: {interests}")
+                update_tasks.append(self.user_profile_service.bulk_update_user_interests(
+                    db, self.session_id, [(interest, 0.7, "conversation") for interest in interests]
+                ))
             
-            # 根據意圖更新活動偏好
+            # 根據意圖更新活動偏好（偏好地點與偏好類別合併為一次更新）
             if intent == "search_events" and agent_response.get("search_params"):
                 search_params = agent_response["search_params"]
-                
-                # 更新偏好地點
+                preferences = {}
                 if search_params.get("city"):
-                    await self.user_profile_service.update_activity_preference(
-                        db, self.session_id, "preferred_locations", [search_params["city"]]
-                    )
-                
-                # 更新偏好類別
+                    preferences["preferred_locations"] = [search_params["city"]]
                 if search_params.get("category"):
-                    await self.user_profile_service.update_activity_preference(
-                        db, self.session_id, "preferred_categories", [search_params["category"]]
-                    )
+                    preferences["preferred_categories"] = [search_params["category"]]
+                
+                if preferences:
+                    update_tasks.append(self.user_profile_service.update_activity_preferences(
+                        db, self.session_id, preferences
+                    ))
             
             # 更新互動統計
-            await self.user_profile_service.update_interaction_stats(db, self.session_id)
+            update_tasks.append(self.user_profile_service.update_interaction_stats(db, self.session_id))
+            
+            for update in update_tasks:
+                try:
+                    await update
+                except Exception as update_error:
+                    logger.error(f"Error in user profile update: {str(update_error)}")
+            
+            if interests:
+                logger.info(f"Updated user interests: {interests}")
             
         except Exception as e:
             logger.error(f"Error updating user profile from interaction: {str(e)}")
@@ -293,25 +383,18 @@ class Agent:
     async def _extract_interests_from_message(self, message: str) -> List[str]:
         """從訊息中提取興趣"""
         try:
-            activity_keywords = {
-                "音樂": ["音樂", "演唱會", "音樂會", "演出", "表演", "歌手", "樂團"],
-                "藝術": ["藝術", "展覽", "美術", "畫展", "藝文", "博物館", "畫廊"],
-                "運動": ["運動", "健身", "瑜伽", "跑步", "球類", "游泳", "登山"],
-                "美食": ["美食", "餐廳", "料理", "烹飪", "品酒", "咖啡", "甜點"],
-                "學習": ["學習", "課程", "講座", "工作坊", "研習", "教學"],
-                "親子": ["親子", "兒童", "家庭", "小孩", "孩子"],
-                "戶外": ["戶外", "野餐", "露營", "踏青", "自然", "郊遊"],
-                "社交": ["社交", "聚會", "交友", "派對", "聯誼"]
-            }
+            # 關鍵字皆為中文，不需轉小寫；單次掃描取得所有命中類別
+            hits = _INTEREST_MATCHER.labels(message)
             
+            # 依優先順序逐一檢查類別，達到上限即停止
             detected_interests = []
-            message_lower = message.lower()
-            
-            for category, keywords in activity_keywords.items():
-                if any(keyword in message_lower for keyword in keywords):
+            for category, _ in _ACTIVITY_KEYWORDS:
+                if category in hits:
                     detected_interests.append(category)
+                    if len(detected_interests) >= 3:  # 最多返回3個興趣
+                        break
             
-            return detected_interests[:3]  # 最多返回3個興趣
+            return detected_interests
             
         except Exception as e:
             logger.error(f"Error extracting interests from message: {str(e)}")
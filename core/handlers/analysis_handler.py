@@ -1,8 +1,38 @@
-from typing import Dict, Any, List, Optional
-import httpx
+from typing import Dict, Any, List, Optional, Callable, Awaitable, Hashable
+import asyncio
+import heapq
+import orjson
+from cachetools import TTLCache
 from .base_handler import BaseHandler
+from core.http import shared_http_client
+from llm_handler import analyze_monthly_trends, analyze_geographic_distribution, clear_eventgo_cache
 from utils.logger import logger
 
+# 分析結果快取：聚合數據以分鐘到小時為單位變動，5 分鐘內的相同請求直接沿用結果
+_analysis_cache = TTLCache(maxsize=512, ttl=300)
+
+async def _cached_fetch(
+    key: Hashable,
+    fetch: Callable[[], Awaitable[Any]],
+    cacheable: Callable[[Any], bool] = bool
+) -> Any:
+    """從快取取得分析結果，未命中時呼叫 fetch 取得並存入快取"""
+    result = _analysis_cache.get(key)
+    if result is not None:
+        logger.info(f"Analysis cache hit: {key[0]}")
+        return result
+    
+    result = await fetch()
+    if cacheable(result):
+        _analysis_cache[key] = result
+    return result
+
+def clear_analysis_cache() -> None:
+    """清除分析結果快取（連同底層的 EventGO 回應快取，避免清除後仍取得舊數據）"""
+    _analysis_cache.clear()
+    clear_eventgo_cache()
+    logger.info("Analysis cache cleared")
+
 class AnalysisHandler(BaseHandler):
     """分析處理器，處理各種數據分析功能"""
     
@@ -16,34 +46,35 @@ class AnalysisHandler(BaseHandler):
             # 從訊息中提取分析參數
             analysis_params = await self._extract_analysis_params(message)
             
-            # 調用趨勢分析API
-            from llm_handler import analyze_monthly_trends
-            
             category = analysis_params.get("category", "")
             if not category:
                 # 嘗試從訊息中提取類別
                 category = await self._extract_category_from_message(message)
             
-            result = await analyze_monthly_trends(category)
+            # 發生錯誤或無數據時 data 為空，不快取以便下次重新取得
+            result = await _cached_fetch(
+                ("monthly_trends", category),
+                lambda: analyze_monthly_trends(category),
+                cacheable=lambda r: bool(r.get("data"))
+            )
             
             # 構建回應
-            response_message = f"## 📈 {category}活動趨勢分析\n\n"
-            response_message += result.get("message", "")
+            parts = [f"## 📈 {category}活動趨勢分析\n\n", result.get("message", "")]
             
             if result.get("trend_analysis"):
                 trend = result["trend_analysis"]
-                response_message += f"\n\n### 📊 統計摘要\n"
-                response_message += f"- 總活動數：{trend.get('total_events', 0)} 個\n"
-                response_message += f"- 平均每月：{trend.get('average_events', 0):.1f} 個\n"
-                response_message += f"- 分析期間：{trend.get('time_period', {}).get('start', '')} 至 {trend.get('time_period', {}).get('end', '')}\n"
+                parts.append(f"\n\n### 📊 統計摘要\n")
+                parts.append(f"- 總活動數：{trend.get('total_events', 0)} 個\n")
+                parts.append(f"- 平均每月：{trend.get('average_events', 0):.1f} 個\n")
+                parts.append(f"- 分析期間：{trend.get('time_period', {}).get('start', '')} 至 {trend.get('time_period', {}).get('end', '')}\n")
                 
                 if trend.get('max_month'):
-                    response_message += f"- 活動最多月份：{trend['max_month'].get('month', '')} ({trend['max_month'].get('count', 0)} 個)\n"
+                    parts.append(f"- 活動最多月份：{trend['max_month'].get('month', '')} ({trend['max_month'].get('count', 0)} 個)\n")
                 if trend.get('min_month'):
-                    response_message += f"- 活動最少月份：{trend['min_month'].get('month', '')} ({trend['min_month'].get('count', 0)} 個)\n"
+                    parts.append(f"- 活動最少月份：{trend['min_month'].get('month', '')} ({trend['min_month'].get('count', 0)} 個)\n")
             
             return self._create_success_response(
-                response_message,
+                "".join(parts),
                 "analyze_trends",
                 analysis_data=result,
                 visualization=result.get("visualization")
@@ -95,36 +126,26 @@ class AnalysisHandler(BaseHandler):
             # 從訊息中提取分析參數
             analysis_params = await self._extract_analysis_params(message)
             
-            # 調用地理分析API
-            from llm_handler import analyze_geographic_distribution
-            
             category = analysis_params.get("category", "")
             if not category:
                 category = await self._extract_category_from_message(message)
             
-            result = await analyze_geographic_distribution(category)
+            result = await _cached_fetch(
+                ("geographic", category),
+                lambda: analyze_geographic_distribution(category)
+            )
             
             # 構建回應
-            response_message = f"## 🗺️ {category}活動地理分布分析\n\n"
+            parts = [f"## 🗺️ {category}活動地理分布分析\n\n"]
             
             if result.get("data"):
-                response_message += "### 📊 各城市活動數量分布\n\n"
-                
-                # 排序並顯示前10個城市
-                sorted_data = sorted(result["data"], key=lambda x: x.get("value", 0), reverse=True)
-                for i, item in enumerate(sorted_data[:10], 1):
-                    city = item.get("key", "未知城市")
-                    count = item.get("value", 0)
-                    response_message += f"{i}. **{city}**：{count} 個活動\n"
-                
-                # 計算總計
-                total_events = sum(item.get("value", 0) for item in result["data"])
-                response_message += f"\n**總計**：{total_events} 個活動分布在 {len(result['data'])} 個城市\n"
+                parts.append("### 📊 各城市活動數量分布\n\n")
+                parts.append(self._render_geographic_section(result["data"]))
             else:
-                response_message += "目前沒有找到相關的地理分布數據。"
+                parts.append("目前沒有找到相關的地理分布數據。")
             
             return self._create_success_response(
-                response_message,
+                "".join(parts),
                 "analyze_geographic",
                 analysis_data=result,
                 visualization=result.get("visualization")
@@ -146,9 +167,8 @@ class AnalysisHandler(BaseHandler):
         """處理報告生成請求"""
         try:
             # 調用報告生成API
-            async with httpx.AsyncClient(verify=False) as client:
-                response = await client.get(f"http://127.0.0.1:8000/api/analysis/report")
-                result = response.json()
+            response = await shared_http_client.get("http://127.0.0.1:8000/api/analysis/report")
+            result = orjson.loads(response.content)
             
             # 構建回應
             response_message = "## 📋 活動分析報告\n\n"
@@ -185,28 +205,28 @@ class AnalysisHandler(BaseHandler):
             }
             api_params.update(params)
             
-            async with httpx.AsyncClient(verify=False) as client:
-                response = await client.get(
+            async def fetch_histogram():
+                response = await shared_http_client.get(
                     "http://127.0.0.1:8000/api/activity/histogram",
                     params=api_params
                 )
-                result = response.json()
+                response.raise_for_status()
+                return orjson.loads(response.content)
+            
+            result = await _cached_fetch(
+                ("histogram", tuple(sorted(api_params.items()))),
+                fetch_histogram
+            )
             
             # 構建回應
-            response_message = "## 📊 活動類別統計分析\n\n"
+            parts = ["## 📊 活動類別統計分析\n\n"]
             
             if result:
-                response_message += "### 各類別活動數量排行\n\n"
-                for i, item in enumerate(result[:10], 1):
-                    category = item.get("key", "未知類別")
-                    count = item.get("value", 0)
-                    response_message += f"{i}. **{category}**：{count} 個活動\n"
-                
-                total_events = sum(item.get("value", 0) for item in result)
-                response_message += f"\n**總計**：{total_events} 個活動分布在 {len(result)} 個類別\n"
+                parts.append("### 各類別活動數量排行\n\n")
+                parts.append(self._render_category_section(result))
             
             return self._create_success_response(
-                response_message,
+                "".join(parts),
                 "analyze_statistics",
                 statistics_data=result
             )
@@ -226,21 +246,32 @@ class AnalysisHandler(BaseHandler):
     ) -> Dict[str, Any]:
         """處理綜合統計"""
         try:
-            # 同時獲取地理和類別統計
-            geographic_result = await self.handle_analyze_geographic(message, [])
-            category_result = await self._handle_category_statistics(message, params)
+            # 同時獲取地理和類別統計（兩個API互不相依，並行執行）
+            geographic_result, category_result = await asyncio.gather(
+                self.handle_analyze_geographic(message, []),
+                self._handle_category_statistics(message, params),
+                return_exceptions=True
+            )
+            if isinstance(geographic_result, Exception):
+                logger.error(f"Error in geographic part of comprehensive statistics: {str(geographic_result)}")
+                geographic_result = {}
+            if isinstance(category_result, Exception):
+                logger.error(f"Error in category part of comprehensive statistics: {str(category_result)}")
+                category_result = {}
             
-            response_message = "## 📈 綜合活動統計分析\n\n"
-            response_message += "### 🗺️ 地理分布概況\n"
+            # 直接以子處理器回傳的原始數據渲染各段落，不需解析已格式化的訊息
+            parts = ["## 📈 綜合活動統計分析\n\n", "### 🗺️ 地理分布概況\n"]
             if geographic_result.get("success"):
-                response_message += geographic_result["message"].split("### 📊 各城市活動數量分布")[1] if "### 📊 各城市活動數量分布" in geographic_result["message"] else "暫無地理分布數據\n"
+                geographic_data = (geographic_result.get("analysis_data") or {}).get("data")
+                parts.append(f"\n\n{self._render_geographic_section(geographic_data)}" if geographic_data else "暫無地理分布數據\n")
             
-            response_message += "\n### 🏷️ 類別分布概況\n"
+            parts.append("\n### 🏷️ 類別分布概況\n")
             if category_result.get("success"):
-                response_message += category_result["message"].split("### 各類別活動數量排行")[1] if "### 各類別活動數量排行" in category_result["message"] else "暫無類別分布數據\n"
+                category_data = category_result.get("statistics_data")
+                parts.append(f"\n\n{self._render_category_section(category_data)}" if category_data else "暫無類別分布數據\n")
             
             return self._create_success_response(
-                response_message,
+                "".join(parts),
                 "analyze_statistics",
                 comprehensive_data={
                     "geographic": geographic_result.get("analysis_data"),
@@ -254,4 +285,29 @@ class AnalysisHandler(BaseHandler):
                 "抱歉，分析綜合統計時發生錯誤。",
                 "analyze_statistics",
                 str(e)
-            ) 
\ No newline at end of file
+            ) 
+
+    def _render_geographic_section(self, data: List[Dict[str, Any]]) -> str:
+        """渲染各城市活動數量排行（前10名）與總計"""
+        # 只取前10個城市，不需排序全部數據
+        top_cities = heapq.nlargest(10, data, key=lambda x: x.get("value", 0))
+        parts = [
+            f"{i}. **{item.get('key', '未知城市')}**：{item.get('value', 0)} 個活動\n"
+            for i, item in enumerate(top_cities, 1)
+        ]
+        
+        # 計算總計
+        total_events = sum(item.get("value", 0) for item in data)
+        parts.append(f"\n**總計**：{total_events} 個活動分布在 {len(data)} 個城市\n")
+        return "".join(parts)
+
+    def _render_category_section(self, data: List[Dict[str, Any]]) -> str:
+        """渲染各類別活動數量排行（前10名）與總計"""
+        parts = [
+            f"{i}. **{item.get('key', '未知類別')}**：{item.get('value', 0)} 個活動\n"
+            for i, item in enumerate(data[:10], 1)
+        ]
+        
+        total_events = sum(item.get("value", 0) for item in data)
+        parts.append(f"\n**總計**：{total_events} 個活動分布在 {len(data)} 個類別\n")
+        return "".join(parts)
@@ -1,7 +1,67 @@
-from typing import Dict, Any, List, Optional
-from datetime import datetime
+from typing import Dict, Any, List, Optional, Tuple
+from datetime import datetime, timedelta
+import functools
+import re
+import time
 from sqlalchemy.orm import Session
 from utils.logger import logger
+from utils.keyword_matcher import KeywordMatcher
+
+# 城市列表（依優先順序）
+_CITIES = ("台北", "臺北", "新北", "桃園", "台中", "臺中", "台南", "臺南", "高雄", "基隆", "新竹", "苗栗", "彰化", "南投", "雲林", "嘉義", "屏東", "宜蘭", "花蓮", "台東", "臺東", "澎湖", "金門", "連江")
+
+# 活動類別關鍵字（依優先順序）
+_CATEGORY_KEYWORDS = (
+    ("運動", frozenset({"運動", "健身", "瑜伽", "跑步", "球類", "游泳"})),
+    ("音樂", frozenset({"音樂", "演唱會", "音樂會", "演出", "表演"})),
+    ("藝術", frozenset({"藝術", "展覽", "美術", "畫展", "藝文"})),
+    ("美食", frozenset({"美食", "餐廳", "料理", "烹飪", "品酒"})),
+    ("學習", frozenset({"學習", "講座", "課程", "工作坊", "研習"})),
+    ("親子", frozenset({"親子", "兒童", "家庭", "小孩"})),
+    ("戶外", frozenset({"戶外", "野餐", "露營", "踏青", "自然"})),
+)
+
+# 統計類型關鍵字（依優先順序）
+_STATISTICS_TYPE_KEYWORDS = (
+    ("geographic", frozenset({"地區", "城市", "地理", "分布"})),
+    ("category", frozenset({"類別", "分類", "種類"})),
+    ("temporal", frozenset({"時間", "月份", "趨勢"})),
+)
+
+# 活動識別符中需移除的問句詞彙；單字「的」改以 str.translate 移除
+_STOP_PATTERN = re.compile(r'(請問|查詢|詳情|資訊|活動)')
+_DROP_CHARS = str.maketrans('', '', '的')
+
+# 活動 ID：只接受明確標示的「活動ID：xxx」；活動名稱本身可能含有英數字（如 2024TIFF），不能視為 ID
+_EVENT_ID_RE = re.compile(r'活動\s*ID\s*[:：]\s*([A-Za-z0-9\-]+)', re.IGNORECASE)
+
+# 模組載入時預先編譯比對器，每則訊息只需掃描一次
+_CITY_MATCHER = KeywordMatcher((city, city) for city in _CITIES)
+_CATEGORY_MATCHER = KeywordMatcher(
+    (keyword, category) for category, keywords in _CATEGORY_KEYWORDS for keyword in keywords
+)
+_STATISTICS_TYPE_MATCHER = KeywordMatcher(
+    (keyword, stats_type) for stats_type, keywords in _STATISTICS_TYPE_KEYWORDS for keyword in keywords
+)
+
+# 回應字典範本：鍵的順序固定，每次回應只需複製後填值
+_SUCCESS_TEMPLATE = {"message": None, "intent": None, "success": True}
+_ERROR_TEMPLATE = {"message": None, "intent": None, "success": False}
+
+@functools.lru_cache(maxsize=128)
+def _compute_range(tag: str, minute_bucket: int) -> Tuple[int, int]:
+    """計算時間範圍（毫秒時間戳），以分鐘為單位快取，同一分鐘內的請求共用結果"""
+    now = datetime.fromtimestamp(minute_bucket * 60)
+    if tag == "this_month":
+        start = now.replace(day=1, hour=0, minute=0, second=0, microsecond=0)
+        end = now
+    elif tag == "last_month":
+        end = now.replace(day=1) - timedelta(days=1)
+        start = end.replace(day=1)
+    else:  # half_year
+        start = now - timedelta(days=180)
+        end = now
+    return int(start.timestamp() * 1000), int(end.timestamp() * 1000)
 
 class BaseHandler:
     """基礎處理器類，提供共同的工具方法和介面"""
@@ -25,28 +85,21 @@ class BaseHandler:
         
         # 提取時間範圍
         if "本月" in message:
-            now = datetime.now()
-            start_of_month = now.replace(day=1, hour=0, minute=0, second=0, microsecond=0)
-            params["from"] = int(start_of_month.timestamp() * 1000)
-            params["to"] = int(now.timestamp() * 1000)
+            tag = "this_month"
         elif "上個月" in message:
-            from datetime import timedelta
-            now = datetime.now()
-            start_of_last_month = (now.replace(day=1) - timedelta(days=1)).replace(day=1)
-            end_of_last_month = now.replace(day=1) - timedelta(days=1)
-            params["from"] = int(start_of_last_month.timestamp() * 1000)
-            params["to"] = int(end_of_last_month.timestamp() * 1000)
+            tag = "last_month"
         elif "半年" in message or "6個月" in message:
-            from datetime import timedelta
-            now = datetime.now()
-            six_months_ago = now - timedelta(days=180)
-            params["from"] = int(six_months_ago.timestamp() * 1000)
-            params["to"] = int(now.timestamp() * 1000)
+            tag = "half_year"
+        else:
+            tag = None
+        
+        if tag:
+            params["from"], params["to"] = _compute_range(tag, int(time.time() // 60))
         
         # 提取城市
-        cities = ["台北", "臺北", "新北", "桃園", "台中", "臺中", "台南", "臺南", "高雄", "基隆", "新竹", "苗栗", "彰化", "南投", "雲林", "嘉義", "屏東", "宜蘭", "花蓮", "台東", "臺東", "澎湖", "金門", "連江"]
-        for city in cities:
-            if city in message:
+        matched_cities = _CITY_MATCHER.labels(message)
+        for city in _CITIES:
+            if city in matched_cities:
                 params["city"] = city
                 break
         
@@ -54,60 +107,48 @@ class BaseHandler:
 
     async def _extract_category_from_message(self, message: str) -> str:
         """從訊息中提取活動類別"""
-        categories = {
-            "運動": ["運動", "健身", "瑜伽", "跑步", "球類", "游泳"],
-            "音樂": ["音樂", "演唱會", "音樂會", "演出", "表演"],
-            "藝術": ["藝術", "展覽", "美術", "畫展", "藝文"],
-            "美食": ["美食", "餐廳", "料理", "烹飪", "品酒"],
-            "學習": ["學習", "講座", "課程", "工作坊", "研習"],
-            "親子": ["親子", "兒童", "家庭", "小孩"],
-            "戶外": ["戶外", "野餐", "露營", "踏青", "自然"]
-        }
-        
-        for category, keywords in categories.items():
-            if any(keyword in message for keyword in keywords):
+        matched_categories = _CATEGORY_MATCHER.labels(message)
+        for category, _ in _CATEGORY_KEYWORDS:
+            if category in matched_categories:
                 return category
         
         return "全部"
 
     async def _extract_statistics_type(self, message: str) -> str:
         """從訊息中提取統計類型"""
-        if any(keyword in message for keyword in ["地區", "城市", "地理", "分布"]):
-            return "geographic"
-        elif any(keyword in message for keyword in ["類別", "分類", "種類"]):
-            return "category"
-        elif any(keyword in message for keyword in ["時間", "月份", "趨勢"]):
-            return "temporal"
-        else:
-            return "general"
+        matched_types = _STATISTICS_TYPE_MATCHER.labels(message)
+        for stats_type, _ in _STATISTICS_TYPE_KEYWORDS:
+            if stats_type in matched_types:
+                return stats_type
+        
+        return "general"
 
     async def _extract_event_identifier(self, message: str) -> str:
         """從訊息中提取活動識別符"""
-        import re
+        # 訊息中帶有活動 ID 時直接使用
+        match = _EVENT_ID_RE.search(message)
+        if match:
+            return match.group(1)
         
         # 移除常見的問句詞彙
-        cleaned_message = re.sub(r'(請問|查詢|詳情|資訊|活動|的)', '', message)
-        cleaned_message = cleaned_message.strip()
+        cleaned_message = _STOP_PATTERN.sub('', message).translate(_DROP_CHARS).strip()
         
         return cleaned_message if len(cleaned_message) > 2 else ""
 
     def _create_success_response(self, message: str, intent: str, **kwargs) -> Dict[str, Any]:
         """創建成功回應"""
-        response = {
-            "message": message,
-            "intent": intent,
-            "success": True
-        }
-        response.update(kwargs)
+        response = _SUCCESS_TEMPLATE.copy()
+        response["message"] = message
+        response["intent"] = intent
+        if kwargs:
+            response.update(kwargs)
         return response
 
     def _create_error_response(self, message: str, intent: str, error: str = None) -> Dict[str, Any]:
         """創建錯誤回應"""
-        response = {
-            "message": message,
-            "intent": intent,
-            "success": False
-        }
+        response = _ERROR_TEMPLATE.copy()
+        response["message"] = message
+        response["intent"] = intent
         if error:
             response["error"] = error
         return response 
\ No newline at end of file
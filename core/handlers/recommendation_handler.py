@@ -1,8 +1,73 @@
 from typing import Dict, Any, List, Optional
 from datetime import datetime
+import asyncio
+import functools
+import logging
+import re
+import time
+import orjson
 from .base_handler import BaseHandler
+from llm_handler import recommend_events
+from utils.config import REC_MAX_CONCURRENCY
 from utils.logger import logger
 
+# 活動比較的回應內容（各比較功能仍在開發中，內容固定）
+_COMPARISON_RESPONSES = {
+    "geographic": (
+        "## 🗺️ 地理活動比較分析\n\n"
+        "地理比較功能正在開發中，將提供以下功能：\n"
+        "- 不同城市活動數量對比\n"
+        "- 活動類型分布差異\n"
+        "- 熱門活動地點排行\n"
+        "- 地區活動特色分析\n"
+    ),
+    "temporal": (
+        "## 📅 時間活動比較分析\n\n"
+        "時間比較功能正在開發中，將提供以下功能：\n"
+        "- 不同月份活動數量對比\n"
+        "- 季節性活動趨勢分析\n"
+        "- 週末vs平日活動分布\n"
+        "- 節慶期間活動特色\n"
+    ),
+    "category": (
+        "## 🏷️ 類別活動比較分析\n\n"
+        "類別比較功能正在開發中，將提供以下功能：\n"
+        "- 不同活動類型數量對比\n"
+        "- 各類別活動熱門程度\n"
+        "- 類別間參與者特徵分析\n"
+        "- 跨類別活動推薦\n"
+    ),
+    "general": (
+        "## 📊 綜合活動比較分析\n\n"
+        "綜合比較功能正在開發中，將提供以下功能：\n"
+        "- 多維度活動對比分析\n"
+        "- 活動相似度計算\n"
+        "- 個人化比較建議\n"
+        "- 活動選擇決策支援\n"
+    ),
+}
+
+# 比較類型關鍵字，以具名群組一次掃描分類
+_CMP_TYPE_RE = re.compile(r"(?P<geographic>地區|城市)|(?P<temporal>時間|月份|年份)|(?P<category>類別|種類)")
+# 同時命中多種類型時的優先順序
+_CMP_TYPE_PRIORITY = ("geographic", "temporal", "category")
+
+# 所有請求共用的推薦API並行上限，避免突發流量壓垮下游服務
+_rec_semaphore = asyncio.Semaphore(REC_MAX_CONCURRENCY)
+# 目前進行中（含等待中）的推薦請求數，供觀察負載使用
+_rec_in_flight = 0
+
+# 進行中的推薦請求：參數相同的並行請求共用同一次API呼叫
+_rec_pending: Dict[bytes, asyncio.Task] = {}
+
+# 推薦回應的固定標頭；固定內容放在最前面，動態的活動清單接在後面，讓前綴每次都完全相同
+_REC_HEADER = "## 🎯 為您推薦的活動\n\n"
+
+@functools.lru_cache(maxsize=4096)
+def _fmt_start_time(ts_ms: int) -> str:
+    """將毫秒時間戳格式化為顯示用的本地時間，熱門活動重複出現時直接取用快取"""
+    return datetime.fromtimestamp(ts_ms / 1000).strftime('%Y-%m-%d %H:%M')
+
 class RecommendationHandler(BaseHandler):
     """推薦處理器，處理個人化推薦和活動比較功能"""
     
@@ -17,46 +82,70 @@ class RecommendationHandler(BaseHandler):
             # 結合用戶畫像和訊息內容生成推薦參數
             recommendation_params = await self._build_recommendation_params(message, user_profile)
             
-            # 調用推薦API
-            from llm_handler import recommend_events
-            result = await recommend_events(recommendation_params)
+            # 調用推薦API（相同請求合併，並受共用並行上限限制）
+            result = await self._recommend_events_coalesced(recommendation_params)
             
             # 構建回應
-            response_message = "## 🎯 為您推薦的活動\n\n"
+            parts = []
             
             if result.get("events"):
-                response_message += f"根據您的偏好，為您找到 {len(result['events'])} 個推薦活動：\n\n"
+                parts.append(f"根據您的偏好，為您找到 {len(result['events'])} 個推薦活動：\n\n")
                 
                 for i, event in enumerate(result["events"][:5], 1):  # 只顯示前5個
-                    response_message += f"### {i}. {event.get('name', '未知活動')}\n"
+                    parts.append(f"### {i}. {event.get('name', '未知活動')}\n")
                     if event.get('start_time'):
-                        start_date = datetime.fromtimestamp(event['start_time'] / 1000)
-                        response_message += f"📅 **時間**：{start_date.strftime('%Y-%m-%d %H:%M')}\n"
+                        parts.append(f"📅 **時間**：{_fmt_start_time(event['start_time'])}\n")
                     if event.get('location'):
-                        response_message += f"📍 **地點**：{event['location']}\n"
+                        parts.append(f"📍 **地點**：{event['location']}\n")
                     if event.get('category'):
-                        response_message += f"🏷️ **類別**：{event['category']}\n"
+                        parts.append(f"🏷️ **類別**：{event['category']}\n")
                     if event.get('link'):
-                        response_message += f"🔗 **詳情**：[點擊查看]({event['link']})\n"
-                    response_message += "\n"
+                        parts.append(f"🔗 **詳情**：[點擊查看]({event['link']})\n")
+                    parts.append("\n")
             else:
-                response_message += "抱歉，目前沒有找到符合您偏好的活動，請嘗試調整搜尋條件。"
+                parts.append("抱歉，目前沒有找到符合您偏好的活動，請嘗試調整搜尋條件。")
             
             return self._create_success_response(
-                response_message,
+                _REC_HEADER + "".join(parts),
                 "get_recommendations",
                 events=result,
                 recommendation_params=recommendation_params
             )
             
         except Exception as e:
-            logger.error(f"Error handling get recommendations: {str(e)}", exc_info=True)
+            logger.error("Error handling get recommendations: %s", e, exc_info=logger.isEnabledFor(logging.DEBUG))
             return self._create_error_response(
                 "抱歉，獲取推薦活動時發生錯誤，請稍後再試。",
                 "get_recommendations",
                 str(e)
             )
 
+    async def _recommend_events_coalesced(self, params: Dict[str, Any]) -> Dict[str, Any]:
+        """合併參數相同的並行推薦請求，只對下游發出一次呼叫"""
+        key = orjson.dumps(params, option=orjson.OPT_SORT_KEYS)
+        task = _rec_pending.get(key)
+        if task is None:
+            task = asyncio.create_task(self._recommend_events_limited(params))
+            _rec_pending[key] = task
+            task.add_done_callback(lambda _: _rec_pending.pop(key, None))
+        else:
+            logger.info("Joining in-flight recommendation request with identical parameters")
+        
+        # 單一等待者被取消時不影響共用的呼叫
+        return await asyncio.shield(task)
+
+    async def _recommend_events_limited(self, params: Dict[str, Any]) -> Dict[str, Any]:
+        """在共用並行上限內呼叫推薦API"""
+        global _rec_in_flight
+        _rec_in_flight += 1
+        try:
+            if _rec_in_flight > REC_MAX_CONCURRENCY:
+                logger.info("Recommendation requests in flight: %d, waiting for a free slot", _rec_in_flight)
+            async with _rec_semaphore:
+                return await recommend_events(params)
+        finally:
+            _rec_in_flight -= 1
+
     async def handle_compare_events(
         self, 
         message: str, 
@@ -67,18 +156,11 @@ class RecommendationHandler(BaseHandler):
             # 提取比較參數
             comparison_params = await self._extract_comparison_params(message)
             
-            # 根據比較類型執行不同的比較邏輯
-            if comparison_params.get("type") == "geographic":
-                return await self._compare_geographic_events(comparison_params)
-            elif comparison_params.get("type") == "temporal":
-                return await self._compare_temporal_events(comparison_params)
-            elif comparison_params.get("type") == "category":
-                return await self._compare_category_events(comparison_params)
-            else:
-                return await self._general_event_comparison(comparison_params)
+            # 根據比較類型回傳對應的比較內容
+            return self._comparison_response(comparison_params.get("type", "general"))
                 
         except Exception as e:
-            logger.error(f"Error handling compare events: {str(e)}", exc_info=True)
+            logger.error("Error handling compare events: %s", e, exc_info=logger.isEnabledFor(logging.DEBUG))
             return self._create_error_response(
                 "抱歉，比較活動時發生錯誤，請稍後再試。",
                 "compare_events",
@@ -91,30 +173,30 @@ class RecommendationHandler(BaseHandler):
         user_profile: Dict[str, Any] = None
     ) -> Dict[str, Any]:
         """構建推薦參數"""
-        params = {
-            "num": 10,
-            "sort": "start_time",
-            "asc": True
-        }
-        
-        # 從用戶畫像中提取偏好
-        if user_profile:
-            interests = user_profile.get("interests", [])
-            if interests:
-                # 取第一個興趣作為類別
-                first_interest = interests[0]
-                if isinstance(first_interest, dict):
-                    params["category"] = first_interest.get("interest", "")
-                else:
-                    params["category"] = str(first_interest)
+        # 從用戶畫像中提取偏好（純記憶體運算，不需等待）
+        params = self._build_params_from_profile(user_profile)
         
         # 從訊息中提取額外參數
         analysis_params = await self._extract_analysis_params(message)
         params.update(analysis_params)
         
-        # 設置時間範圍為未來活動
+        # 設置時間範圍為未來活動（取整到秒，讓同一秒內的相同請求可以合併）
         if "from" not in params:
-            params["from"] = int(datetime.now().timestamp() * 1000)
+            params["from"] = int(time.time()) * 1000
+        
+        return params
+
+    def _build_params_from_profile(self, user_profile: Dict[str, Any] = None) -> Dict[str, Any]:
+        """根據用戶畫像構建基本推薦參數"""
+        params = {
+            "num": 10,
+            "sort": "start_time",
+            "asc": True
+        }
+        
+        # 取第一個興趣作為類別（興趣名稱已在載入用戶畫像時正規化）
+        if user_profile and (interest_names := user_profile.get("interest_names")):
+            params["category"] = interest_names[0]
         
         return params
 
@@ -122,112 +204,20 @@ class RecommendationHandler(BaseHandler):
         """提取比較參數"""
         params = {"type": "general"}
         
-        if any(keyword in message for keyword in ["地區", "城市"]):
-            params["type"] = "geographic"
-        elif any(keyword in message for keyword in ["時間", "月份", "年份"]):
-            params["type"] = "temporal"
-        elif any(keyword in message for keyword in ["類別", "種類"]):
-            params["type"] = "category"
+        matched_types = {match.lastgroup for match in _CMP_TYPE_RE.finditer(message)}
+        for comparison_type in _CMP_TYPE_PRIORITY:
+            if comparison_type in matched_types:
+                params["type"] = comparison_type
+                break
         
         return params
 
-    async def _compare_geographic_events(self, params: Dict[str, Any]) -> Dict[str, Any]:
-        """比較不同地區的活動"""
-        try:
-            # 實現地理比較邏輯
-            # 這裡可以調用地理分析API來獲取不同城市的數據進行比較
-            response_message = "## 🗺️ 地理活動比較分析\n\n"
-            response_message += "地理比較功能正在開發中，將提供以下功能：\n"
-            response_message += "- 不同城市活動數量對比\n"
-            response_message += "- 活動類型分布差異\n"
-            response_message += "- 熱門活動地點排行\n"
-            response_message += "- 地區活動特色分析\n"
-            
-            return self._create_success_response(
-                response_message,
-                "compare_events",
-                comparison_type="geographic"
-            )
-            
-        except Exception as e:
-            logger.error(f"Error in geographic comparison: {str(e)}")
-            return self._create_error_response(
-                "地理比較分析時發生錯誤。",
-                "compare_events",
-                str(e)
-            )
-
-    async def _compare_temporal_events(self, params: Dict[str, Any]) -> Dict[str, Any]:
-        """比較不同時間的活動"""
-        try:
-            # 實現時間比較邏輯
-            response_message = "## 📅 時間活動比較分析\n\n"
-            response_message += "時間比較功能正在開發中，將提供以下功能：\n"
-            response_message += "- 不同月份活動數量對比\n"
-            response_message += "- 季節性活動趨勢分析\n"
-            response_message += "- 週末vs平日活動分布\n"
-            response_message += "- 節慶期間活動特色\n"
-            
-            return self._create_success_response(
-                response_message,
-                "compare_events",
-                comparison_type="temporal"
-            )
-            
-        except Exception as e:
-            logger.error(f"Error in temporal comparison: {str(e)}")
-            return self._create_error_response(
-                "時間比較分析時發生錯誤。",
-                "compare_events",
-                str(e)
-            )
-
-    async def _compare_category_events(self, params: Dict[str, Any]) -> Dict[str, Any]:
-        """比較不同類別的活動"""
-        try:
-            # 實現類別比較邏輯
-            response_message = "## 🏷️ 類別活動比較分析\n\n"
-            response_message += "類別比較功能正在開發中，將提供以下功能：\n"
-            response_message += "- 不同活動類型數量對比\n"
-            response_message += "- 各類別活動熱門程度\n"
-            response_message += "- 類別間參與者特徵分析\n"
-            response_message += "- 跨類別活動推薦\n"
-            
-            return self._create_success_response(
-                response_message,
-                "compare_events",
-                comparison_type="category"
-            )
-            
-        except Exception as e:
-            logger.error(f"Error in category comparison: {str(e)}")
-            return self._create_error_response(
-                "類別比較分析時發生錯誤。",
-                "compare_events",
-                str(e)
-            )
-
-    async def _general_event_comparison(self, params: Dict[str, Any]) -> Dict[str, Any]:
-        """一般活動比較"""
-        try:
-            # 實現一般比較邏輯
-            response_message = "## 📊 綜合活動比較分析\n\n"
-            response_message += "綜合比較功能正在開發中，將提供以下功能：\n"
-            response_message += "- 多維度活動對比分析\n"
-            response_message += "- 活動相似度計算\n"
-            response_message += "- 個人化比較建議\n"
-            response_message += "- 活動選擇決策支援\n"
-            
-            return self._create_success_response(
-                response_message,
-                "compare_events",
-                comparison_type="general"
-            )
-            
-        except Exception as e:
-            logger.error(f"Error in general comparison: {str(e)}")
-            return self._create_error_response(
-                "綜合比較分析時發生錯誤。",
-                "compare_events",
-                str(e)
-            ) 
\ No newline at end of file
+    def _comparison_response(self, kind: str) -> Dict[str, Any]:
+        """根據比較類型建立比較回應，未知類型視為綜合比較"""
+        if kind not in _COMPARISON_RESPONSES:
+            kind = "general"
+        return self._create_success_response(
+            _COMPARISON_RESPONSES[kind],
+            "compare_events",
+            comparison_type=kind
+        )
@@ -1,11 +1,59 @@
-from typing import Dict, Any, List, Optional
+from typing import Dict, Any, List, Optional, Tuple
+import asyncio
+import threading
 from datetime import datetime
+from types import MappingProxyType
 from sqlalchemy.orm import Session
+from cachetools import TTLCache
 
 from .base_handler import BaseHandler
 from tools.search_tools import SearchParamsExtractor, EventSearchService
+from llm_handler import recommend_events
 from utils.logger import logger
 
+# 活動列表項目的渲染快取，鍵為 (活動 ID 或連結, 更新時間, 開始日期, 結束日期)
+_EVENT_RENDER_CACHE = TTLCache(maxsize=10_000, ttl=600)
+# 大頁面會在執行緒中格式化，快取存取需加鎖
+_EVENT_RENDER_LOCK = threading.Lock()
+
+# 活動數達到此門檻時改在執行緒中格式化；小頁面切換執行緒的成本反而較高
+_OFFLOAD_MIN_EVENTS = 20
+
+# 搜尋結果標題與摘要；不計算總數時只顯示本頁數量
+_HEADER_TEMPLATE = "## 搜尋結果\n\n共找到 {total} 個活動，本頁顯示 {current} 個活動\n"
+_PAGE_ONLY_HEADER_TEMPLATE = "## 搜尋結果\n\n本頁顯示 {current} 個活動\n"
+
+def _search_header(total: Optional[int], current: int) -> str:
+    """產生搜尋結果的標題與摘要，total 為 None 表示未計算總數"""
+    if total is None:
+        return _PAGE_ONLY_HEADER_TEMPLATE.format_map({'current': current})
+    return _HEADER_TEMPLATE.format_map({'total': total, 'current': current})
+
+# 排序欄位的顯示名稱
+_SORT_DISPLAY = MappingProxyType({
+    '_score': '相關度',
+    'start_time': '開始時間',
+    'end_time': '結束時間',
+    'updated_time': '更新時間',
+    'distance': '距離'
+})
+
+def _format_date_param(timestamp: int) -> str:
+    """將毫秒時間戳格式化為日期字串"""
+    return datetime.fromtimestamp(timestamp / 1000).strftime('%Y-%m-%d')
+
+# 搜尋條件的顯示順序：(參數名稱, 顯示標籤, 值的轉換函式)
+_PARAM_FORMATTERS = (
+    ('query', '🔍 關鍵字', str),
+    ('city', '📍 城市', str),
+    ('category', '🏷️ 類別', str),
+    ('from', '📅 開始日期', _format_date_param),
+    ('to', '📅 結束日期', _format_date_param),
+    ('type', '📋 活動類型', str),
+    ('sort', '↕️ 排序方式', lambda sort: _SORT_DISPLAY.get(sort, sort)),
+    ('asc', '↕️ 排序方向', lambda asc: '升序' if asc else '降序'),
+)
+
 class SearchHandler(BaseHandler):
     """搜尋處理器，處理活動搜尋和詳情查詢"""
     
@@ -42,27 +90,11 @@ class SearchHandler(BaseHandler):
             logger.info(f"Current page count: {current_page_count}")
             
             # 構建回應
-            response_parts = [
-                f"## 搜尋結果\n",
-                f"共找到 {pagination.get('total_events', 0)} 個活動，本頁顯示 {current_page_count} 個活動\n"
-            ]
-            
-            # 添加搜尋條件
-            formatted_params = self._format_search_params(extracted_params)
-            
-            # 添加活動列表
-            if result.get("events"):
-                response_parts.append("\n### 活動列表\n")
-                for i, event in enumerate(result["events"], 1):
-                    event_info = self._format_event_info(i, event)
-                    response_parts.append(event_info)
-            
-            # 組合最終回應
-            final_response = "\n".join(response_parts)
-            
-            # 添加搜尋條件到最終回應
-            if formatted_params:
-                final_response += "\n\n### 搜尋條件\n" + "\n".join(formatted_params)
+            final_response = await self._render_search_results_async(
+                _search_header(pagination.get('total_events', 0), current_page_count),
+                result.get("events"),
+                extracted_params
+            )
             
             # 構建符合 main.py 期望的回應格式
             return self._create_success_response(
@@ -103,7 +135,6 @@ class SearchHandler(BaseHandler):
                 "num": 1
             }
             
-            from llm_handler import recommend_events
             result = await recommend_events(search_params)
             
             if result.get("events") and len(result["events"]) > 0:
@@ -135,9 +166,20 @@ class SearchHandler(BaseHandler):
     async def direct_search_events(
         self,
         page: int = 1,
-        search_params: Optional[Dict[str, Any]] = None
+        search_params: Optional[Dict[str, Any]] = None,
+        after_start_time: Optional[int] = None,
+        include_total: bool = True,
+        after_ids: Optional[List[str]] = None
     ) -> Dict[str, Any]:
-        """直接搜尋活動，不需要處理訊息"""
+        """
+        直接搜尋活動，不需要處理訊息
+        
+        after_start_time / after_ids: 游標分頁，取開始時間不早於 after_start_time 的活動（依開始時間升序），
+            並略過 after_ids 中在該時間已回傳過的活動；翻到深頁時不需重新掃描前面的頁面
+        include_total: 為 False 時改用游標分頁且不計算總數，分頁資訊以 has_more / next_cursor 表示
+        
+        三個游標參數也可以放在 search_params 中（/api/chat 即以此方式傳入），不會送往 EventGO API
+        """
         try:
             logger.info(f"Direct search events - page: {page}, search_params: {search_params}")
             
@@ -151,23 +193,36 @@ class SearchHandler(BaseHandler):
                     'from': int(datetime.now().timestamp() * 1000)
                 }
             
+            # 取出游標參數，明確傳入的引數優先
+            cursor_start = search_params.pop('after_start_time', None)
+            cursor_ids = search_params.pop('after_ids', None)
+            total_flag = search_params.pop('include_total', None)
+            if after_start_time is None:
+                after_start_time = cursor_start
+            if after_ids is None:
+                after_ids = cursor_ids
+            if total_flag is not None:
+                include_total = bool(total_flag)
+            keyset = after_start_time is not None or not include_total
+            
             # 設置分頁參數
-            search_params['p'] = page
             search_params['num'] = search_params.get('num', 5)
-            
-            logger.info(f"Final search params for direct search: {search_params}")
-            
-            # 直接調用 recommend_events
-            from llm_handler import recommend_events
-            result = await recommend_events(search_params)
-            logger.info(f"Direct search result structure: {type(result)}")
-            
-            # 獲取分頁信息
-            pagination = result.get("pagination", {})
-            logger.info(f"Direct search pagination data: {pagination}")
+            if keyset:
+                result, pagination = await self._keyset_search(search_params, after_start_time, after_ids)
+            else:
+                search_params['p'] = page
+                logger.info(f"Final search params for direct search: {search_params}")
+                
+                # 直接調用 recommend_events
+                result = await recommend_events(search_params)
+                logger.info(f"Direct search result structure: {type(result)}")
+                
+                # 獲取分頁信息
+                pagination = result.get("pagination", {})
+                logger.info(f"Direct search pagination data: {pagination}")
             
             # 如果沒有分頁數據，創建默認的分頁數據
-            if not pagination or pagination.get('total_events', 0) == 0:
+            if not keyset and (not pagination or pagination.get('total_events', 0) == 0):
                 events_count = len(result.get("events", []))
                 total_events = result.get("count", events_count)
                 pagination = {
@@ -184,27 +239,8 @@ class SearchHandler(BaseHandler):
             logger.info(f"Direct search current page count: {current_page_count}")
             
             # 構建詳細回應
-            response_parts = [
-                f"## 搜尋結果\n",
-                f"共找到 {pagination.get('total_events', 0)} 個活動，本頁顯示 {current_page_count} 個活動\n"
-            ]
-            
-            # 添加搜尋條件
-            formatted_params = self._format_search_params(search_params)
-            
-            # 添加活動列表
-            if result.get("events"):
-                response_parts.append("\n### 活動列表\n")
-                for i, event in enumerate(result["events"], 1):
-                    event_info = self._format_event_info(i, event)
-                    response_parts.append(event_info)
-            
-            # 組合最終回應
-            final_response = "\n".join(response_parts)
-            
-            # 添加搜尋條件到最終回應
-            if formatted_params:
-                final_response += "\n\n### 搜尋條件\n" + "\n".join(formatted_params)
+            header = _search_header(None if keyset else pagination.get('total_events', 0), current_page_count)
+            final_response = await self._render_search_results_async(header, result.get("events"), search_params)
             
             # 構建回應格式
             return self._create_success_response(
@@ -223,68 +259,176 @@ class SearchHandler(BaseHandler):
                 str(e)
             )
     
+    async def _keyset_search(
+        self,
+        search_params: Dict[str, Any],
+        after_start_time: Optional[int],
+        after_ids: Optional[List[str]]
+    ) -> Tuple[Dict[str, Any], Dict[str, Any]]:
+        """
+        以 (開始時間, 活動 ID) 為游標取得一頁活動
+        
+        開始時間不是唯一值，因此游標包含該時間並略過已回傳的活動 ID；多取一筆用來判斷是否還有下一頁
+        """
+        num = search_params['num']
+        skip_ids = set(after_ids or ()) if after_start_time is not None else set()
+        api_params = {
+            **search_params,
+            'timeKey': 'start_time',
+            'sort': 'start_time',
+            'asc': True,
+            'p': 1,
+            'num': num + len(skip_ids) + 1
+        }
+        if after_start_time is not None:
+            api_params['from'] = after_start_time
+        logger.info(f"Final search params for keyset search: {api_params}")
+        
+        result = await recommend_events(api_params)
+        fetched = [event for event in result.get("events", []) if event.get('id') not in skip_ids]
+        events = fetched[:num]
+        has_more = len(fetched) > num
+        
+        next_cursor = None
+        if has_more:
+            last_start = events[-1].get('start_time')
+            boundary_ids = [event.get('id') for event in events if event.get('start_time') == last_start]
+            # 整頁都停在同一個開始時間時，先前略過的活動也要繼續略過
+            if last_start == after_start_time:
+                boundary_ids = list(skip_ids) + boundary_ids
+            next_cursor = {'after_start_time': last_start, 'after_ids': boundary_ids}
+        
+        pagination = {
+            'events_per_page': num,
+            'total_events': None,
+            'current_page_count': len(events),
+            'has_more': has_more,
+            'next_cursor': next_cursor
+        }
+        return {**result, 'events': events, 'pagination': pagination}, pagination
+    
+    async def _render_search_results_async(
+        self,
+        header: str,
+        events: Optional[List[Dict[str, Any]]],
+        params: Dict[str, Any]
+    ) -> str:
+        """組合搜尋結果訊息；大頁面移到執行緒處理，避免阻塞事件迴圈上的其他對話"""
+        if events and len(events) >= _OFFLOAD_MIN_EVENTS:
+            return await asyncio.to_thread(self._render_search_results, header, events, params)
+        return self._render_search_results(header, events, params)
+    
+    def _render_search_results(
+        self,
+        header: str,
+        events: Optional[List[Dict[str, Any]]],
+        params: Dict[str, Any]
+    ) -> str:
+        """組合搜尋結果訊息：標題摘要、活動列表與搜尋條件，最後只做一次 join"""
+        response_parts = [header]
+        
+        # 添加活動列表
+        if events:
+            response_parts.append("\n### 活動列表\n")
+            start_strs, end_strs = self._format_event_dates(events)
+            for i, event in enumerate(events, 1):
+                response_parts.append(self._format_event_info(i, event, start_strs[i - 1], end_strs[i - 1]))
+        
+        # 添加搜尋條件
+        formatted_params = self._format_search_params(params)
+        if formatted_params:
+            response_parts.append("\n### 搜尋條件")
+            response_parts.extend(formatted_params)
+        
+        return "\n".join(response_parts)
+    
     def _format_search_params(self, params: Dict[str, Any]) -> List[str]:
         """格式化搜尋參數"""
         formatted_params = []
         
-        if 'query' in params:
-            formatted_params.append(f"🔍 關鍵字：{params['query']}")
-        if 'city' in params:
-            formatted_params.append(f"📍 城市：{params['city']}")
-        if 'category' in params:
-            formatted_params.append(f"🏷️ 類別：{params['category']}")
-        if 'from' in params:
-            try:
-                from_date = datetime.fromtimestamp(params['from'] / 1000)
-                formatted_params.append(f"📅 開始日期：{from_date.strftime('%Y-%m-%d')}")
-            except Exception as e:
-                logger.error(f"Error formatting from date: {str(e)}")
-        if 'to' in params:
-            try:
-                to_date = datetime.fromtimestamp(params['to'] / 1000)
-                formatted_params.append(f"📅 結束日期：{to_date.strftime('%Y-%m-%d')}")
-            except Exception as e:
-                logger.error(f"Error formatting to date: {str(e)}")
-        if 'type' in params:
-            formatted_params.append(f"📋 活動類型：{params['type']}")
-        if 'sort' in params:
-            sort_display = {
-                '_score': '相關度',
-                'start_time': '開始時間',
-                'end_time': '結束時間',
-                'updated_time': '更新時間',
-                'distance': '距離'
-            }.get(params['sort'], params['sort'])
-            formatted_params.append(f"↕️ 排序方式：{sort_display}")
-        if 'asc' in params:
-            formatted_params.append(f"↕️ 排序方向：{'升序' if params['asc'] else '降序'}")
+        for key, label, transform in _PARAM_FORMATTERS:
+            if key in params:
+                try:
+                    formatted_params.append(f"{label}：{transform(params[key])}")
+                except Exception as e:
+                    logger.error(f"Error formatting {key} param: {str(e)}")
         
         return formatted_params
     
-    def _format_event_info(self, index: int, event: Dict[str, Any]) -> str:
-        """格式化單個活動信息"""
+    def _format_event_dates(self, events: List[Dict[str, Any]]) -> Tuple[List[Optional[str]], List[Optional[str]]]:
+        """
+        一次轉換整頁活動的開始/結束日期字串
+        同一頁的時間戳常有重複，每個不同的時間戳只轉換一次；無法轉換的時間戳對應 None
+        """
+        date_strs: Dict[Any, Optional[str]] = {}
+        for event in events:
+            for key in ("start_time", "end_time"):
+                ts = event.get(key)
+                if ts and ts not in date_strs:
+                    try:
+                        date_strs[ts] = datetime.fromtimestamp(ts / 1000).strftime('%Y-%m-%d')
+                    except Exception as e:
+                        logger.error(f"Error formatting event date: {str(e)}")
+                        date_strs[ts] = None
+        
+        start_strs = [date_strs.get(event.get("start_time")) for event in events]
+        end_strs = [date_strs.get(event.get("end_time")) for event in events]
+        return start_strs, end_strs
+    
+    def _format_event_info(
+        self,
+        index: int,
+        event: Dict[str, Any],
+        start_str: Optional[str] = None,
+        end_str: Optional[str] = None
+    ) -> str:
+        """
+        格式化單個活動信息（日期字串由 _format_event_dates 預先轉換）
+        熱門活動常在不同頁面與用戶間重複出現，不含序號的內容依活動 ID 與更新時間快取
+        """
+        identity = event.get("id") or event.get("link")
+        if identity:
+            key = (identity, event.get("updated_time"), start_str, end_str)
+            with _EVENT_RENDER_LOCK:
+                rendered = _EVENT_RENDER_CACHE.get(key)
+            if rendered is None:
+                rendered = self._render_event_info(event, start_str, end_str)
+                if rendered is not None:
+                    with _EVENT_RENDER_LOCK:
+                        _EVENT_RENDER_CACHE[key] = rendered
+        else:
+            rendered = self._render_event_info(event, start_str, end_str)
+        
+        if rendered is None:
+            return f"{index}. 活動信息格式化錯誤"
+        
+        heading, details = rendered
+        return f"{index}. {heading}\n{details}" if heading else details
+    
+    def _render_event_info(
+        self,
+        event: Dict[str, Any],
+        start_str: Optional[str],
+        end_str: Optional[str]
+    ) -> Optional[Tuple[str, str]]:
+        """產生活動的標題（不含序號）與明細行，格式化失敗時回傳 None"""
         try:
-            event_parts = []
-            
             # 活動名稱和連結
             title = event.get("name", "")
             link = event.get("link", "")
             if title and link:
-                event_parts.append(f"{index}. [{title}]({link})")
-            elif title:
-                event_parts.append(f"{index}. {title}")
+                heading = f"[{title}]({link})"
+            else:
+                heading = title
+            
+            event_parts = []
             
             # 日期時間
-            if event.get("start_time"):
-                try:
-                    start_date = datetime.fromtimestamp(event['start_time'] / 1000)
-                    date_str = f"   - 活動日期：{start_date.strftime('%Y-%m-%d')}"
-                    if event.get("end_time"):
-                        end_date = datetime.fromtimestamp(event['end_time'] / 1000)
-                        date_str += f" 至 {end_date.strftime('%Y-%m-%d')}"
-                    event_parts.append(date_str)
-                except Exception as e:
-                    logger.error(f"Error formatting event date: {str(e)}")
+            if start_str:
+                date_str = f"   - 活動日期：{start_str}"
+                if end_str:
+                    date_str += f" 至 {end_str}"
+                event_parts.append(date_str)
             
             # 地點
             has_location = False
@@ -327,11 +471,11 @@ class SearchHandler(BaseHandler):
             else:
                 event_parts.append("   - 適合年齡：未提供")
             
-            return "\n".join(event_parts)
+            return heading, "\n".join(event_parts)
             
         except Exception as e:
-            logger.error(f"Error formatting event {index}: {str(e)}")
-            return f"{index}. 活動信息格式化錯誤"
+            logger.error(f"Error formatting event {event.get('id')}: {str(e)}")
+            return None
     
     def _format_event_details(self, event: Dict[str, Any]) -> str:
         """格式化活動詳情"""
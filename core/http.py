@@ -0,0 +1,14 @@
+"""
+共用的 HTTP 客戶端
+所有處理器共用同一個連線池，避免每次請求重新建立 TCP/TLS 連線
+"""
+
+import httpx
+
+# 啟用 HTTP/2 與 keep-alive 連線池，讓並行的分析請求共用連線
+shared_http_client = httpx.AsyncClient(
+    verify=False,  # Disable SSL verification for local development
+    timeout=httpx.Timeout(10.0, connect=3.0),
+    limits=httpx.Limits(max_keepalive_connections=50, max_connections=200, keepalive_expiry=60),
+    http2=True
+)
@@ -1,5 +1,5 @@
 from typing import List, Dict, Any, Optional, Callable, Awaitable
-from pydantic import BaseModel
+from pydantic import BaseModel, ConfigDict, Field
 
 class ConversationContext(BaseModel):
     """對話上下文管理"""
@@ -11,18 +11,13 @@ class ConversationContext(BaseModel):
     follow_up_questions: List[str] = []
 
 class Tool(BaseModel):
+    # 工具定義建立後不再變動，凍結後可安全地在多個 Agent 之間共用
+    model_config = ConfigDict(frozen=True, arbitrary_types_allowed=True)
+
     name: str
     description: str
     parameters: Dict[str, Any]
-    handler: Optional[Callable[[Dict[str, Any]], Awaitable[Dict[str, Any]]]] = None
+    # 處理函式不參與序列化
+    handler: Optional[Callable[[Dict[str, Any]], Awaitable[Dict[str, Any]]]] = Field(default=None, exclude=True)
     priority: int = 1  # 工具優先級
     category: str = "general"  # 工具分類
-
-    def dict(self, *args, **kwargs):
-        """
-        重寫 dict 方法，排除方法屬性
-        """
-        d = super().dict(*args, **kwargs)
-        # 移除方法屬性
-        d.pop('handler', None)
-        return d 
\ No newline at end of file
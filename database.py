@@ -1,21 +1,50 @@
-from sqlalchemy import create_engine, Column, Integer, String, DateTime, Text, ForeignKey, Float, JSON, Boolean
+from sqlalchemy import BigInteger, Column, Integer, String, Text, ForeignKey, Float, JSON, Boolean, Index, delete, insert, select, text, update
+from sqlalchemy import inspect
+from sqlalchemy.dialects.postgresql import JSONB, insert as postgresql_insert
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker
 from sqlalchemy.ext.declarative import declarative_base
-from sqlalchemy.orm import sessionmaker, relationship
-from datetime import datetime
-from utils.config import DATABASE_URL
+from sqlalchemy.orm import relationship
+from datetime import datetime, timezone
+import time
+from utils.config import ASYNC_DATABASE_URL, DB_POOL_SIZE, DB_MAX_OVERFLOW
 import uuid
 import re
 from typing import List, Dict, Any, Optional
 
-# Create SQLAlchemy engine
-engine = create_engine(DATABASE_URL)
+# 連線池設定；aiosqlite 由 SQLAlchemy 自行選擇連線池，不接受 pool_size 等參數
+_engine_options = {"pool_pre_ping": True}
+if not ASYNC_DATABASE_URL.startswith("sqlite"):
+    _engine_options.update(pool_size=DB_POOL_SIZE, max_overflow=DB_MAX_OVERFLOW)
+
+# Create SQLAlchemy async engine（資料庫 I/O 不再阻塞事件迴圈）
+engine = create_async_engine(ASYNC_DATABASE_URL, **_engine_options)
 
 # Create session factory
-SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+# 提交後不使物件過期，避免在非同步環境中觸發隱式的延遲載入
+SessionLocal = async_sessionmaker(engine, autoflush=False, expire_on_commit=False)
+
+# 支援 INSERT ... ON CONFLICT 的方言專用 insert（SQLite 與 PostgreSQL）
+_upsert_insert = postgresql_insert if engine.dialect.name == "postgresql" else sqlite_insert
 
 # Create base class for models
 Base = declarative_base()
 
+# 時間欄位一律以 UTC 毫秒時間戳（BigInteger）儲存，與活動資料的時間格式一致
+
+# 彈性 JSON 欄位；PostgreSQL 上使用 JSONB，可建立 GIN 索引讓 @> 等查詢走索引
+_JSONData = JSON().with_variant(JSONB(), "postgresql")
+
+def now_ms() -> int:
+    """目前的 UTC 毫秒時間戳"""
+    return int(time.time() * 1000)
+
+def ms_to_iso(timestamp_ms: Optional[int]) -> Optional[str]:
+    """將毫秒時間戳轉為 ISO 8601 字串（UTC），供 API 回應使用"""
+    if timestamp_ms is None:
+        return None
+    return datetime.fromtimestamp(timestamp_ms / 1000, tz=timezone.utc).isoformat()
+
 class ChatSession(Base):
     __tablename__ = "chat_sessions"
 
@@ -23,11 +52,22 @@ class ChatSession(Base):
     session_id = Column(String(50), unique=True, index=True)
     ip_address = Column(String(50), index=True)
     message_count = Column(Integer, default=0)
-    created_at = Column(DateTime, default=datetime.utcnow)
-    updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+    created_at = Column(BigInteger, default=now_ms)
+    updated_at = Column(BigInteger, default=now_ms, onupdate=now_ms)
     messages = relationship("ChatMessage", back_populates="session", order_by="ChatMessage.created_at")
     user_profile = relationship("UserProfile", back_populates="session", uselist=False)
 
+    __table_args__ = (
+        # 部分索引：只收錄未滿的會話，讓「該 IP 最新未滿會話」的查詢直接走索引
+        Index(
+            "ix_chat_sessions_ip_unfilled",
+            "ip_address",
+            created_at.desc(),
+            sqlite_where=message_count < 20,
+            postgresql_where=message_count < 20
+        ),
+    )
+
 class ChatMessage(Base):
     __tablename__ = "chat_messages"
 
@@ -35,9 +75,21 @@ class ChatMessage(Base):
     session_id = Column(String(50), ForeignKey("chat_sessions.session_id"))
     role = Column(String(20))  # 'user' or 'assistant'
     content = Column(Text)
-    created_at = Column(DateTime, default=datetime.utcnow)
+    created_at = Column(BigInteger, default=now_ms)
     session = relationship("ChatSession", back_populates="messages")
 
+    __table_args__ = (
+        # 同時滿足依會話篩選與依建立時間排序，載入對話歷史時不需額外排序
+        Index("ix_messages_session_created", "session_id", "created_at"),
+    )
+
+class ActiveSessionByIP(Base):
+    """每個 IP 目前使用中（未滿）的會話，讓會話查詢成為主鍵點查詢"""
+    __tablename__ = "active_sessions"
+
+    ip_address = Column(String(50), primary_key=True)
+    session_id = Column(String(50), ForeignKey("chat_sessions.session_id"))
+
 class UserProfile(Base):
     __tablename__ = "user_profiles"
 
@@ -46,9 +98,9 @@ class UserProfile(Base):
     visit_count = Column(Integer, default=1)
     total_interactions = Column(Integer, default=0)
     satisfaction_score = Column(Float, default=0.0)
-    last_activity = Column(DateTime, default=datetime.utcnow)
-    created_at = Column(DateTime, default=datetime.utcnow)
-    updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+    last_activity = Column(BigInteger, default=now_ms)
+    created_at = Column(BigInteger, default=now_ms)
+    updated_at = Column(BigInteger, default=now_ms, onupdate=now_ms)
     
     # JSON fields for complex data
     personality_traits = Column(JSON, default=dict)  # openness, social_level, adventure_seeking, etc.
@@ -70,96 +122,231 @@ class UserInterest(Base):
     interest = Column(String(100), index=True)
     confidence = Column(Float, default=0.5)  # 0.0 to 1.0
     source = Column(String(50), default="conversation")  # conversation, explicit, inferred
-    created_at = Column(DateTime, default=datetime.utcnow)
-    updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+    created_at = Column(BigInteger, default=now_ms)
+    updated_at = Column(BigInteger, default=now_ms, onupdate=now_ms)
     
     profile = relationship("UserProfile", back_populates="interests")
 
+    __table_args__ = (
+        # 興趣查詢與更新都以畫像 ID 加興趣名稱篩選
+        Index("ix_ui_profile_interest", "profile_id", "interest"),
+    )
+
 class UserPreference(Base):
     __tablename__ = "user_preferences"
 
     id = Column(Integer, primary_key=True, index=True)
     profile_id = Column(Integer, ForeignKey("user_profiles.id"))
-    preference_type = Column(String(50), index=True)  # category, location, time, group_size, budget
+    preference_type = Column(String(50))  # category, location, time, group_size, budget
     preference_value = Column(String(200))
     confidence = Column(Float, default=0.5)
-    created_at = Column(DateTime, default=datetime.utcnow)
-    updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+    created_at = Column(BigInteger, default=now_ms)
+    updated_at = Column(BigInteger, default=now_ms, onupdate=now_ms)
     
     profile = relationship("UserProfile", back_populates="preferences")
 
+    __table_args__ = (
+        # 偏好查詢都以畫像 ID 加偏好類型篩選
+        Index("ix_up_profile_type", "profile_id", "preference_type"),
+    )
+
 class UserBehavior(Base):
     __tablename__ = "user_behaviors"
 
     id = Column(Integer, primary_key=True, index=True)
     profile_id = Column(Integer, ForeignKey("user_profiles.id"))
-    behavior_type = Column(String(50), index=True)  # search, click, view, interaction
-    behavior_data = Column(JSON)  # flexible data storage
-    timestamp = Column(DateTime, default=datetime.utcnow)
+    behavior_type = Column(String(50))  # search, click, view, interaction
+    behavior_data = Column(_JSONData)  # flexible data storage
+    event_id = Column(String(64), index=True)  # 由 behavior_data 提升的常用查詢鍵
+    timestamp = Column(BigInteger, default=now_ms)
     
     profile = relationship("UserProfile", back_populates="behaviors")
 
+    __table_args__ = (
+        # 「某畫像最近 N 筆行為」同時滿足篩選與排序
+        Index("ix_ub_profile_ts", "profile_id", timestamp.desc()),
+        Index("ix_ub_data_gin", "behavior_data", postgresql_using="gin").ddl_if(dialect="postgresql"),
+    )
+
 class UserFeedback(Base):
     __tablename__ = "user_feedbacks"
 
     id = Column(Integer, primary_key=True, index=True)
     profile_id = Column(Integer, ForeignKey("user_profiles.id"))
-    feedback_type = Column(String(50), index=True)  # rating, comment, satisfaction
+    feedback_type = Column(String(50))  # rating, comment, satisfaction
     feedback_value = Column(String(500))
     rating = Column(Float)  # 1.0 to 5.0
-    context = Column(JSON)  # context when feedback was given
-    created_at = Column(DateTime, default=datetime.utcnow)
+    context = Column(_JSONData)  # context when feedback was given
+    event_id = Column(String(64), index=True)  # 由 context 提升的常用查詢鍵
+    created_at = Column(BigInteger, default=now_ms)
     
     profile = relationship("UserProfile", back_populates="feedbacks")
 
-# Create all tables
-Base.metadata.create_all(bind=engine)
+    __table_args__ = (
+        # 反饋歷史依畫像篩選並依時間倒序
+        Index("ix_uf_profile_created", "profile_id", created_at.desc()),
+        Index("ix_uf_context_gin", "context", postgresql_using="gin").ddl_if(dialect="postgresql"),
+    )
+
+# 已由複合索引取代的低基數單欄索引，既有資料庫啟動時移除
+_OBSOLETE_INDEXES = (
+    "ix_user_preferences_preference_type",
+    "ix_user_behaviors_behavior_type",
+    "ix_user_feedbacks_feedback_type",
+)
+
+# 由 DateTime 改為毫秒時間戳的欄位：(資料表, 欄位)
+_MS_TIMESTAMP_COLUMNS = tuple(
+    (table.name, column.name)
+    for table in Base.metadata.sorted_tables
+    for column in table.columns
+    if isinstance(column.type, BigInteger) and column.name in ("created_at", "updated_at", "last_activity", "timestamp")
+)
+
+# 由 JSON 欄位提升為獨立欄位的鍵：(模型, 欄位名稱, 來源 JSON 欄位名稱)
+_PROMOTED_JSON_KEYS = (
+    (UserBehavior, "event_id", "behavior_data"),
+    (UserFeedback, "event_id", "context"),
+)
+
+def _existing_columns(sync_conn) -> Dict[str, set]:
+    """讀取資料庫中各資料表現有的欄位名稱"""
+    inspector = inspect(sync_conn)
+    return {
+        table.name: {column["name"] for column in inspector.get_columns(table.name)}
+        for table in Base.metadata.sorted_tables
+    }
+
+async def init_db():
+    """建立所有資料表與索引（應用程式啟動時呼叫）"""
+    async with engine.begin() as conn:
+        # Create all tables
+        await conn.run_sync(Base.metadata.create_all)
+        
+        # 既有資料表補上提升的欄位，並從 JSON 欄位回填
+        existing_columns = await conn.run_sync(_existing_columns)
+        for model, column_name, source_name in _PROMOTED_JSON_KEYS:
+            table = model.__table__
+            if column_name in existing_columns[table.name]:
+                continue
+            column = table.c[column_name]
+            column_type = column.type.compile(dialect=conn.dialect)
+            await conn.execute(text(f"ALTER TABLE {table.name} ADD COLUMN {column_name} {column_type}"))
+            await conn.execute(
+                update(table)
+                .where(table.c[source_name].is_not(None))
+                .values({column_name: table.c[source_name][column_name].as_string()})
+            )
+        
+        # create_all 不會為既有的資料表補建索引，後續新增的索引需個別建立
+        for table in Base.metadata.sorted_tables:
+            for index in table.indexes:
+                await conn.run_sync(index.create, checkfirst=True)
+        
+        for index_name in _OBSOLETE_INDEXES:
+            await conn.execute(text(f"DROP INDEX IF EXISTS {index_name}"))
+        
+        # 既有 SQLite 資料庫中以文字儲存的 DateTime 值就地轉為毫秒時間戳
+        if conn.dialect.name == "sqlite":
+            for table_name, column_name in _MS_TIMESTAMP_COLUMNS:
+                await conn.execute(text(
+                    f"UPDATE {table_name} "
+                    f"SET {column_name} = CAST(ROUND((julianday({column_name}) - 2440587.5) * 86400000) AS INTEGER) "
+                    f"WHERE typeof({column_name}) = 'text'"
+                ))
 
 # Dependency to get DB session
-def get_db():
-    db = SessionLocal()
-    try:
+async def get_db():
+    async with SessionLocal() as db:
         yield db
-    finally:
-        db.close() 
+
+async def _set_active_session(db, ip_address: str, session_id: str):
+    """
+    記錄該 IP 使用中的會話
+    以單一 INSERT ... ON CONFLICT DO UPDATE 寫入，同一 IP 並行的首次請求不會因主鍵衝突而失敗
+    """
+    stmt = _upsert_insert(ActiveSessionByIP).values(ip_address=ip_address, session_id=session_id)
+    await db.execute(stmt.on_conflict_do_update(
+        index_elements=[ActiveSessionByIP.ip_address],
+        set_={"session_id": stmt.excluded.session_id}
+    ))
 
 async def get_or_create_session(db, ip_address: str, session_id: str = None):
     """
     獲取或創建會話，根據消息數量和 IP 地址管理會話
+    
+    回傳的會話物件與資料庫 session 分離：後續服務發生 rollback 時不會被設為過期，
+    在非同步環境中讀取其屬性也不會觸發隱式查詢
     """
     if session_id:
         # 嘗試獲取現有會話
-        session = db.query(ChatSession).filter(ChatSession.session_id == session_id).first()
+        session = await db.scalar(select(ChatSession).where(ChatSession.session_id == session_id))
         if session:
             # 檢查消息數量
             if session.message_count < 20:
+                db.expunge(session)
                 return session
             # 如果 session 已滿，不使用傳入的 session_id，讓系統創建新的
     
-    # 嘗試獲取該 IP 的最新未滿的會話
-    latest_session = (
-        db.query(ChatSession)
-        .filter(
+    # 先以主鍵查詢該 IP 目前使用中的會話
+    active = await db.get(ActiveSessionByIP, ip_address)
+    if active:
+        session = await db.scalar(select(ChatSession).where(ChatSession.session_id == active.session_id))
+        if session and session.message_count < 20:
+            db.expunge(session)
+            return session
+    
+    # 未命中時才查詢該 IP 的最新未滿的會話
+    latest_session = await db.scalar(
+        select(ChatSession)
+        .where(
             ChatSession.ip_address == ip_address,
             ChatSession.message_count < 20
         )
         .order_by(ChatSession.created_at.desc())
-        .first()
+        .limit(1)
     )
     
     if latest_session:
+        await _set_active_session(db, ip_address, latest_session.session_id)
+        await db.commit()
+        db.expunge(latest_session)
         return latest_session
     
     # 創建新會話（總是使用新的 UUID，不使用傳入的 session_id）
-    new_session = ChatSession(
-        session_id=str(uuid.uuid4()),
-        ip_address=ip_address,
-        message_count=0
+    # 以 INSERT ... RETURNING 一次取回主鍵，不需在提交後再 refresh 查詢一次
+    now = now_ms()
+    values = {
+        "session_id": str(uuid.uuid4()),
+        "ip_address": ip_address,
+        "message_count": 0,
+        "created_at": now,
+        "updated_at": now
+    }
+    row = (await db.execute(insert(ChatSession).values(**values).returning(ChatSession.id))).one()
+    await _set_active_session(db, ip_address, values["session_id"])
+    await db.commit()
+    return ChatSession(id=row.id, **values)
+
+async def _increment_message_count(db, session: ChatSession, count: int, now: int):
+    """
+    以單一 UPDATE 在資料庫端遞增消息計數，避免並行請求讀到相同計數而遺失更新；
+    會話額滿時移除該 IP 的使用中會話紀錄，下一輪改走完整查詢
+    """
+    message_count = await db.scalar(
+        update(ChatSession)
+        .where(ChatSession.session_id == session.session_id)
+        .values(message_count=ChatSession.message_count + count, updated_at=now)
+        .returning(ChatSession.message_count)
+        .execution_options(synchronize_session=False)
     )
-    db.add(new_session)
-    db.commit()
-    db.refresh(new_session)
-    return new_session
+    if message_count is not None and message_count >= 20:
+        await db.execute(
+            delete(ActiveSessionByIP).where(
+                ActiveSessionByIP.ip_address == session.ip_address,
+                ActiveSessionByIP.session_id == session.session_id
+            )
+        )
 
 async def add_message_to_session(db, session: ChatSession, role: str, content: str):
     """
@@ -172,9 +359,35 @@ async def add_message_to_session(db, session: ChatSession, role: str, content: s
     )
     db.add(message)
     
-    # 更新會話的消息計數
-    session.message_count += 1
-    session.updated_at = datetime.utcnow()
+    await _increment_message_count(db, session, 1, now_ms())
+    
+    await db.commit()
+    return message
+
+async def add_messages_to_session(db, session: ChatSession, messages: List[Dict[str, Any]]):
+    """
+    批次添加多則消息到會話：一次 executemany 寫入所有消息，並以單一 UPDATE 遞增消息計數，
+    整個對話回合只需提交一次
+    
+    Args:
+        messages: 每則消息包含 role、content，可選 created_at（未提供時使用目前時間）
+    """
+    if not messages:
+        return
+    
+    now = now_ms()
+    await db.execute(
+        insert(ChatMessage),
+        [
+            {
+                "session_id": session.session_id,
+                "role": message["role"],
+                "content": message["content"],
+                "created_at": message.get("created_at") or now
+            }
+            for message in messages
+        ]
+    )
+    await _increment_message_count(db, session, len(messages), now)
     
-    db.commit()
-    return message 
\ No newline at end of file
+    await db.commit()
@@ -6,7 +6,9 @@
 import asyncio
 import json
 from datetime import datetime
+from typing import Any, Dict, List
 from core.agent import Agent
+from database import SessionLocal, init_db
 from utils.logger import logger
 
 async def demo_proactive_agent():
@@ -14,9 +16,6 @@ async def demo_proactive_agent():
     
     print("=== 主動式提問Agent演示 ===\n")
     
-    # 初始化Agent
-    agent = Agent(session_id="demo_session_001")
-    
     # 模擬對話場景
     scenarios = [
         {
@@ -52,52 +51,65 @@ async def demo_proactive_agent():
         }
     ]
     
-    for i, scenario in enumerate(scenarios, 1):
-        print(f"\n--- 場景 {i}: {scenario['name']} ---")
-        print(f"用戶訊息: {scenario['user_message']}")
-        
-        try:
+    # 各場景互不相依，並行執行以重疊 LLM 等待時間，完成後依序輸出
+    results = await asyncio.gather(*(run_scenario(i, scenario) for i, scenario in enumerate(scenarios, 1)))
+    for lines in results:
+        print("\n".join(lines))
+
+async def run_scenario(i: int, scenario: Dict[str, Any]) -> List[str]:
+    """執行單一對話場景，回傳要輸出的文字行"""
+    lines = [
+        f"\n--- 場景 {i}: {scenario['name']} ---",
+        f"用戶訊息: {scenario['user_message']}"
+    ]
+    
+    try:
+        # 每個場景使用獨立的 Agent 與資料庫 session，並行時不會互相干擾
+        agent = Agent(session_id=f"demo_session_001_{i}")
+        async with SessionLocal() as db:
             # 處理訊息
             response = await agent.process_message(
                 message=scenario['user_message'],
+                db=db,
                 chat_history=scenario['chat_history']
             )
+        
+        lines.append(f"Agent回應: {response.get('message', '')}")
+        
+        # 顯示主動式提問信息
+        if response.get('proactive_questions'):
+            proactive = response['proactive_questions']
+            lines.append(f"\n主動式提問:")
+            lines.append(f"  問題類型: {proactive.get('question_type', 'unknown')}")
+            lines.append(f"  信心度: {proactive.get('confidence', 0)}")
             
-            print(f"Agent回應: {response.get('message', '')}")
-            
-            # 顯示主動式提問信息
-            if response.get('proactive_questions'):
-                proactive = response['proactive_questions']
-                print(f"\n主動式提問:")
-                print(f"  問題類型: {proactive.get('question_type', 'unknown')}")
-                print(f"  信心度: {proactive.get('confidence', 0)}")
-                
-                if proactive.get('questions'):
-                    print(f"  生成的問題:")
-                    for j, question in enumerate(proactive['questions'], 1):
-                        print(f"    {j}. {question}")
-                
-                if proactive.get('follow_up_suggestions'):
-                    print(f"  後續建議: {', '.join(proactive['follow_up_suggestions'])}")
-            
-            # 顯示用戶畫像信息
-            if response.get('user_profile_summary'):
-                profile = response['user_profile_summary']
-                print(f"\n用戶畫像:")
-                print(f"  新用戶: {profile.get('is_new_user', 'unknown')}")
-                if profile.get('interests'):
-                    print(f"  興趣: {', '.join(profile['interests'])}")
-            
-            # 顯示對話階段
-            if response.get('conversation_stage'):
-                print(f"\n對話階段: {response['conversation_stage']}")
-            
-            print(f"處理成功: {response.get('success', False)}")
+            if proactive.get('questions'):
+                lines.append(f"  生成的問題:")
+                for j, question in enumerate(proactive['questions'], 1):
+                    lines.append(f"    {j}. {question}")
             
-        except Exception as e:
-            print(f"錯誤: {str(e)}")
+            if proactive.get('follow_up_suggestions'):
+                lines.append(f"  後續建議: {', '.join(proactive['follow_up_suggestions'])}")
         
-        print("-" * 50)
+        # 顯示用戶畫像信息
+        if response.get('user_profile_summary'):
+            profile = response['user_profile_summary']
+            lines.append(f"\n用戶畫像:")
+            lines.append(f"  新用戶: {profile.get('is_new_user', 'unknown')}")
+            if profile.get('interests'):
+                lines.append(f"  興趣: {', '.join(profile['interests'])}")
+        
+        # 顯示對話階段
+        if response.get('conversation_stage'):
+            lines.append(f"\n對話階段: {response['conversation_stage']}")
+        
+        lines.append(f"處理成功: {response.get('success', False)}")
+        
+    except Exception as e:
+        lines.append(f"錯誤: {str(e)}")
+    
+    lines.append("-" * 50)
+    return lines
 
 async def demo_conversation_flow():
     """演示完整的對話流程"""
@@ -189,6 +201,7 @@ async def demo_stage_analysis():
 async def main():
     """主函數"""
     try:
+        await init_db()
         await demo_proactive_agent()
         await demo_conversation_flow()
         await demo_stage_analysis()
@@ -1,31 +1,39 @@
 import os
-from typing import List, Dict, Any, Optional
-import json
+from typing import AsyncIterator, List, Dict, Any, Optional, Tuple
+import orjson
 from datetime import datetime, timedelta
-import httpx
+import numpy as np
 import pandas as pd
+import matplotlib
+matplotlib.use('Agg')  # 伺服器端只輸出圖片，不需要互動式後端
 import matplotlib.pyplot as plt
 import seaborn as sns
 import io
+import logging
 import base64
 import re
-from openai import OpenAI
+import functools
+import time
+from types import MappingProxyType
+from cachetools import TTLCache
+from openai import AsyncOpenAI
 from utils.config import OPENAI_API_KEY, EVENTGO_API_BASE
 from dotenv import load_dotenv
 from utils.logger import logger
+from utils.single_flight import SingleFlightCache, cache_key
+from core.http import shared_http_client
 
 # Load environment variables from .env file
 load_dotenv(override=True)
 
 # Initialize OpenAI client
 logger.info("Initializing OpenAI client...")
-client = OpenAI(api_key=OPENAI_API_KEY)
+# 非同步客戶端：在協程中呼叫模型時不會阻塞事件迴圈
+aclient = AsyncOpenAI(api_key=OPENAI_API_KEY)
 logger.info("OpenAI client initialized successfully")
 
-# Create HTTP client with SSL verification disabled for development
-logger.info("Creating HTTP client...")
-http_client = httpx.AsyncClient(verify=False)
-logger.info("HTTP client created successfully")
+# EventGO 請求與各處理器共用同一個 HTTP/2 連線池（由 main.py 在關閉時釋放）
+http_client = shared_http_client
 
 SYSTEM_PROMPT = """你是一個專業的活動分析助手，可以幫助用戶查詢和分析活動資訊。
 你可以：
@@ -43,51 +51,110 @@ SYSTEM_PROMPT = """你是一個專業的活動分析助手，可以幫助用戶
 
 請根據用戶的需求，使用適當的API來獲取和分析數據。"""
 
-async def extract_search_params(message: str, existing_params: Dict[str, Any] = None) -> Dict[str, Any]:
-    """
-    Extract search parameters from natural language message using GPT-4
-    existing_params: 已存在的搜尋參數（例如從前端傳來的排序參數）
-    """
-    logger.info(f"Extracting search parameters from message: {message}")
-    logger.info(f"Existing parameters: {existing_params}")
-    
-    # Get today's date in different formats for the prompt
-    today = datetime.now()
-    today_str = today.strftime("%Y-%m-%d")
-    today_timestamp = int(today.timestamp() * 1000)  # Convert to milliseconds
-    
-    # Define valid cities
-    valid_cities = [
-        "臺北", "新北", "臺中", "臺南", "高雄", "桃園", "基隆", "新竹", "嘉義",
-        "苗栗", "彰化", "南投", "雲林", "屏東", "宜蘭", "花蓮", "臺東", "澎湖",
-        "金門", "連江"
-    ]
-    
-    # Define valid sort keys
-    valid_sort_keys = [
-        "_score", "start_time", "end_time", "updated_time", "distance"
-    ]
-    
-    prompt = f"""請從以下用戶訊息中提取活動搜尋參數，並以JSON格式返回：
+# 有效的城市名稱（提示詞與結果驗證共用，依顯示順序排列）
+_VALID_CITIES = (
+    "臺北", "新北", "臺中", "臺南", "高雄", "桃園", "基隆", "新竹", "嘉義",
+    "苗栗", "彰化", "南投", "雲林", "屏東", "宜蘭", "花蓮", "臺東", "澎湖",
+    "金門", "連江"
+)
+_VALID_CITY_SET = frozenset(_VALID_CITIES)
+
+# 相對時間用語 -> (from 相對今天的毫秒偏移, to 相對今天的毫秒偏移或 None)，與提示詞中的時間規則一致
+_RELATIVE_TIME_RANGES = {
+    "今天": (0, None),
+    "明天": (86400000, None),
+    "下週": (604800000, None),
+    "過去半年": (-15552000000, 0),
+    "最近半年": (-15552000000, 0),
+    "過去一個月": (-2592000000, 0),
+    "最近一個月": (-2592000000, 0),
+    "過去一週": (-604800000, 0),
+    "最近一週": (-604800000, 0),
+    "過去一年": (-31536000000, 0),
+    "最近一年": (-31536000000, 0),
+    "上個月": (-5184000000, -2592000000),
+    "上週": (-1209600000, -604800000),
+}
+
+# 排序用語 -> (排序欄位, 是否升序)
+_SORT_PHRASES = {
+    "最新": ("start_time", False),
+    "即將開始": ("start_time", True),
+    "即將結束": ("end_time", True),
+    "最近更新": ("updated_time", False),
+    "距離最近": ("distance", True),
+}
+
+# 可在本地直接判定的活動類別
+_FAST_PATH_CATEGORIES = (
+    "音樂", "展覽", "運動", "藝術", "親子", "戶外", "美食", "講座",
+    "電影", "戲劇", "舞蹈", "市集", "課程", "工作坊", "演唱會", "音樂會"
+)
+
+# 不影響搜尋條件的常見用語與標點
+_FILLER_WORDS = (
+    "我想", "我要", "想要", "幫我", "給我", "請問", "請", "找", "搜尋", "查詢", "推薦",
+    "一些", "有什麼", "有沒有", "有哪些", "哪些", "的", "活動", "嗎", "呢", "吧",
+    "在", "和", "與", "跟", "及", "或", "、", "，", ",", "。", "？", "?", "！", "!"
+)
+
+def _build_fast_path_tokens() -> Dict[str, tuple]:
+    """建立本地參數比對的用語表：用語 -> (種類, 值)"""
+    tokens = {word: ("filler", None) for word in _FILLER_WORDS}
+    for category in _FAST_PATH_CATEGORIES:
+        tokens[category] = ("category", category)
+    for phrase, offsets in _RELATIVE_TIME_RANGES.items():
+        tokens[phrase] = ("time", offsets)
+    for phrase, sort in _SORT_PHRASES.items():
+        tokens[phrase] = ("sort", sort)
+    for city in _VALID_CITIES:
+        for name in {city, city.replace("臺", "台")}:
+            for suffix in ("", "市", "縣"):
+                tokens[name + suffix] = ("city", (city,))
+    for name in ("台灣", "臺灣", "全台"):
+        tokens[name] = ("city", _VALID_CITIES)
+    return tokens
+
+_FAST_PATH_TOKENS = _build_fast_path_tokens()
+# 長用語優先，讓「最近一週」不會被拆成較短的用語
+_FAST_PATH_RE = re.compile("|".join(map(re.escape, sorted(_FAST_PATH_TOKENS, key=len, reverse=True))))
+
+# 分析圖表共用的畫布，每次繪圖前清空重畫，省去反覆建立 Figure/Canvas 的成本
+# （繪圖到輸出之間沒有 await，事件迴圈內不會交錯使用）
+_FIG, _AX = plt.subplots(figsize=(12, 6))
+
+def _render_figure(**savefig_kwargs) -> str:
+    """將共用畫布輸出為 base64 編碼的 PNG"""
+    img = io.BytesIO()
+    _FIG.savefig(img, format='png', bbox_inches='tight', **savefig_kwargs)
+    return base64.b64encode(img.getvalue()).decode()
+
+# 可用的排序欄位
+_VALID_SORT_KEYS = ("_score", "start_time", "end_time", "updated_time", "distance")
+_VALID_CITIES_STR = ', '.join(_VALID_CITIES)
+_VALID_SORT_KEYS_STR = ', '.join(_VALID_SORT_KEYS)
+
+# 搜尋參數提取提示詞模板，每次請求只需填入訊息與時間戳
+_EXTRACTION_PROMPT_TEMPLATE = """請從以下用戶訊息中提取活動搜尋參數，並以JSON格式返回：
     用戶訊息：{message}
     
     今天的日期是：{today_str}（時間戳：{today_timestamp}）
     
     請確保返回的是有效的JSON格式，包含以下參數（如果存在）：
     - query: 搜尋關鍵字
-    - city: 城市（必須是以下城市之一或多個，用逗號分隔：{', '.join(valid_cities)}）
+    - city: 城市（必須是以下城市之一或多個，用逗號分隔：{valid_cities}）
     - category: 活動類別
     - from: 開始時間（毫秒時間戳，例如：{today_timestamp}）
     - to: 結束時間（毫秒時間戳）
     - type: 活動類型（預設為 "Web Post"）
     - timeKey: 時間過濾條件（預設為 "start_time"）
-    - sort: 排序欄位（預設為 "_score"，可選值：{', '.join(valid_sort_keys)}）
+    - sort: 排序欄位（預設為 "_score"，可選值：{valid_sort_keys}）
     - asc: 排序方向（預設為 true，表示升序）
     
     城市處理規則：
     1. 如果提到"台灣"或"全台"，則包含所有城市
     2. 如果提到多個城市，用逗號分隔
-    3. 城市名稱必須完全匹配以下列表：{', '.join(valid_cities)}
+    3. 城市名稱必須完全匹配以下列表：{valid_cities}
     4. 如果提到的城市不在列表中，請忽略該城市
     
     時間處理規則：
@@ -129,13 +196,13 @@ async def extract_search_params(message: str, existing_params: Dict[str, Any] =
     {{"city": "臺北", "category": "運動", "type": "Web Post", "timeKey": "start_time", "from": {today_timestamp}, "sort": "_score", "asc": false}}
     
     例如，如果用戶說"找過去半年的展覽活動"，應該返回：
-    {{"category": "展覽", "type": "Web Post", "timeKey": "start_time", "from": {today_timestamp - 15552000000}, "to": {today_timestamp}, "sort": "start_time", "asc": true}}
+    {{"category": "展覽", "type": "Web Post", "timeKey": "start_time", "from": {half_year_ago}, "to": {today_timestamp}, "sort": "start_time", "asc": true}}
     
     例如，如果用戶說"找上個月的音樂活動"，應該返回：
-    {{"category": "音樂", "type": "Web Post", "timeKey": "start_time", "from": {today_timestamp - 5184000000}, "to": {today_timestamp - 2592000000}, "sort": "start_time", "asc": true}}
+    {{"category": "音樂", "type": "Web Post", "timeKey": "start_time", "from": {two_months_ago}, "to": {one_month_ago}, "sort": "start_time", "asc": true}}
     
     例如，如果用戶說"找最近一週的展覽"，應該返回：
-    {{"category": "展覽", "type": "Web Post", "timeKey": "start_time", "from": {today_timestamp - 604800000}, "to": {today_timestamp}, "sort": "start_time", "asc": true}}
+    {{"category": "展覽", "type": "Web Post", "timeKey": "start_time", "from": {one_week_ago}, "to": {today_timestamp}, "sort": "start_time", "asc": true}}
     
     請注意：
     1. 必須返回有效的JSON格式
@@ -150,10 +217,228 @@ async def extract_search_params(message: str, existing_params: Dict[str, Any] =
     10. 如果沒有指定排序，sort 參數應設為 "start_time"，asc 參數應設為 true
     11. 時間範圍查詢（如"過去半年"）必須同時設置 from 和 to 參數
     """
+
+@functools.lru_cache(maxsize=1)
+def _today_context_at(minute: int) -> Tuple[str, int]:
+    """依分鐘序號建立今天的日期字串與毫秒時間戳"""
+    return datetime.fromtimestamp(minute * 60).strftime("%Y-%m-%d"), minute * 60000
+
+def _today_context() -> Tuple[str, int]:
+    """取得今天的日期字串與毫秒時間戳（精確到分鐘），每分鐘才重新建立一次"""
+    return _today_context_at(int(time.time() // 60))
+
+@functools.lru_cache(maxsize=256)
+def _ms_to_date(timestamp_ms: int) -> str:
+    """將毫秒時間戳轉為 YYYY-MM-DD"""
+    return datetime.fromtimestamp(timestamp_ms / 1000).strftime('%Y-%m-%d')
+
+def _match_search_params(message: str, today_timestamp: int) -> Optional[Dict[str, Any]]:
+    """
+    以預編譯的用語表在本地解析常見的搜尋訊息
+    
+    訊息中每個字都必須屬於已知的城市、類別、時間、排序或贅詞；
+    只要有無法辨識的內容或條件互相衝突就回傳 None，交由模型解析
+    """
+    cities: List[str] = []
+    category = time_range = sort = None
+    position = 0
+    for match in _FAST_PATH_RE.finditer(message):
+        if message[position:match.start()].strip():
+            return None
+        position = match.end()
+        
+        kind, value = _FAST_PATH_TOKENS[match.group()]
+        if kind == "city":
+            cities.extend(city for city in value if city not in cities)
+        elif kind == "category":
+            if category not in (None, value):
+                return None
+            category = value
+        elif kind == "time":
+            if time_range not in (None, value):
+                return None
+            time_range = value
+        elif kind == "sort":
+            if sort not in (None, value):
+                return None
+            sort = value
+    if message[position:].strip():
+        return None
+    
+    params: Dict[str, Any] = {"type": "Web Post", "timeKey": "start_time"}
+    if cities:
+        params["city"] = ",".join(cities)
+    if category:
+        params["category"] = category
+    if time_range:
+        from_offset, to_offset = time_range
+        params["from"] = today_timestamp + from_offset
+        if to_offset is not None:
+            params["to"] = today_timestamp + to_offset
+    if sort:
+        params["sort"], params["asc"] = sort
+    return params
+
+def _finalize_params(params: Dict[str, Any], existing_params: Optional[Dict[str, Any]], today_timestamp: int) -> Dict[str, Any]:
+    """驗證城市、套用前端排序參數的優先級並補上預設值"""
+    # Validate and process city parameter
+    if 'city' in params:
+        valid_cities_list = [city.strip() for city in params['city'].split(',') if city.strip() in _VALID_CITY_SET]
+        if valid_cities_list:
+            params['city'] = ','.join(valid_cities_list)
+        else:
+            del params['city']
+    
+    # 處理排序參數的優先級
+    if existing_params:
+        # 如果前端指定了要保留排序參數
+        if existing_params.get('preserve_sort'):
+            params['sort'] = existing_params['sort']
+            logger.info(f"Using frontend sort parameter: {existing_params['sort']}")
+        # 如果前端指定了要保留排序方向
+        if existing_params.get('preserve_asc'):
+            params['asc'] = existing_params['asc']
+            logger.info(f"Using frontend asc parameter: {existing_params['asc']}")
+    else:
+        # 根據搜索條件設置默認排序
+        if 'query' in params:
+            # 如果有關鍵字搜索，按相關度排序
+            params['sort'] = '_score'
+            params['asc'] = False
+        elif 'sort' not in params:
+            # 默認按開始時間降序
+            params['sort'] = 'start_time'
+            params['asc'] = False
+    
+    # 如果前端沒有指定要保留排序參數，但提供了排序參數，則使用前端的排序參數
+    if existing_params and not existing_params.get('preserve_sort'):
+        if 'sort' in existing_params:
+            params['sort'] = existing_params['sort']
+            logger.info(f"Using frontend sort parameter without preserve flag: {existing_params['sort']}")
+        if 'asc' in existing_params:
+            params['asc'] = existing_params['asc']
+            logger.info(f"Using frontend asc parameter without preserve flag: {existing_params['asc']}")
+    
+    # Add default values if not present
+    if 'type' not in params:
+        params['type'] = 'Web Post'
+    if 'from' not in params:
+        params['from'] = today_timestamp
+    
+    return params
+
+# 判斷訊息是否為活動搜尋的關鍵字（皆為中文，不需轉小寫）
+_SEARCH_KEYWORD_RE = re.compile("找|搜尋|推薦|活動")
+
+# EventGO 回應中體積大、回傳給前端前要移除的活動欄位
+_DROP_FIELDS = frozenset(('description', 'highlight_description', 'imgs'))
+
+# 推薦回應提示詞只需要的活動欄位；其餘欄位只會增加輸入 token
+_RECO_FIELDS = ('name', 'start_time', 'end_time', 'location', 'category', 'category_list', 'link')
+# 分頁參數已另外寫在提示詞中，不需重複放入搜尋參數
+_PAGING_PARAMS = frozenset(('p', 'num'))
+
+def _slim_event(event: Dict[str, Any]) -> Dict[str, Any]:
+    """只保留推薦回應需要的欄位，並將座標與城市、區域攤平"""
+    slim = {k: event[k] for k in _RECO_FIELDS if event.get(k)}
+    gps = event.get('gps') or {}
+    if gps.get('lat') and gps.get('lon'):
+        slim['latitude'] = gps['lat']
+        slim['longitude'] = gps['lon']
+    venue = event.get('venue') or {}
+    if venue.get('city'):
+        slim['city'] = venue['city']
+    if venue.get('area'):
+        slim['area'] = venue['area']
+    return slim
+
+# 無法解析模型回應時使用的預設搜尋參數（from 於每次請求時補上）
+_DEFAULT_SEARCH_PARAMS = MappingProxyType({
+    'type': 'Web Post',
+    'sort': 'start_time',
+    'asc': False
+})
+
+# 搜尋參數提取結果快取；參數中含有當下時間戳，因此只保留 60 秒，相同的並行請求共用同一次 LLM 呼叫
+_extraction_cache = SingleFlightCache(maxsize=2048, ttl=60)
+
+# EventGO GET 回應快取（保存原始內容，每次解析出新的物件，呼叫端可自由修改）
+_eventgo_cache = TTLCache(maxsize=512, ttl=60)
+
+async def _eventgo_get(path: str, params: Dict[str, Any]) -> Any:
+    """以查詢字串為鍵快取 EventGO GET 請求，回傳解析後的 JSON"""
+    url = f"{EVENTGO_API_BASE}{path}"
+    key = (url, tuple(sorted((k, str(v)) for k, v in params.items())))
+    content = _eventgo_cache.get(key)
+    if content is None:
+        response = await http_client.get(url, params=params)
+        logger.info(f"EventGO response status: {response.status_code}")
+        content = response.content
+        if response.status_code == 200:
+            _eventgo_cache[key] = content
+    else:
+        logger.info(f"EventGO cache hit: {path}")
+    return orjson.loads(content)
+
+def clear_eventgo_cache() -> None:
+    """清除 EventGO GET 回應快取"""
+    _eventgo_cache.clear()
+
+async def extract_search_params(message: str, existing_params: Dict[str, Any] = None) -> Dict[str, Any]:
+    """
+    Extract search parameters from natural language message（帶快取）
+    existing_params: 已存在的搜尋參數（例如從前端傳來的排序參數）
+    """
+    key = cache_key(message.strip(), existing_params)
+    
+    params = _extraction_cache.get(key)
+    if params is None:
+        # 模型呼叫失敗時的預設參數不寫入快取，下次請求重新呼叫模型
+        params = await _extraction_cache.get_or_compute(
+            key, lambda: _extract_search_params(message, existing_params)
+        )
+    else:
+        logger.info(f"Search params cache hit for message: {message}")
+    
+    # 回傳副本，呼叫端會加入分頁等參數
+    return dict(params)
+
+async def _extract_search_params(message: str, existing_params: Dict[str, Any] = None) -> Tuple[Dict[str, Any], bool]:
+    """
+    Extract search parameters from natural language message using GPT-4
+    existing_params: 已存在的搜尋參數（例如從前端傳來的排序參數）
+    回傳 (搜尋參數, 是否可快取)；模型回應無法使用而改用預設值時不可快取
+    """
+    logger.info(f"Extracting search parameters from message: {message}")
+    logger.info(f"Existing parameters: {existing_params}")
+    
+    # Get today's date in different formats for the prompt
+    today_str, today_timestamp = _today_context()
+    
+    # 常見的城市、時間與排序描述可直接在本地解析，省去一次模型往返
+    params = _match_search_params(message.strip(), today_timestamp)
+    if params is not None:
+        params = _finalize_params(params, existing_params, today_timestamp)
+        logger.info(f"Resolved search parameters locally: {params}")
+        return params, True
+    
+    prompt = _EXTRACTION_PROMPT_TEMPLATE.format(
+        message=message,
+        today_str=today_str,
+        today_timestamp=today_timestamp,
+        half_year_ago=today_timestamp - 15552000000,
+        two_months_ago=today_timestamp - 5184000000,
+        one_month_ago=today_timestamp - 2592000000,
+        one_week_ago=today_timestamp - 604800000,
+        valid_cities=_VALID_CITIES_STR,
+        valid_sort_keys=_VALID_SORT_KEYS_STR
+    )
     
     try:
-        response = client.chat.completions.create(
-            model="gpt-4o",
+        # 結構化的參數提取交給較小的模型，並以 JSON 模式保證回應可直接解析
+        response = await aclient.chat.completions.create(
+            model="gpt-4o-mini",
+            response_format={"type": "json_object"},
             messages=[
                 {"role": "system", "content": "你是一個專業的活動搜尋助手，請從用戶訊息中提取搜尋參數，並以JSON格式返回。請確保返回的是純JSON格式，不要添加任何markdown標記或其他文字。type 參數預設值為 'Web Post'。如果沒有提到時間，必須包含 from 參數並設置為今天的時間戳。"},
                 {"role": "user", "content": prompt}
@@ -162,133 +447,141 @@ async def extract_search_params(message: str, existing_params: Dict[str, Any] =
             max_tokens=500
         )
         
-        content = response.choices[0].message.content.strip()
-        logger.info(f"Raw response from GPT-4: {content}")
-        
-        # Clean the response content
-        cleaned_content = content
-        cleaned_content = re.sub(r'^```json\s*', '', cleaned_content)
-        cleaned_content = re.sub(r'^```\s*', '', cleaned_content)
-        cleaned_content = re.sub(r'\s*```$', '', cleaned_content)
-        cleaned_content = cleaned_content.strip()
-        
-        logger.info(f"Cleaned content: {cleaned_content}")
+        content = response.choices[0].message.content
+        logger.info(f"Raw response from model: {content}")
         
+        cacheable = True
         try:
-            # Try to parse the cleaned content as JSON
-            params = json.loads(cleaned_content)
-            
-            # Validate and process city parameter
-            if 'city' in params:
-                cities = params['city'].split(',')
-                valid_cities_list = []
-                for city in cities:
-                    city = city.strip()
-                    if city in valid_cities:
-                        valid_cities_list.append(city)
-                if valid_cities_list:
-                    params['city'] = ','.join(valid_cities_list)
-                else:
-                    del params['city']
-            
-            # 處理排序參數的優先級
-            if existing_params:
-                # 如果前端指定了要保留排序參數
-                if existing_params.get('preserve_sort'):
-                    params['sort'] = existing_params['sort']
-                    logger.info(f"Using frontend sort parameter: {existing_params['sort']}")
-                # 如果前端指定了要保留排序方向
-                if existing_params.get('preserve_asc'):
-                    params['asc'] = existing_params['asc']
-                    logger.info(f"Using frontend asc parameter: {existing_params['asc']}")
-            else:
-                # 根據搜索條件設置默認排序
-                if 'query' in params:
-                    # 如果有關鍵字搜索，按相關度排序
-                    params['sort'] = '_score'
-                    params['asc'] = False
-                elif 'sort' not in params:
-                    # 默認按開始時間降序
-                    params['sort'] = 'start_time'
-                    params['asc'] = False
-            
-            # 如果前端沒有指定要保留排序參數，但提供了排序參數，則使用前端的排序參數
-            if existing_params and not existing_params.get('preserve_sort'):
-                if 'sort' in existing_params:
-                    params['sort'] = existing_params['sort']
-                    logger.info(f"Using frontend sort parameter without preserve flag: {existing_params['sort']}")
-                if 'asc' in existing_params:
-                    params['asc'] = existing_params['asc']
-                    logger.info(f"Using frontend asc parameter without preserve flag: {existing_params['asc']}")
-            
-            # Add default values if not present
-            if 'type' not in params:
-                params['type'] = 'Web Post'
-            if 'from' not in params:
-                params['from'] = today_timestamp
-            
-            logger.info(f"Successfully parsed JSON with priority handling: {params}")
-            return params
-        except json.JSONDecodeError as e:
+            params = orjson.loads(content)
+        except orjson.JSONDecodeError as e:
+            # JSON 模式下只有在輸出被截斷時才會發生
             logger.error(f"Failed to parse JSON: {str(e)}")
-            # Try to extract JSON using regex as a fallback
-            json_match = re.search(r'\{.*\}', cleaned_content)
-            if json_match:
-                try:
-                    params = json.loads(json_match.group())
-                    # 處理排序參數的優先級
-                    if existing_params:
-                        # 如果前端指定了要保留排序參數
-                        if existing_params.get('preserve_sort'):
-                            params['sort'] = existing_params['sort']
-                            logger.info(f"Using frontend sort parameter: {existing_params['sort']}")
-                        # 如果前端指定了要保留排序方向
-                        if existing_params.get('preserve_asc'):
-                            params['asc'] = existing_params['asc']
-                            logger.info(f"Using frontend asc parameter: {existing_params['asc']}")
-                    else:
-                        # 根據搜索條件設置默認排序
-                        if 'query' in params:
-                            # 如果有關鍵字搜索，按相關度排序
-                            params['sort'] = '_score'
-                            params['asc'] = False
-                        elif 'sort' not in params:
-                            # 默認按開始時間降序
-                            params['sort'] = 'start_time'
-                            params['asc'] = False
-                    
-                    # Add default values if not present
-                    if 'type' not in params:
-                        params['type'] = 'Web Post'
-                    if 'from' not in params:
-                        params['from'] = today_timestamp
-                    
-                    logger.info(f"Successfully extracted and parsed JSON with priority handling: {params}")
-                    return params
-                except json.JSONDecodeError as e:
-                    logger.error(f"Failed to parse extracted JSON: {str(e)}")
-                    return {
-                        'type': 'Web Post',
-                        'sort': 'start_time',
-                        'asc': False,
-                        'from': today_timestamp
-                    }
-            else:
-                logger.error("No JSON found in response")
-                return {
-                    'type': 'Web Post',
-                    'sort': 'start_time',
-                    'asc': False,
-                    'from': today_timestamp
-                }
+            params, cacheable = {}, False
+        
+        if not isinstance(params, dict):
+            logger.error("No JSON object found in response")
+            params, cacheable = {}, False
+        
+        params = _finalize_params(params, existing_params, today_timestamp)
+        logger.info(f"Successfully parsed JSON with priority handling: {params}")
+        return params, cacheable
     except Exception as e:
         logger.error(f"Error extracting search parameters: {str(e)}", exc_info=True)
-        return {
-            'type': 'Web Post',
-            'sort': 'start_time',
-            'asc': False,
-            'from': today_timestamp
-        }
+        return {**_DEFAULT_SEARCH_PARAMS, 'from': today_timestamp}, False
+
+# 推薦回應的系統提示詞
+_RECOMMENDATION_SYSTEM_PROMPT = "你是一個專業的活動推薦助手，請根據搜尋結果生成詳細的活動推薦回應。"
+
+def _format_search_conditions(extracted_params: Dict[str, Any], search_params: Optional[Dict[str, Any]]) -> str:
+    """將搜尋參數整理成附加在回應後的「搜尋條件」區塊，沒有條件時回傳空字串"""
+    formatted_params = []
+    if 'query' in extracted_params:
+        formatted_params.append(f"🔍 關鍵字：{extracted_params['query']}")
+    if 'city' in extracted_params:
+        formatted_params.append(f"📍 城市：{extracted_params['city']}")
+    if 'category' in extracted_params:
+        formatted_params.append(f"🏷️ 類別：{extracted_params['category']}")
+    if 'from' in extracted_params:
+        formatted_params.append(f"📅 開始日期：{_ms_to_date(extracted_params['from'])}")
+    if 'to' in extracted_params:
+        formatted_params.append(f"📅 結束日期：{_ms_to_date(extracted_params['to'])}")
+    if 'type' in extracted_params:
+        formatted_params.append(f"📋 活動類型：{extracted_params['type']}")
+    if 'sort' in extracted_params:
+        sort_display = {
+            '_score': '相關度',
+            'start_time': '開始時間',
+            'end_time': '結束時間',
+            'updated_time': '更新時間',
+            'distance': '距離'
+        }.get(extracted_params['sort'], extracted_params['sort'])
+        formatted_params.append(f"↕️ 排序方式：{sort_display}")
+    if 'asc' in extracted_params:
+        formatted_params.append(f"↕️ 排序方向：{'升序' if extracted_params['asc'] else '降序'}")
+    if search_params and search_params.get('preserve_sort'):
+        formatted_params.append("↕️ 排序方式：使用前端指定的排序")
+    if search_params and search_params.get('preserve_asc'):
+        formatted_params.append("↕️ 排序方向：使用前端指定的方向")
+
+    if not formatted_params:
+        return ""
+    return "\n\n### 搜尋條件\n" + "\n".join(formatted_params)
+
+async def _prepare_event_search(message: str, page: int, search_params: Optional[Dict[str, Any]]) -> Optional[Dict[str, Any]]:
+    """
+    若訊息為活動搜尋，提取參數、查詢活動並組好推薦回應的提示詞
+    非活動搜尋（或無法提取參數）時回傳 None，由呼叫端改走一般對話
+    """
+    # Check if the message is about event search
+    if not _SEARCH_KEYWORD_RE.search(message):
+        return None
+    
+    logger.info("Message is about event search, extracting parameters...")
+    # Extract search parameters with existing params
+    logger.info(f"Frontend search parameters: {search_params}")
+    extracted_params = await extract_search_params(message, search_params)
+    logger.info(f"Extracted search parameters: {extracted_params}")
+
+    if not extracted_params:
+        return None
+    
+    # Add p parameter to search params (EventGO API uses 'p' for pagination)
+    extracted_params['p'] = page
+    logger.info(f"Search parameters with page: {extracted_params}")
+
+    logger.info("Searching for events with parameters...")
+    # Search for events
+    events = await recommend_events(extracted_params)
+
+    # Generate personalized response
+    logger.info("Generating personalized response...")
+    prompt = f"""根據以下搜尋結果，生成一個自然的回應：
+    搜尋參數：{orjson.dumps({k: v for k, v in extracted_params.items() if k not in _PAGING_PARAMS}).decode()}
+    搜尋結果：{orjson.dumps([_slim_event(event) for event in events['events']]).decode()}
+
+    請包含以下內容：
+    1. 符合條件的活動數量（共找到 {events['pagination']['total_events']} 個活動，本頁顯示 {events['pagination']['current_page_count']} 個活動）
+    2. 主要活動類型和地點
+    3. 特別推薦的活動，每個活動請包含：
+       - 活動名稱
+       - 活動開始日期和結束日期（請將時間戳轉換為可讀的日期時間格式）
+       - 活動地點
+       - 城市（如果有）
+       - 區域（如果有）
+       - 類別（如果有）
+       - 活動來源連結
+
+    注意事項：
+    1. 日期時間格式請使用：YYYY-MM-DD
+    2. 連結請確保是完整的URL，不要因為括號造成連結錯誤
+    3. 如果活動沒有結束時間，只顯示開始時間
+    4. 活動地點顯示規則：
+       - 如果活動有GPS座標（latitude和longitude），請使用以下格式：
+         [地點名稱](https://www.google.com/maps/place/{{latitude}},{{longitude}})
+         例如：如果活動的latitude是25.0150627，longitude是121.2188074，則連結應該是：
+         [台北市立體育館](https://www.google.com/maps/place/25.0150627,121.2188074)
+       - 如果活動沒有GPS座標，直接顯示地點名稱，不要添加任何連結
+         例如：台北市立體育館
+    5. 城市、區域和類別請分別單獨顯示，格式為：
+       城市：台北市
+       區域：信義區
+       類別：運動
+    6. 如果某項信息不存在，請不要顯示該項
+    7. 在回應開頭必須顯示總活動數和當前頁顯示的活動數，格式為：
+       "共找到 {events['pagination']['total_events']} 個活動，本頁顯示 {events['pagination']['current_page_count']} 個活動"
+
+    請以markdown格式返回，確保連結可以正常點擊。
+    """
+    
+    return {
+        "messages": [
+            {"role": "system", "content": _RECOMMENDATION_SYSTEM_PROMPT},
+            {"role": "user", "content": prompt}
+        ],
+        "events": events,
+        "search_params": extracted_params,
+        "conditions": _format_search_conditions(extracted_params, search_params)
+    }
 
 async def process_chat_message(message: str, chat_history: List[Dict[str, str]], page: int = 1, search_params: Dict[str, Any] = None) -> Dict[str, Any]:
     """
@@ -303,142 +596,43 @@ async def process_chat_message(message: str, chat_history: List[Dict[str, str]],
     logger.info(f"Chat history length: {len(chat_history)}")
     logger.info(f"Current page: {page}")
 
-    # Prepare messages for OpenAI
-    messages = [
-        {"role": "system", "content": SYSTEM_PROMPT},
-        *chat_history,
-        {"role": "user", "content": message}
-    ]
-
     try:
+        # 先判斷是否為活動搜尋；搜尋路徑會另外生成推薦回應，不需要先取得一般回覆
+        search = await _prepare_event_search(message, page, search_params)
+        if search is not None:
+            events = search["events"]
+            recommendation_response = await aclient.chat.completions.create(
+                model="gpt-4o",
+                messages=search["messages"],
+                temperature=0.7,
+                max_tokens=1000
+            )
+            
+            # Add formatted search parameters to the response
+            formatted_response = recommendation_response.choices[0].message.content + search["conditions"]
+            
+            logger.info("Generated personalized response")
+            logger.info(f"Pagination data in response: {orjson.dumps(events['pagination'], option=orjson.OPT_INDENT_2).decode()}")
+            
+            return {
+                "message": formatted_response,
+                "events": events,
+                "search_params": search["search_params"],
+                "pagination": events['pagination']
+            }
+        
         # Get response from OpenAI
         logger.info("Getting response from OpenAI...")
-        response = client.chat.completions.create(
+        response = await aclient.chat.completions.create(
             model="gpt-4o",
-            messages=messages,
+            messages=_chat_messages(message, chat_history),
             temperature=0.7,
-            max_tokens=1000
+            max_tokens=400  # 一般回覆都很短，不需要保留 1000 個 token 的生成額度
         )
         
         response_content = response.choices[0].message.content
         logger.info("Received response from OpenAI")
         
-        # Check if the message is about event search
-        if any(keyword in message.lower() for keyword in ["找", "搜尋", "推薦", "活動"]):
-            logger.info("Message is about event search, extracting parameters...")
-            # Extract search parameters with existing params
-            logger.info(f"Frontend search parameters: {search_params}")
-            extracted_params = await extract_search_params(message, search_params)
-            logger.info(f"Extracted search parameters: {extracted_params}")
-            
-            if extracted_params:
-                # Add p parameter to search params (EventGO API uses 'p' for pagination)
-                extracted_params['p'] = page
-                logger.info(f"Search parameters with page: {extracted_params}")
-                
-                logger.info("Searching for events with parameters...")
-                # Search for events
-                events = await recommend_events(extracted_params)
-                
-                # Format search parameters for display
-                formatted_params = []
-                if 'query' in extracted_params:
-                    formatted_params.append(f"🔍 關鍵字：{extracted_params['query']}")
-                if 'city' in extracted_params:
-                    formatted_params.append(f"📍 城市：{extracted_params['city']}")
-                if 'category' in extracted_params:
-                    formatted_params.append(f"🏷️ 類別：{extracted_params['category']}")
-                if 'from' in extracted_params:
-                    from_date = datetime.fromtimestamp(extracted_params['from'] / 1000)
-                    formatted_params.append(f"📅 開始日期：{from_date.strftime('%Y-%m-%d')}")
-                if 'to' in extracted_params:
-                    to_date = datetime.fromtimestamp(extracted_params['to'] / 1000)
-                    formatted_params.append(f"📅 結束日期：{to_date.strftime('%Y-%m-%d')}")
-                if 'type' in extracted_params:
-                    formatted_params.append(f"📋 活動類型：{extracted_params['type']}")
-                if 'sort' in extracted_params:
-                    sort_display = {
-                        '_score': '相關度',
-                        'start_time': '開始時間',
-                        'end_time': '結束時間',
-                        'updated_time': '更新時間',
-                        'distance': '距離'
-                    }.get(extracted_params['sort'], extracted_params['sort'])
-                    formatted_params.append(f"↕️ 排序方式：{sort_display}")
-                if 'asc' in extracted_params:
-                    formatted_params.append(f"↕️ 排序方向：{'升序' if extracted_params['asc'] else '降序'}")
-                if search_params and search_params.get('preserve_sort'):
-                    formatted_params.append("↕️ 排序方式：使用前端指定的排序")
-                if search_params and search_params.get('preserve_asc'):
-                    formatted_params.append("↕️ 排序方向：使用前端指定的方向")
-                
-                # Generate personalized response
-                logger.info("Generating personalized response...")
-                prompt = f"""根據以下搜尋結果，生成一個自然的回應：
-                搜尋參數：{json.dumps(extracted_params, ensure_ascii=False)}
-                搜尋結果：{json.dumps(events, ensure_ascii=False)}
-                
-                請包含以下內容：
-                1. 符合條件的活動數量（共找到 {events['pagination']['total_events']} 個活動，本頁顯示 {events['pagination']['current_page_count']} 個活動）
-                2. 主要活動類型和地點
-                3. 特別推薦的活動，每個活動請包含：
-                   - 活動名稱
-                   - 活動開始日期和結束日期（請將時間戳轉換為可讀的日期時間格式）
-                   - 活動地點
-                   - 城市（如果有）
-                   - 區域（如果有）
-                   - 類別（如果有）
-                   - 活動來源連結
-                
-                注意事項：
-                1. 日期時間格式請使用：YYYY-MM-DD
-                2. 連結請確保是完整的URL，不要因為括號造成連結錯誤
-                3. 如果活動沒有結束時間，只顯示開始時間
-                4. 活動地點顯示規則：
-                   - 如果活動有GPS座標（latitude和longitude），請使用以下格式：
-                     [地點名稱](https://www.google.com/maps/place/{{latitude}},{{longitude}})
-                     例如：如果活動的latitude是25.0150627，longitude是121.2188074，則連結應該是：
-                     [台北市立體育館](https://www.google.com/maps/place/25.0150627,121.2188074)
-                   - 如果活動沒有GPS座標，直接顯示地點名稱，不要添加任何連結
-                     例如：台北市立體育館
-                5. 城市、區域和類別請分別單獨顯示，格式為：
-                   城市：台北市
-                   區域：信義區
-                   類別：運動
-                6. 如果某項信息不存在，請不要顯示該項
-                7. 在回應開頭必須顯示總活動數和當前頁顯示的活動數，格式為：
-                   "共找到 {events['pagination']['total_events']} 個活動，本頁顯示 {events['pagination']['current_page_count']} 個活動"
-                
-                請以markdown格式返回，確保連結可以正常點擊。
-                """
-                
-                recommendation_response = client.chat.completions.create(
-                    model="gpt-4o",
-                    messages=[
-                        {"role": "system", "content": "你是一個專業的活動推薦助手，請根據搜尋結果生成詳細的活動推薦回應。"},
-                        {"role": "user", "content": prompt}
-                    ],
-                    temperature=0.7,
-                    max_tokens=1000
-                )
-                
-                # Add formatted search parameters to the response
-                formatted_response = recommendation_response.choices[0].message.content
-                if formatted_params:
-                    formatted_response += "\n\n### 搜尋條件\n" + "\n".join(formatted_params)
-                
-                logger.info("Generated personalized response")
-                logger.info(f"Pagination data in response: {json.dumps(events['pagination'], ensure_ascii=False, indent=2)}")
-                
-                response_data = {
-                    "message": formatted_response,
-                    "events": events,
-                    "search_params": extracted_params,
-                    "pagination": events['pagination']
-                }
-                
-                return response_data
-        
         return {
             "message": response_content,
             "events": None,
@@ -449,19 +643,73 @@ async def process_chat_message(message: str, chat_history: List[Dict[str, str]],
         logger.error(f"Error processing chat message: {str(e)}", exc_info=True)
         raise
 
+def _chat_messages(message: str, chat_history: List[Dict[str, str]]) -> List[Dict[str, str]]:
+    """Prepare messages for OpenAI（一般對話）"""
+    return [
+        {"role": "system", "content": SYSTEM_PROMPT},
+        *chat_history,
+        {"role": "user", "content": message}
+    ]
+
+def _sse(data: Dict[str, Any], event: str = "message") -> str:
+    """組成一筆 Server-Sent Events 訊息"""
+    return f"event: {event}\ndata: {orjson.dumps(data).decode()}\n\n"
+
+async def stream_chat_message(message: str, chat_history: List[Dict[str, str]], page: int = 1, search_params: Dict[str, Any] = None) -> AsyncIterator[str]:
+    """
+    以 Server-Sent Events 串流聊天回應
+    模型生成的文字以 message 事件逐段送出，結束時以 done 事件附上活動、搜尋參數與分頁資料
+    """
+    logger.info(f"Streaming chat message: {message}")
+    
+    try:
+        search = await _prepare_event_search(message, page, search_params)
+        if search is not None:
+            messages, max_tokens = search["messages"], 1000
+        else:
+            messages, max_tokens = _chat_messages(message, chat_history or []), 400
+        
+        stream = await aclient.chat.completions.create(
+            model="gpt-4o",
+            messages=messages,
+            temperature=0.7,
+            max_tokens=max_tokens,
+            stream=True
+        )
+        async for chunk in stream:
+            if chunk.choices and chunk.choices[0].delta.content:
+                yield _sse({"delta": chunk.choices[0].delta.content})
+        
+        if search is None:
+            yield _sse({"events": None, "search_params": None, "pagination": None}, "done")
+            return
+        
+        if search["conditions"]:
+            yield _sse({"delta": search["conditions"]})
+        events = search["events"]
+        yield _sse({
+            "events": events,
+            "search_params": search["search_params"],
+            "pagination": events['pagination']
+        }, "done")
+    except Exception as e:
+        logger.error(f"Error streaming chat message: {str(e)}", exc_info=True)
+        yield _sse({"error": str(e)}, "error")
+
 async def analyze_monthly_trends(category: str = "藝術") -> Dict[str, Any]:
     """
     Analyze monthly trends for a specific category using the date-histogram API
     """
     logger.info(f"Analyzing monthly trends for category: {category}")
-    end_date = datetime.now()
+    # 取到分鐘即可，讓同一分鐘內的查詢可共用快取
+    end_date = datetime.now().replace(second=0, microsecond=0)
     start_date = end_date - timedelta(days=180)  # 過去6個月
     
     try:
         logger.info("Fetching data from EventGO date-histogram API...")
-        response = await http_client.get(
-            f"{EVENTGO_API_BASE}/activity/date-histogram",
-            params={
+        data = await _eventgo_get(
+            "/activity/date-histogram",
+            {
                 "interval": "1M",  # 月度間隔
                 "group": "start_time",  # 按活動開始時間分組
                 "timezone": "Asia/Taipei",  # 台北時區
@@ -470,7 +718,6 @@ async def analyze_monthly_trends(category: str = "藝術") -> Dict[str, Any]:
                 "category": category,  # 指定類別
             }
         )
-        data = response.json()
         logger.info(f"Raw API response: {data}")
         
         # Handle empty data case
@@ -496,63 +743,49 @@ async def analyze_monthly_trends(category: str = "藝術") -> Dict[str, Any]:
         # Process data and create visualization
         logger.info("Creating visualization...")
         
-        # 轉換API回應格式為DataFrame
-        processed_data = []
-        for item in data:
-            # 將毫秒時間戳轉換為日期
-            timestamp_ms = item.get('key', 0)
-            date_obj = datetime.fromtimestamp(timestamp_ms / 1000)
-            month_str = date_obj.strftime('%Y-%m')
-            
-            processed_data.append({
-                'timestamp': timestamp_ms,
-                'key_as_string': item.get('key_as_string', ''),
-                'month': month_str,
-                'count': item.get('value', 0)
-            })
-        
-        df = pd.DataFrame(processed_data)
+        # 轉換API回應格式為DataFrame（整欄轉換，不逐筆建立 dict）
+        timestamps = np.fromiter((item.get('key', 0) for item in data), dtype=np.int64, count=len(data))
+        counts = np.fromiter((item.get('value', 0) for item in data), dtype=np.int64, count=len(data))
+        # 將毫秒時間戳轉換為月份（依查詢時指定的台北時區分組），直接在 DatetimeIndex 上一次轉換
+        months = pd.to_datetime(timestamps, unit='ms', utc=True).tz_convert('Asia/Taipei').strftime('%Y-%m')
+        df = pd.DataFrame({'month': months, 'count': counts, 'timestamp': timestamps})
         logger.info(f"Processed DataFrame shape: {df.shape}")
         logger.info(f"DataFrame data: {df}")
         
         # 創建月度趨勢圖
-        plt.figure(figsize=(12, 6))
-        sns.barplot(data=df, x='month', y='count', palette='viridis')
-        plt.xticks(rotation=45)
-        plt.title(f'{category}活動月度分布趨勢', fontsize=16, pad=20)
-        plt.xlabel('月份', fontsize=12)
-        plt.ylabel('活動數量', fontsize=12)
-        plt.grid(axis='y', alpha=0.3)
+        _AX.clear()
+        sns.barplot(data=df, x='month', y='count', palette='viridis', ax=_AX)
+        _AX.tick_params(axis='x', rotation=45)
+        _AX.set_title(f'{category}活動月度分布趨勢', fontsize=16, pad=20)
+        _AX.set_xlabel('月份', fontsize=12)
+        _AX.set_ylabel('活動數量', fontsize=12)
+        _AX.grid(axis='y', alpha=0.3)
         
         # 添加數值標籤
-        for i, v in enumerate(df['count']):
-            plt.text(i, v + max(df['count']) * 0.01, str(int(v)), 
-                    ha='center', va='bottom', fontsize=10)
+        _AX.bar_label(_AX.containers[0], fontsize=10)
         
         # Convert plot to base64
-        img = io.BytesIO()
-        plt.savefig(img, format='png', bbox_inches='tight', dpi=150)
-        img.seek(0)
-        plot_url = base64.b64encode(img.getvalue()).decode()
-        plt.close()
+        plot_url = _render_figure(dpi=150)
         logger.info("Visualization created successfully")
         
-        # Generate trend analysis
-        total_events = int(df['count'].sum())
-        average_events = float(df['count'].mean()) if not df.empty else 0
+        # Generate trend analysis（直接在 NumPy 陣列上計算，並重用轉成 list 的結果）
+        months = months.tolist()
+        count_list = counts.tolist()
+        total_events = int(counts.sum())
+        average_events = total_events / len(count_list) if count_list else 0
         
         max_month_data = None
         min_month_data = None
-        if not df.empty:
-            max_idx = df['count'].idxmax()
-            min_idx = df['count'].idxmin()
+        if count_list:
+            max_idx = int(counts.argmax())
+            min_idx = int(counts.argmin())
             max_month_data = {
-                'month': df.loc[max_idx, 'month'],
-                'count': int(df.loc[max_idx, 'count'])
+                'month': months[max_idx],
+                'count': count_list[max_idx]
             }
             min_month_data = {
-                'month': df.loc[min_idx, 'month'],
-                'count': int(df.loc[min_idx, 'count'])
+                'month': months[min_idx],
+                'count': count_list[min_idx]
             }
         
         trend_analysis = {
@@ -560,7 +793,10 @@ async def analyze_monthly_trends(category: str = "藝術") -> Dict[str, Any]:
             "average_events": round(average_events, 1),
             "max_month": max_month_data,
             "min_month": min_month_data,
-            "monthly_data": df[['month', 'count']].to_dict('records'),
+            "monthly_data": [
+                {'month': month, 'count': count}
+                for month, count in zip(months, count_list)
+            ],
             "time_period": {
                 "start": start_date.strftime('%Y-%m-%d'),
                 "end": end_date.strftime('%Y-%m-%d')
@@ -619,27 +855,20 @@ async def analyze_geographic_distribution(category: str = "藝術") -> Dict[str,
         if category and category != "全部":
             api_params["category"] = category
         
-        response = await http_client.get(
-            f"{EVENTGO_API_BASE}/activity/histogram",
-            params=api_params
-        )
-        data = response.json()
+        data = await _eventgo_get("/activity/histogram", api_params)
         logger.info("Data fetched successfully")
         
         # Create visualization
         logger.info("Creating visualization...")
         df = pd.DataFrame(data)
         category_text = "全部" if category == "全部" or not category else category
-        plt.figure(figsize=(12, 6))
-        sns.barplot(data=df, x='key', y='value')
-        plt.xticks(rotation=45)
-        plt.title(f'{category_text} Events Distribution by City')
+        _AX.clear()
+        sns.barplot(data=df, x='key', y='value', ax=_AX)
+        _AX.tick_params(axis='x', rotation=45)
+        _AX.set_title(f'{category_text} Events Distribution by City')
         
         # Convert plot to base64
-        img = io.BytesIO()
-        plt.savefig(img, format='png', bbox_inches='tight')
-        img.seek(0)
-        plot_url = base64.b64encode(img.getvalue()).decode()
+        plot_url = _render_figure()
         logger.info("Visualization created successfully")
         
         return {
@@ -654,7 +883,7 @@ async def recommend_events(preferences: Dict[str, Any]) -> Dict[str, Any]:
     """
     Recommend events based on user preferences
     """
-    logger.info(f"Recommending events with preferences: {preferences}")
+    logger.info("Recommending events with preferences: %s", preferences)
     try:
         # 確保有必要的分頁參數
         if 'num' not in preferences:
@@ -664,39 +893,31 @@ async def recommend_events(preferences: Dict[str, Any]) -> Dict[str, Any]:
         if 'p' not in preferences:
             preferences['p'] = 1
         
-        logger.info(f"Final API parameters: {preferences}")
+        logger.info("Final API parameters: %s", preferences)
         
         logger.info("Fetching events from EventGO API...")
-        response = await http_client.get(
-            f"{EVENTGO_API_BASE}/activity",
-            params=preferences
-        )
-        data = response.json()
-        logger.info(f"API Response status: {response.status_code}")
-        logger.info(f"API Response data keys: {list(data.keys()) if isinstance(data, dict) else 'Not a dict'}")
+        data = await _eventgo_get("/activity", preferences)
+        if logger.isEnabledFor(logging.INFO):
+            logger.info("API Response data keys: %s", list(data.keys()) if isinstance(data, dict) else 'Not a dict')
         
         # Get events and total count from API response
         events = data.get('events', [])
         total_events = data.get('count', 0)
         query_time = data.get('queryTime', 0)
         
-        logger.info(f"Total events from API: {total_events}")
-        logger.info(f"Number of events in response: {len(events)}")
+        logger.info("Total events from API: %s", total_events)
+        logger.info("Number of events in response: %s", len(events))
         
         # 獲取分頁參數
         current_page = preferences.get('p', 1)
         events_per_page = preferences.get('num', 5)
         
-        # 計算總頁數
-        total_pages = max(1, (total_events + events_per_page - 1) // events_per_page)
+        # 計算總頁數（無條件進位；沒有活動時仍視為 1 頁）
+        total_pages = -(-total_events // events_per_page) if total_events > 0 else 1
         current_page_count = len(events)
         
         # Filter out unnecessary fields from each event
-        filtered_events = []
-        for event in events:
-            # Create a copy of the event without heavy fields
-            filtered_event = {k: v for k, v in event.items() if k not in ['description', 'highlight_description', 'imgs']}
-            filtered_events.append(filtered_event)
+        filtered_events = [{k: v for k, v in event.items() if k not in _DROP_FIELDS} for event in events]
         
         # Create pagination data
         pagination_data = {
@@ -707,7 +928,7 @@ async def recommend_events(preferences: Dict[str, Any]) -> Dict[str, Any]:
             'current_page_count': current_page_count
         }
         
-        logger.info(f"Created pagination data: {pagination_data}")
+        logger.info("Created pagination data: %s", pagination_data)
         
         # Create response with filtered events and pagination
         result = {
@@ -717,19 +938,42 @@ async def recommend_events(preferences: Dict[str, Any]) -> Dict[str, Any]:
             'pagination': pagination_data
         }
         
-        logger.info(f"Returning {len(filtered_events)} events for page {current_page}")
+        logger.info("Returning %s events for page %s", len(filtered_events), current_page)
         return result
     except Exception as e:
         logger.error(f"Error recommending events: {str(e)}", exc_info=True)
         raise
 
-def generate_analysis_report(data: Dict[str, Any]) -> str:
+# 沒有任何數據時直接回傳的報告
+_EMPTY_REPORT_TEMPLATE = "## 活動分析報告\n\n目前的{sections}數據中沒有任何活動，暫時無法產生分析報告。請稍後再試或調整查詢條件。"
+_REPORT_SECTION_NAMES = MappingProxyType({
+    "monthly_trends": "月度趨勢",
+    "geographic_distribution": "地理分布"
+})
+
+def _is_empty_report_data(data: Dict[str, Any]) -> bool:
+    """判斷報告數據是否完全沒有活動（每個區段都是空的，或所有統計值皆為 0）"""
+    if not all(isinstance(records, list) for records in data.values()):
+        return False
+    return not any(
+        isinstance(item, dict) and item.get('value')
+        for records in data.values()
+        for item in records
+    )
+
+async def generate_analysis_report(data: Dict[str, Any]) -> str:
     """
     Generate a natural language analysis report
     """
     logger.info("Generating analysis report...")
+    # 所有區段都沒有活動數量時，報告只會是空泛的文字，不值得一次模型呼叫
+    if _is_empty_report_data(data):
+        logger.info("No activity data for report, returning templated report")
+        sections = "、".join(_REPORT_SECTION_NAMES.get(key, key) for key in data) or "分析"
+        return _EMPTY_REPORT_TEMPLATE.format(sections=sections)
+    
     prompt = f"""請根據以下數據生成一份活動分析報告：
-    {json.dumps(data, ensure_ascii=False, indent=2)}
+    {orjson.dumps(data, option=orjson.OPT_INDENT_2, default=str).decode()}
     
     請包含以下內容：
     1. 活動總體趨勢
@@ -739,8 +983,9 @@ def generate_analysis_report(data: Dict[str, Any]) -> str:
     """
     
     try:
-        response = client.chat.completions.create(
-            model="gpt-4o",
+        # 報告是敘述性文字，不需要推理能力，使用較小的模型即可
+        response = await aclient.chat.completions.create(
+            model="gpt-4o-mini",
             messages=[
                 {"role": "system", "content": "你是一個專業的活動分析師，請根據數據生成詳細的分析報告。"},
                 {"role": "user", "content": prompt}
@@ -1,18 +1,23 @@
 from fastapi import FastAPI, HTTPException, Depends, Request
+from fastapi.responses import ORJSONResponse, StreamingResponse
 from fastapi.middleware.cors import CORSMiddleware
 from pydantic import BaseModel, Field
 from typing import List, Optional, Dict, Any
+import asyncio
 import httpx
 from datetime import datetime, timedelta
 import pandas as pd
+import matplotlib
+matplotlib.use('Agg')  # 伺服器端只輸出圖片，不需要互動式後端
 import matplotlib.pyplot as plt
 import seaborn as sns
 import io
 import base64
 import uuid
 import uvicorn
-from sqlalchemy.orm import Session
-from database import get_db, ChatSession, ChatMessage, Base, engine, get_or_create_session, add_message_to_session
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+from database import get_db, ChatSession, ChatMessage, init_db, engine, get_or_create_session, add_messages_to_session, now_ms, ms_to_iso
 from utils.config import (
     API_PREFIX,
     API_TITLE,
@@ -23,6 +28,7 @@ from utils.config import (
 )
 from llm_handler import (
     process_chat_message,
+    stream_chat_message,
     analyze_monthly_trends,
     analyze_geographic_distribution,
     recommend_events,
@@ -32,11 +38,9 @@ from utils.logger import logger
 import json
 from pydantic import validator
 from core.agent import Agent
-
-# Create database tables
-logger.info("Creating database tables...")
-Base.metadata.create_all(bind=engine)
-logger.info("Database tables created successfully")
+from services.user_profile_db_service import flush_pending_behaviors
+from core.handlers.analysis_handler import clear_analysis_cache
+from core.http import shared_http_client
 
 # Initialize FastAPI app
 logger.info("Initializing FastAPI application...")
@@ -44,7 +48,8 @@ app = FastAPI(
     title=API_TITLE,
     description=API_DESCRIPTION,
     version=API_VERSION,
-    prefix=API_PREFIX
+    prefix=API_PREFIX,
+    default_response_class=ORJSONResponse  # 以 orjson 序列化回應，較標準庫 json 快
 )
 logger.info("FastAPI application initialized successfully")
 
@@ -67,12 +72,23 @@ logger.info("Global httpx client initialized successfully")
 @app.on_event("startup")
 async def startup_event():
     logger.info("Starting up application...")
+    # Create database tables
+    logger.info("Creating database tables...")
+    await init_db()
+    logger.info("Database tables created successfully")
 
 @app.on_event("shutdown")
 async def shutdown_event():
     logger.info("Shutting down application...")
     await http_client.aclose()
     logger.info("Global httpx client closed successfully")
+    await shared_http_client.aclose()
+    logger.info("Shared handler httpx client closed successfully")
+    # 寫入尚在佇列中的用戶互動行為，必須在釋放資料庫引擎之前
+    await flush_pending_behaviors()
+    logger.info("Pending user behaviors flushed successfully")
+    await engine.dispose()
+    logger.info("Database engine disposed successfully")
 
 # 添加獲取客戶端 IP 的依賴函數
 def get_client_ip(request: Request) -> str:
@@ -127,7 +143,9 @@ class EventSearchResponse(BaseModel):
 class Pagination(BaseModel):
     current_page: int = Field(default=1, description="當前頁碼")
     events_per_page: int = Field(default=5, description="每頁顯示的事件數量")
-    total_events: int = Field(default=0, description="總事件數量")
+    total_events: Optional[int] = Field(default=0, description="總事件數量；游標分頁時不計算，為 None")
+    has_more: Optional[bool] = Field(default=None, description="游標分頁：是否還有下一頁")
+    next_cursor: Optional[Dict[str, Any]] = Field(default=None, description="游標分頁：下一頁放入 search_params 的 after_start_time / after_ids")
 
 class ChatMessageRequest(BaseModel):
     message: str
@@ -211,14 +229,14 @@ async def root():
 async def chat(
     request: ChatMessageRequest,
     client_ip: str = Depends(get_client_ip),
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_db)
 ):
     try:
         # 獲取或創建會話
         session = await get_or_create_session(db, client_ip, request.session_id)
         
-        # 保存用戶消息
-        await add_message_to_session(db, session, "user", request.message)
+        # 用戶消息與助手回覆在回合結束時一併寫入，先記下收到用戶消息的時間
+        user_message = {"role": "user", "content": request.message, "created_at": now_ms()}
         
         # 初始化Agent
         agent = Agent(session_id=session.session_id)
@@ -232,8 +250,11 @@ async def chat(
             search_params=request.search_params
         )
         
-        # 保存助手回覆
-        await add_message_to_session(db, session, "assistant", response.get("message", ""))
+        # 保存用戶消息與助手回覆（單次提交）
+        await add_messages_to_session(db, session, [
+            user_message,
+            {"role": "assistant", "content": response.get("message", "")}
+        ])
         
         logger.info(f"Chat response generated for session {session.session_id}")
         
@@ -255,24 +276,40 @@ async def chat(
         logger.error(f"Error in chat endpoint: {str(e)}")
         raise HTTPException(status_code=500, detail=f"處理聊天訊息時發生錯誤: {str(e)}")
 
+@app.post("/api/chat/stream")
+async def chat_stream(request: ChatMessageRequest):
+    """
+    以 Server-Sent Events 串流聊天回應，模型生成的文字會即時送出
+    """
+    logger.info(f"Streaming chat response for session {request.session_id}")
+    return StreamingResponse(
+        stream_chat_message(
+            request.message,
+            request.chat_history or [],
+            page=request.page,
+            search_params=request.search_params
+        ),
+        media_type="text/event-stream"
+    )
+
 @app.get("/api/chat/history/latest")
 async def get_latest_chat_history(
     client_ip: str = Depends(get_client_ip),
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_db)
 ):
     """
     獲取該 IP 最近的未滿會話歷史
     """
     try:
         # 查找該 IP 的最新未滿會話
-        session = (
-            db.query(ChatSession)
-            .filter(
+        session = await db.scalar(
+            select(ChatSession)
+            .where(
                 ChatSession.ip_address == client_ip,
                 ChatSession.message_count < 20
             )
             .order_by(ChatSession.updated_at.desc())
-            .first()
+            .limit(1)
         )
         
         if not session:
@@ -282,14 +319,19 @@ async def get_latest_chat_history(
                 "message_count": 0
             }
         
-        # 獲取會話消息
+        # 獲取會話消息（非同步 session 不支援延遲載入，明確查詢）
+        session_messages = await db.scalars(
+            select(ChatMessage)
+            .where(ChatMessage.session_id == session.session_id)
+            .order_by(ChatMessage.created_at)
+        )
         messages = [
             {
                 "role": msg.role,
                 "content": msg.content,
-                "timestamp": msg.created_at.isoformat()
+                "timestamp": ms_to_iso(msg.created_at)
             }
-            for msg in session.messages
+            for msg in session_messages
         ]
         
         return {
@@ -306,22 +348,22 @@ async def get_latest_chat_history(
 async def get_chat_history(
     session_id: str,
     client_ip: str = Depends(get_client_ip),
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_db)
 ):
     try:
         # 驗證會話是否屬於當前客戶端
-        session = db.query(ChatSession).filter(
+        session = await db.scalar(select(ChatSession).where(
             ChatSession.session_id == session_id,
             ChatSession.client_ip == client_ip
-        ).first()
+        ))
         
         if not session:
             raise HTTPException(status_code=404, detail="會話不存在或無權限訪問")
         
         # 獲取會話的所有消息
-        messages = db.query(ChatMessage).filter(
+        messages = (await db.scalars(select(ChatMessage).where(
             ChatMessage.session_id == session_id
-        ).order_by(ChatMessage.timestamp).all()
+        ).order_by(ChatMessage.timestamp))).all()
         
         # 格式化消息
         formatted_messages = []
@@ -335,8 +377,8 @@ async def get_chat_history(
         return {
             "session_id": session_id,
             "messages": formatted_messages,
-            "created_at": session.created_at.isoformat(),
-            "updated_at": session.updated_at.isoformat()
+            "created_at": ms_to_iso(session.created_at),
+            "updated_at": ms_to_iso(session.updated_at)
         }
         
     except HTTPException:
@@ -349,16 +391,16 @@ async def get_chat_history(
 async def get_user_profile(
     session_id: str,
     client_ip: str = Depends(get_client_ip),
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_db),
     integrated: bool = False  # 新增參數，是否返回整合畫像
 ):
     """獲取用戶畫像信息"""
     try:
         # 驗證會話是否屬於當前客戶端
-        session = db.query(ChatSession).filter(
+        session = await db.scalar(select(ChatSession).where(
             ChatSession.session_id == session_id,
             ChatSession.ip_address == client_ip
-        ).first()
+        ))
         
         if not session:
             raise HTTPException(status_code=404, detail="會話不存在或無權限訪問")
@@ -395,7 +437,7 @@ async def get_user_profile(
 @app.get("/api/user-profile-integrated")
 async def get_integrated_user_profile(
     client_ip: str = Depends(get_client_ip),
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_db)
 ):
     """獲取整合的跨session用戶畫像"""
     try:
@@ -462,6 +504,15 @@ async def get_geographic_analysis():
         logger.error(f"Error in geographic analysis: {str(e)}", exc_info=True)
         raise HTTPException(status_code=500, detail=str(e))
 
+@app.delete("/api/analysis/cache")
+async def clear_analysis_cache_endpoint():
+    """
+    Clear cached analysis results so the next request fetches fresh data
+    """
+    logger.info("Clearing analysis cache")
+    clear_analysis_cache()
+    return {"success": True}
+
 @app.post("/api/recommend")
 async def get_recommendations(preferences: EventSearchParams):
     """
@@ -483,11 +534,12 @@ async def get_analysis_report():
     """
     logger.info("Generating comprehensive analysis report")
     try:
-        # Get data for analysis
-        logger.info("Retrieving monthly trends data...")
-        monthly_data = await analyze_monthly_trends()
-        logger.info("Retrieving geographic distribution data...")
-        geo_data = await analyze_geographic_distribution()
+        # Get data for analysis（兩個 EventGO 查詢互不相依，並行取得）
+        logger.info("Retrieving monthly trends and geographic distribution data...")
+        monthly_data, geo_data = await asyncio.gather(
+            analyze_monthly_trends(),
+            analyze_geographic_distribution()
+        )
         
         # Combine data for report
         analysis_data = {
@@ -497,7 +549,7 @@ async def get_analysis_report():
         
         # Generate report
         logger.info("Generating report from combined data...")
-        report = generate_analysis_report(analysis_data)
+        report = await generate_analysis_report(analysis_data)
         logger.info("Analysis report generated successfully")
         
         return {
@@ -573,5 +625,11 @@ async def get_activity_date_histogram(request: Request):
         raise HTTPException(status_code=500, detail=str(e))
 
 if __name__ == "__main__":
-    logger.info("Starting Event Chatbot API server...")
-    uvicorn.run(app, host="0.0.0.0", port=8000) 
\ No newline at end of file
+    # 有安裝 uvloop 時使用其事件迴圈，降低並行分析請求的 I/O 系統呼叫開銷（Windows 不支援 uvloop）
+    try:
+        import uvloop  # noqa: F401
+        loop = "uvloop"
+    except ImportError:
+        loop = "asyncio"
+    logger.info(f"Starting Event Chatbot API server with {loop} event loop...")
+    uvicorn.run(app, host="0.0.0.0", port=8000, loop=loop) 
\ No newline at end of file
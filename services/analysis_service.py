@@ -1,13 +1,17 @@
-from typing import Dict, Any, List
+from typing import Dict, Any, List, Tuple
 import json
-from openai import OpenAI
+from openai import AsyncOpenAI
 from openai.types.chat import ChatCompletion
 import openai
 from utils.config import OPENAI_API_KEY
 from utils.logger import logger
 from services.filter_service import ChatHistoryFilterService
 
-client = OpenAI(api_key=OPENAI_API_KEY)
+# 非同步客戶端：分析服務都在協程中呼叫，等待模型時不會阻塞事件迴圈
+aclient = AsyncOpenAI(api_key=OPENAI_API_KEY)
+
+# 意圖分析使用的模型（同時作為意圖快取鍵的版本，更換模型時快取自動失效）
+INTENT_MODEL = "gpt-4"
 
 class IntentAnalysisService:
     """意圖分析服務"""
@@ -17,6 +21,15 @@ class IntentAnalysisService:
         """
         分析用戶意圖
         """
+        intent, _ = await IntentAnalysisService.resolve_user_intent(message, chat_history)
+        return intent
+
+    @staticmethod
+    async def resolve_user_intent(message: str, chat_history: List[Dict[str, Any]] = None) -> Tuple[str, bool]:
+        """
+        分析用戶意圖，回傳 (意圖, 是否由模型判斷)
+        模型無法使用時改用關鍵詞判斷，這類暫時性的結果不應被快取
+        """
         try:
             # 過濾聊天歷史中的 markdown 搜尋結果
             filtered_history = ChatHistoryFilterService.filter_markdown_from_chat_history(chat_history) if chat_history else []
@@ -43,8 +56,8 @@ class IntentAnalysisService:
             請只返回意圖類別，不要添加其他文字。
             """
             
-            response = client.chat.completions.create(
-                model="gpt-4",
+            response = await aclient.chat.completions.create(
+                model=INTENT_MODEL,
                 messages=[
                     {"role": "system", "content": "你是一個專業的意圖分析助手，請準確識別用戶的意圖。"},
                     {"role": "user", "content": prompt}
@@ -56,14 +69,14 @@ class IntentAnalysisService:
             
             intent = response.choices[0].message.content.strip()
             logger.info(f"Analyzed user intent: {intent}")
-            return intent
+            return intent, True
             
         except (openai.APIConnectionError, openai.APITimeoutError) as e:
             logger.warning(f"OpenAI API connection error, using fallback intent analysis: {str(e)}")
-            return IntentAnalysisService._fallback_intent_analysis(message)
+            return IntentAnalysisService._fallback_intent_analysis(message), False
         except Exception as e:
             logger.error(f"Error analyzing user intent: {str(e)}")
-            return IntentAnalysisService._fallback_intent_analysis(message)
+            return IntentAnalysisService._fallback_intent_analysis(message), False
 
     @staticmethod
     def _fallback_intent_analysis(message: str) -> str:
@@ -131,7 +144,7 @@ class SentimentAnalysisService:
             請只返回情感類別，不要添加其他文字。
             """
             
-            response = client.chat.completions.create(
+            response = await aclient.chat.completions.create(
                 model="gpt-4",
                 messages=[
                     {"role": "system", "content": "你是一個專業的情感分析助手，請準確識別用戶的情感狀態。"},
@@ -215,7 +228,7 @@ class EntityExtractionService:
             請直接返回JSON格式，不要添加任何markdown標記或其他文字。
             """
             
-            response = client.chat.completions.create(
+            response = await aclient.chat.completions.create(
                 model="gpt-4",
                 messages=[
                     {"role": "system", "content": "你是一個專業的實體提取助手，請準確提取用戶訊息中的實體信息。"},
@@ -315,7 +328,7 @@ class InterestAnalysisService:
             請以JSON陣列格式返回興趣類別，例如：["藝術文化", "音樂娛樂"]
             """
             
-            response = client.chat.completions.create(
+            response = await aclient.chat.completions.create(
                 model="gpt-4",
                 messages=[
                     {"role": "system", "content": "你是一個專業的興趣分析助手，請準確識別用戶的興趣偏好。"},
@@ -1,12 +1,13 @@
 from typing import Dict, Any, List, Optional
 import json
 from datetime import datetime
-from openai import OpenAI
+from openai import AsyncOpenAI
 import openai
 from utils.config import OPENAI_API_KEY
 from utils.logger import logger
 
-client = OpenAI(api_key=OPENAI_API_KEY)
+# 非同步客戶端：對話階段分析與意圖分析並行執行，等待模型時不能阻塞事件迴圈
+aclient = AsyncOpenAI(api_key=OPENAI_API_KEY)
 
 class ConversationStageService:
     """對話階段分析服務"""
@@ -67,7 +68,7 @@ class ConversationStageService:
             請只返回階段名稱（opening/exploring/clarifying/searching/recommending/deciding/closing）。
             """
             
-            response = client.chat.completions.create(
+            response = await aclient.chat.completions.create(
                 model="gpt-4",
                 messages=[
                     {"role": "system", "content": "你是一個專業的對話分析師，請準確識別對話階段。"},
@@ -1,48 +1,110 @@
-from typing import Dict, Any, List, Optional
+from typing import Dict, Any, List, Optional, Tuple
+import asyncio
+import copy
+import hashlib
 import json
-from datetime import datetime, timedelta
-from sqlalchemy.orm import Session
-from sqlalchemy import and_, desc, func
-from openai import OpenAI
+from collections import Counter
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy import and_, desc, func, insert, select
+from sqlalchemy.exc import IntegrityError
+from cachetools import TTLCache
+from openai import AsyncOpenAI
 import openai
 from utils.config import OPENAI_API_KEY
 from utils.logger import logger
-from database import UserProfile, UserInterest, UserPreference, UserBehavior, UserFeedback, ChatSession
+from utils.keyword_matcher import KeywordMatcher
+from database import SessionLocal, UserProfile, UserInterest, UserPreference, UserBehavior, UserFeedback, ChatSession, now_ms, ms_to_iso
 
-client = OpenAI(api_key=OPENAI_API_KEY)
+# 非同步客戶端：等待模型回應時不會阻塞事件迴圈，也不佔用預設執行緒池
+aclient = AsyncOpenAI(api_key=OPENAI_API_KEY)
+
+# 備用對話分析的關鍵字（依優先順序）
+_FALLBACK_INTEREST_KEYWORDS = (
+    ("藝術", ("藝術", "展覽", "美術", "畫展", "藝文", "博物館")),
+    ("音樂", ("音樂", "演唱會", "音樂會", "演出", "表演")),
+    ("運動", ("運動", "健身", "瑜伽", "跑步", "球類")),
+    ("美食", ("美食", "餐廳", "料理", "烹飪", "品酒")),
+    ("學習", ("學習", "課程", "講座", "工作坊", "研習")),
+    ("親子", ("親子", "兒童", "家庭", "小孩", "孩子")),
+    ("戶外", ("戶外", "野餐", "露營", "踏青", "自然")),
+    ("社交", ("社交", "聚會", "交友", "派對", "聯誼")),
+)
+_FALLBACK_LOCATIONS = ("台北", "新北", "桃園", "台中", "台南", "高雄")
+_SOCIAL_INDICATORS = ("朋友", "一起", "團體", "大家", "聚會")
+_ADVENTURE_INDICATORS = ("新", "特別", "有趣", "刺激", "體驗")
+
+# 整段對話歷史只需掃描一次即可取得興趣、地點、社交與冒險指標
+_FALLBACK_MATCHER = KeywordMatcher(
+    [(keyword, ("interest", category)) for category, keywords in _FALLBACK_INTEREST_KEYWORDS for keyword in keywords]
+    + [(location, ("location", location)) for location in _FALLBACK_LOCATIONS]
+    + [(indicator, "social") for indicator in _SOCIAL_INDICATORS]
+    + [(indicator, "adventure") for indicator in _ADVENTURE_INDICATORS]
+)
+
+# 互動行為的延遲批次寫入：累積到指定筆數或等待指定秒數後一次寫入
+_BEHAVIOR_FLUSH_SIZE = 100
+_BEHAVIOR_FLUSH_INTERVAL = 0.05
+
+# 待寫入的互動行為：(session_id, 行為數據, 時間戳記)
+# 每個請求都會建立新的服務實例，因此佇列與寫入工作放在模組層級共用，並由 main.py 在關閉時寫入剩餘行為
+_behavior_queue: List[Tuple[str, Dict[str, Any], int]] = []
+_behavior_lock = asyncio.Lock()
+_flush_task: Optional[asyncio.Task] = None
+
+# 組好的用戶畫像短暫快取（session_id -> 畫像），跨請求共用，寫入提交後由 invalidate_profile 立即失效
+_profile_cache = TTLCache(maxsize=1024, ttl=5)
+# 每次失效都會遞增；讀取期間若發生失效，讀到的可能是寫入前的數據，不放入快取
+_profile_generation = 0
+
+# 已分析過的用戶訊息摘要（session_id -> 摘要集合），沒有新訊息時略過重複分析；同樣跨請求共用
+_analyzed_turns = TTLCache(maxsize=1024, ttl=3600)
 
 class UserProfileDBService:
     """資料庫版本的用戶畫像服務"""
     
-    def __init__(self):
-        pass
+    def invalidate_profile(self, session_id: str):
+        """讓指定 session 的畫像快取失效（所有服務實例共用同一份快取）"""
+        global _profile_generation
+        _profile_generation += 1
+        _profile_cache.pop(session_id, None)
     
-    async def get_user_profile(self, db: Session, session_id: str) -> Dict[str, Any]:
+    async def get_user_profile(self, db: AsyncSession, session_id: str) -> Dict[str, Any]:
         """從資料庫獲取用戶畫像"""
+        cached = _profile_cache.get(session_id)
+        if cached is not None:
+            # 回傳深層複本，呼叫端修改巢狀的興趣或偏好時不會影響快取
+            return copy.deepcopy(cached)
+        generation = _profile_generation
+        
         try:
             # 查找或創建用戶畫像
-            profile = db.query(UserProfile).filter(UserProfile.session_id == session_id).first()
+            profile = await db.scalar(select(UserProfile).where(UserProfile.session_id == session_id))
             
             if not profile:
                 profile = await self._create_user_profile(db, session_id)
             
+            interests = await self._get_user_interests(db, profile.id)
+            
             # 構建完整的用戶畫像數據
             profile_data = {
                 "session_id": profile.session_id,
                 "visit_count": profile.visit_count,
                 "total_interactions": profile.total_interactions,
                 "satisfaction_score": profile.satisfaction_score,
-                "last_activity": profile.last_activity.isoformat() if profile.last_activity else None,
-                "created_at": profile.created_at.isoformat() if profile.created_at else None,
+                "last_activity": ms_to_iso(profile.last_activity),
+                "created_at": ms_to_iso(profile.created_at),
                 "personality_traits": profile.personality_traits or {},
                 "communication_style": profile.communication_style or {},
                 "engagement_patterns": profile.engagement_patterns or {},
-                "interests": await self._get_user_interests(db, profile.id),
+                "interests": interests,
+                "interest_names": [interest["interest"] for interest in interests],  # 正規化的興趣名稱列表
                 "activity_preferences": await self._get_user_preferences(db, profile.id),
                 "recent_behaviors": await self._get_recent_behaviors(db, profile.id),
                 "feedback_history": await self._get_feedback_history(db, profile.id)
             }
             
+            if generation == _profile_generation:
+                _profile_cache[session_id] = copy.deepcopy(profile_data)
             return profile_data
             
         except Exception as e:
@@ -51,7 +113,7 @@ class UserProfileDBService:
     
     async def update_user_profile(
         self, 
-        db: Session,
+        db: AsyncSession,
         session_id: str, 
         new_data: Dict[str, Any],
         update_type: str = "general"
@@ -59,50 +121,84 @@ class UserProfileDBService:
         """更新用戶畫像到資料庫"""
         try:
             # 獲取或創建用戶畫像
-            profile = db.query(UserProfile).filter(UserProfile.session_id == session_id).first()
+            profile = await db.scalar(select(UserProfile).where(UserProfile.session_id == session_id))
             if not profile:
                 profile = await self._create_user_profile(db, session_id)
             
             # 根據更新類型處理不同的數據
-            if update_type == "interests":
-                await self._update_interests_db(db, profile.id, new_data)
-            elif update_type == "preferences":
-                await self._update_preferences_db(db, profile.id, new_data)
-            elif update_type == "behavior":
-                await self._record_behavior(db, profile.id, new_data)
-            elif update_type == "feedback":
-                await self._record_feedback(db, profile.id, new_data)
-            elif update_type == "personality":
-                profile.personality_traits = {**(profile.personality_traits or {}), **new_data.get("personality_traits", {})}
-                profile.communication_style = {**(profile.communication_style or {}), **new_data.get("communication_style", {})}
-                profile.engagement_patterns = {**(profile.engagement_patterns or {}), **new_data.get("engagement_patterns", {})}
-            else:
-                # 一般性更新
-                if "visit_count" in new_data:
-                    profile.visit_count = new_data["visit_count"]
-                if "total_interactions" in new_data:
-                    profile.total_interactions = new_data["total_interactions"]
-                if "satisfaction_score" in new_data:
-                    profile.satisfaction_score = new_data["satisfaction_score"]
+            await self._apply_update(db, profile, new_data, update_type)
             
             # 更新最後活動時間
-            profile.last_activity = datetime.utcnow()
-            profile.updated_at = datetime.utcnow()
+            profile.last_activity = now_ms()
+            profile.updated_at = now_ms()
             
-            db.commit()
-            db.refresh(profile)
+            await db.commit()
+            self.invalidate_profile(session_id)
+            await db.refresh(profile)
             
             logger.info(f"Updated user profile in database for session {session_id}")
             return await self.get_user_profile(db, session_id)
             
         except Exception as e:
             logger.error(f"Error updating user profile in database: {str(e)}")
-            db.rollback()
+            await db.rollback()
             return await self.get_user_profile(db, session_id)
     
+    async def update_user_profile_bulk(
+        self,
+        db: AsyncSession,
+        session_id: str,
+        updates: List[Tuple[str, Dict[str, Any]]]
+    ) -> Dict[str, Any]:
+        """批次更新用戶畫像，所有 (更新類型, 數據) 在同一個交易中寫入並只提交一次"""
+        try:
+            profile = await db.scalar(select(UserProfile).where(UserProfile.session_id == session_id))
+            if not profile:
+                profile = await self._create_user_profile(db, session_id)
+            
+            for update_type, new_data in updates:
+                await self._apply_update(db, profile, new_data, update_type)
+            
+            profile.last_activity = now_ms()
+            profile.updated_at = now_ms()
+            
+            await db.commit()
+            self.invalidate_profile(session_id)
+            
+            logger.info(f"Bulk updated user profile in database for session {session_id} ({len(updates)} updates)")
+            return await self.get_user_profile(db, session_id)
+            
+        except Exception as e:
+            logger.error(f"Error bulk updating user profile in database: {str(e)}")
+            await db.rollback()
+            return await self.get_user_profile(db, session_id)
+    
+    async def _apply_update(self, db: AsyncSession, profile: UserProfile, new_data: Dict[str, Any], update_type: str):
+        """依更新類型將數據寫入目前的交易（不提交，由呼叫端統一 commit）"""
+        if update_type == "interests":
+            await self._update_interests_db(db, profile.id, new_data)
+        elif update_type == "preferences":
+            await self._update_preferences_db(db, profile.id, new_data)
+        elif update_type == "behavior":
+            self._record_behavior(db, profile.id, new_data)
+        elif update_type == "feedback":
+            self._record_feedback(db, profile.id, new_data)
+        elif update_type == "personality":
+            profile.personality_traits = {**(profile.personality_traits or {}), **new_data.get("personality_traits", {})}
+            profile.communication_style = {**(profile.communication_style or {}), **new_data.get("communication_style", {})}
+            profile.engagement_patterns = {**(profile.engagement_patterns or {}), **new_data.get("engagement_patterns", {})}
+        else:
+            # 一般性更新
+            if "visit_count" in new_data:
+                profile.visit_count = new_data["visit_count"]
+            if "total_interactions" in new_data:
+                profile.total_interactions = new_data["total_interactions"]
+            if "satisfaction_score" in new_data:
+                profile.satisfaction_score = new_data["satisfaction_score"]
+    
     async def analyze_user_from_conversation(
         self, 
-        db: Session,
+        db: AsyncSession,
         session_id: str, 
         chat_history: List[Dict[str, Any]]
     ) -> Dict[str, Any]:
@@ -120,6 +216,14 @@ class UserProfileDBService:
             if not user_messages:
                 return await self.get_user_profile(db, session_id)
             
+            # 所有訊息都已分析過時直接回傳既有畫像，不再重新呼叫模型
+            analyzed_turns = _analyzed_turns.get(session_id, set())
+            turn_digests = [
+                hashlib.blake2b((message or "").encode(), digest_size=16).digest() for message in user_messages
+            ]
+            if analyzed_turns.issuperset(turn_digests):
+                return await self.get_user_profile(db, session_id)
+            
             # 嘗試使用GPT分析用戶特徵
             try:
                 analysis_prompt = f"""
@@ -156,7 +260,8 @@ class UserProfileDBService:
                 }}
                 """
                 
-                response = client.chat.completions.create(
+                # 所有用戶訊息合併為單一請求
+                response = await aclient.chat.completions.create(
                     model="gpt-4",
                     messages=[
                         {"role": "system", "content": "你是一個專業的用戶行為分析師，請準確分析用戶特徵。"},
@@ -168,13 +273,16 @@ class UserProfileDBService:
                 )
                 
                 analysis_result = json.loads(response.choices[0].message.content)
+                from_model = True
                 
             except (openai.APIConnectionError, openai.APITimeoutError, json.JSONDecodeError) as e:
                 logger.warning(f"OpenAI API error, using fallback analysis: {str(e)}")
                 analysis_result = self._fallback_conversation_analysis(user_messages)
+                from_model = False
             except Exception as e:
                 logger.error(f"Error in GPT analysis, using fallback: {str(e)}")
                 analysis_result = self._fallback_conversation_analysis(user_messages)
+                from_model = False
             
             # 更新用戶畫像到資料庫
             await self.update_user_profile(db, session_id, {
@@ -186,11 +294,16 @@ class UserProfileDBService:
             }, "personality")
             
             # 記錄分析行為
-            await self._record_behavior(db, session_id, {
+            self._record_behavior(db, session_id, {
                 "behavior_type": "conversation_analysis",
                 "analysis_result": analysis_result,
                 "message_count": len(user_messages)
             })
+            await db.commit()
+            self.invalidate_profile(session_id)
+            # 只記錄模型分析過的訊息；關鍵字備用分析的結果不記錄，API 恢復後仍會重新分析
+            if from_model:
+                _analyzed_turns[session_id] = analyzed_turns.union(turn_digests)
             
             return await self.get_user_profile(db, session_id)
             
@@ -200,39 +313,22 @@ class UserProfileDBService:
     
     def _fallback_conversation_analysis(self, user_messages: List[str]) -> Dict[str, Any]:
         """備用對話分析（基於關鍵詞）"""
-        combined_text = " ".join(user_messages).lower()
+        # 關鍵字皆為中文，不需轉小寫；整段歷史以單一比對器掃描一次
+        matched = _FALLBACK_MATCHER.labels(" ".join(user_messages))
         
         # 分析興趣
-        interests = []
-        interest_keywords = {
-            "藝術": ["藝術", "展覽", "美術", "畫展", "藝文", "博物館"],
-            "音樂": ["音樂", "演唱會", "音樂會", "演出", "表演"],
-            "運動": ["運動", "健身", "瑜伽", "跑步", "球類"],
-            "美食": ["美食", "餐廳", "料理", "烹飪", "品酒"],
-            "學習": ["學習", "課程", "講座", "工作坊", "研習"],
-            "親子": ["親子", "兒童", "家庭", "小孩", "孩子"],
-            "戶外": ["戶外", "野餐", "露營", "踏青", "自然"],
-            "社交": ["社交", "聚會", "交友", "派對", "聯誼"]
-        }
-        
-        for category, keywords in interest_keywords.items():
-            if any(keyword in combined_text for keyword in keywords):
-                interests.append(category)
+        interests = [
+            category for category, _ in _FALLBACK_INTEREST_KEYWORDS if ("interest", category) in matched
+        ]
         
         # 分析地點偏好
-        locations = []
-        location_keywords = ["台北", "新北", "桃園", "台中", "台南", "高雄"]
-        for location in location_keywords:
-            if location in combined_text:
-                locations.append(location)
+        locations = [location for location in _FALLBACK_LOCATIONS if ("location", location) in matched]
         
         # 分析社交傾向
-        social_indicators = ["朋友", "一起", "團體", "大家", "聚會"]
-        social_level = 0.7 if any(indicator in combined_text for indicator in social_indicators) else 0.4
+        social_level = 0.7 if "social" in matched else 0.4
         
         # 分析冒險精神
-        adventure_indicators = ["新", "特別", "有趣", "刺激", "體驗"]
-        adventure_seeking = 0.7 if any(indicator in combined_text for indicator in adventure_indicators) else 0.5
+        adventure_seeking = 0.7 if "adventure" in matched else 0.5
         
         return {
             "interests": interests[:3],  # 最多3個興趣
@@ -263,7 +359,7 @@ class UserProfileDBService:
     
     async def get_personalized_recommendations(
         self, 
-        db: Session,
+        db: AsyncSession,
         session_id: str, 
         context: Dict[str, Any] = None
     ) -> Dict[str, Any]:
@@ -330,49 +426,122 @@ class UserProfileDBService:
     
     async def record_user_interaction(
         self,
-        db: Session,
+        db: AsyncSession,
         session_id: str,
         interaction_type: str,
         interaction_data: Dict[str, Any]
     ):
-        """記錄用戶互動行為"""
-        try:
-            profile = db.query(UserProfile).filter(UserProfile.session_id == session_id).first()
-            if not profile:
-                profile = await self._create_user_profile(db, session_id)
-            
-            # 記錄行為
-            await self._record_behavior(db, profile.id, {
-                "behavior_type": interaction_type,
-                **interaction_data
-            })
-            
-            # 更新互動計數
-            profile.total_interactions += 1
-            profile.last_activity = datetime.utcnow()
+        """
+        記錄用戶互動行為
+        
+        行為先放入佇列，由背景工作以單一交易批次寫入，提交後才讓畫像快取失效；需要立即讀到結果時請先呼叫 flush()
+        """
+        global _flush_task
+        _behavior_queue.append((
+            session_id,
+            {"behavior_type": interaction_type, **interaction_data},
+            now_ms()
+        ))
+        
+        if len(_behavior_queue) >= _BEHAVIOR_FLUSH_SIZE:
+            await self.flush()
+        elif _flush_task is None or _flush_task.done():
+            _flush_task = asyncio.create_task(self._flush_later())
+    
+    async def _flush_later(self):
+        """等待一小段時間累積更多行為後再寫入"""
+        await asyncio.sleep(_BEHAVIOR_FLUSH_INTERVAL)
+        await self.flush()
+    
+    async def flush(self):
+        """將佇列中的互動行為批次寫入資料庫，並更新各畫像的互動計數"""
+        global _behavior_queue
+        async with _behavior_lock:
+            if not _behavior_queue:
+                return
+            queued, _behavior_queue = _behavior_queue, []
             
-            db.commit()
+            if await self._write_behaviors(queued):
+                return
             
-        except Exception as e:
-            logger.error(f"Error recording user interaction: {str(e)}")
-            db.rollback()
+            # 整批失敗時逐筆重試，只捨棄真正寫不進去的行為，不連累其他 session
+            dropped = 0
+            for item in queued:
+                if not await self._write_behaviors([item]):
+                    dropped += 1
+            if dropped:
+                logger.error(f"Dropped {dropped} of {len(queued)} user interactions after retrying one by one")
     
-    async def _create_user_profile(self, db: Session, session_id: str) -> UserProfile:
+    async def _write_behaviors(self, queued: List[Tuple[str, Dict[str, Any], int]]) -> bool:
+        """在單一交易中寫入行為並更新互動計數，成功時回傳 True"""
+        session_ids = {session_id for session_id, _, _ in queued}
+        
+        # 背景寫入不能共用呼叫端的會話，使用獨立的資料庫會話
+        async with SessionLocal() as db:
+            try:
+                profiles = await self._load_profiles(db, session_ids)
+                missing = session_ids - profiles.keys()
+                if missing:
+                    # 建立畫像時若與並行請求衝突會回滾並改用既有的畫像，回滾後重新載入以免使用已過期的物件
+                    for session_id in missing:
+                        await self._create_user_profile(db, session_id)
+                    profiles = await self._load_profiles(db, session_ids)
+                
+                # 所有行為以單一 executemany INSERT 寫入
+                await db.execute(insert(UserBehavior), [
+                    {
+                        "profile_id": profiles[session_id].id,
+                        "behavior_type": behavior_data.get("behavior_type", "general"),
+                        "behavior_data": behavior_data,
+                        "event_id": behavior_data.get("event_id"),
+                        "timestamp": timestamp
+                    }
+                    for session_id, behavior_data, timestamp in queued
+                ])
+                
+                # 更新互動計數
+                now = now_ms()
+                for session_id, count in Counter(session_id for session_id, _, _ in queued).items():
+                    profile = profiles[session_id]
+                    profile.total_interactions = (profile.total_interactions or 0) + count
+                    profile.last_activity = now
+                
+                await db.commit()
+                
+            except Exception as e:
+                logger.error(f"Error recording user interactions ({len(queued)} behaviors): {str(e)}")
+                await db.rollback()
+                return False
+        
+        for session_id in session_ids:
+            self.invalidate_profile(session_id)
+        return True
+    
+    async def _load_profiles(self, db: AsyncSession, session_ids: set) -> Dict[str, UserProfile]:
+        """一次查詢取得多個 session 的用戶畫像（session_id -> 畫像）"""
+        return {
+            profile.session_id: profile
+            for profile in await db.scalars(
+                select(UserProfile).where(UserProfile.session_id.in_(session_ids))
+            )
+        }
+    
+    async def _create_user_profile(self, db: AsyncSession, session_id: str) -> UserProfile:
         """創建新的用戶畫像"""
         # 獲取session信息以確定IP地址
-        session = db.query(ChatSession).filter(ChatSession.session_id == session_id).first()
+        session = await db.scalar(select(ChatSession).where(ChatSession.session_id == session_id))
         
         # 計算該IP的歷史session數量來確定visit_count
         visit_count = 1  # 默認為1（新用戶）
         if session and session.ip_address:
             # 查詢該IP在當前session創建之前的session數量
-            earlier_sessions_count = (
-                db.query(ChatSession)
-                .filter(
+            earlier_sessions_count = await db.scalar(
+                select(func.count())
+                .select_from(ChatSession)
+                .where(
                     ChatSession.ip_address == session.ip_address,
                     ChatSession.created_at < session.created_at
                 )
-                .count()
             )
             visit_count = earlier_sessions_count + 1  # 加上當前session
         
@@ -386,26 +555,31 @@ class UserProfileDBService:
             engagement_patterns={}
         )
         db.add(profile)
-        db.commit()
-        db.refresh(profile)
+        try:
+            await db.commit()
+        except IntegrityError:
+            # 並行請求已為同一個 session 建立畫像（session_id 唯一），改用已存在的那一筆
+            await db.rollback()
+            return await db.scalar(select(UserProfile).where(UserProfile.session_id == session_id))
+        await db.refresh(profile)
         return profile
     
-    async def _get_user_interests(self, db: Session, profile_id: int) -> List[Dict[str, Any]]:
+    async def _get_user_interests(self, db: AsyncSession, profile_id: int) -> List[Dict[str, Any]]:
         """獲取用戶興趣"""
-        interests = db.query(UserInterest).filter(UserInterest.profile_id == profile_id).all()
+        interests = (await db.scalars(select(UserInterest).where(UserInterest.profile_id == profile_id))).all()
         return [
             {
                 "interest": interest.interest,
                 "confidence": interest.confidence,
                 "source": interest.source,
-                "created_at": interest.created_at.isoformat()
+                "created_at": ms_to_iso(interest.created_at)
             }
             for interest in interests
         ]
     
-    async def _get_user_preferences(self, db: Session, profile_id: int) -> Dict[str, Any]:
+    async def _get_user_preferences(self, db: AsyncSession, profile_id: int) -> Dict[str, Any]:
         """獲取用戶偏好"""
-        preferences = db.query(UserPreference).filter(UserPreference.profile_id == profile_id).all()
+        preferences = (await db.scalars(select(UserPreference).where(UserPreference.profile_id == profile_id))).all()
         
         result = {
             "preferred_categories": [],
@@ -429,32 +603,30 @@ class UserProfileDBService:
         
         return result
     
-    async def _get_recent_behaviors(self, db: Session, profile_id: int, limit: int = 10) -> List[Dict[str, Any]]:
+    async def _get_recent_behaviors(self, db: AsyncSession, profile_id: int, limit: int = 10) -> List[Dict[str, Any]]:
         """獲取最近的用戶行為"""
-        behaviors = (
-            db.query(UserBehavior)
-            .filter(UserBehavior.profile_id == profile_id)
+        behaviors = await db.scalars(
+            select(UserBehavior)
+            .where(UserBehavior.profile_id == profile_id)
             .order_by(desc(UserBehavior.timestamp))
             .limit(limit)
-            .all()
         )
         
         return [
             {
                 "behavior_type": behavior.behavior_type,
                 "behavior_data": behavior.behavior_data,
-                "timestamp": behavior.timestamp.isoformat()
+                "timestamp": ms_to_iso(behavior.timestamp)
             }
             for behavior in behaviors
         ]
     
-    async def _get_feedback_history(self, db: Session, profile_id: int) -> List[Dict[str, Any]]:
+    async def _get_feedback_history(self, db: AsyncSession, profile_id: int) -> List[Dict[str, Any]]:
         """獲取用戶反饋歷史"""
-        feedbacks = (
-            db.query(UserFeedback)
-            .filter(UserFeedback.profile_id == profile_id)
+        feedbacks = await db.scalars(
+            select(UserFeedback)
+            .where(UserFeedback.profile_id == profile_id)
             .order_by(desc(UserFeedback.created_at))
-            .all()
         )
         
         return [
@@ -463,42 +635,53 @@ class UserProfileDBService:
                 "feedback_value": feedback.feedback_value,
                 "rating": feedback.rating,
                 "context": feedback.context,
-                "created_at": feedback.created_at.isoformat()
+                "created_at": ms_to_iso(feedback.created_at)
             }
             for feedback in feedbacks
         ]
     
-    async def _update_interests_db(self, db: Session, profile_id: int, interests_data: Dict[str, Any]):
-        """更新用戶興趣到資料庫"""
+    async def _update_interests_db(self, db: AsyncSession, profile_id: int, interests_data: Dict[str, Any]):
+        """更新用戶興趣（加入目前的交易，由呼叫端提交）"""
         interests = interests_data.get("interests", [])
+        if not interests:
+            return
         
-        for interest_name in interests:
-            # 檢查是否已存在
-            existing = db.query(UserInterest).filter(
+        # 一次查出所有已存在的興趣，取代逐一興趣的查詢
+        existing_interests = {
+            interest.interest: interest
+            for interest in await db.scalars(select(UserInterest).where(
                 and_(
                     UserInterest.profile_id == profile_id,
-                    UserInterest.interest == interest_name
+                    UserInterest.interest.in_(interests)
                 )
-            ).first()
-            
+            ))
+        }
+        
+        now = now_ms()
+        new_interests = []
+        for interest_name in interests:
+            existing = existing_interests.get(interest_name)
             if existing:
                 # 更新信心度
                 existing.confidence = min(existing.confidence + 0.1, 1.0)
-                existing.updated_at = datetime.utcnow()
+                existing.updated_at = now
             else:
                 # 創建新興趣
-                new_interest = UserInterest(
+                existing_interests[interest_name] = UserInterest(
                     profile_id=profile_id,
                     interest=interest_name,
                     confidence=0.7,
-                    source="conversation"
+                    source="conversation",
+                    created_at=now,
+                    updated_at=now
                 )
-                db.add(new_interest)
+                new_interests.append(existing_interests[interest_name])
         
-        db.commit()
+        # 新興趣以單一批次 INSERT 寫入
+        db.add_all(new_interests)
     
-    async def _update_preferences_db(self, db: Session, profile_id: int, preferences_data: Dict[str, Any]):
-        """更新用戶偏好到資料庫"""
+    async def _update_preferences_db(self, db: AsyncSession, profile_id: int, preferences_data: Dict[str, Any]):
+        """更新用戶偏好（加入目前的交易，由呼叫端提交）"""
         activity_preferences = preferences_data.get("activity_preferences", {})
         
         preference_mappings = {
@@ -517,17 +700,17 @@ class UserProfileDBService:
             for value in values:
                 if value:
                     # 檢查是否已存在
-                    existing = db.query(UserPreference).filter(
+                    existing = await db.scalar(select(UserPreference).where(
                         and_(
                             UserPreference.profile_id == profile_id,
                             UserPreference.preference_type == pref_type,
                             UserPreference.preference_value == str(value)
                         )
-                    ).first()
+                    ))
                     
                     if existing:
                         existing.confidence = min(existing.confidence + 0.1, 1.0)
-                        existing.updated_at = datetime.utcnow()
+                        existing.updated_at = now_ms()
                     else:
                         new_preference = UserPreference(
                             profile_id=profile_id,
@@ -536,30 +719,28 @@ class UserProfileDBService:
                             confidence=0.7
                         )
                         db.add(new_preference)
-        
-        db.commit()
     
-    async def _record_behavior(self, db: Session, profile_id: int, behavior_data: Dict[str, Any]):
+    def _record_behavior(self, db: AsyncSession, profile_id: int, behavior_data: Dict[str, Any]):
         """記錄用戶行為"""
         behavior = UserBehavior(
             profile_id=profile_id,
             behavior_type=behavior_data.get("behavior_type", "general"),
-            behavior_data=behavior_data
+            behavior_data=behavior_data,
+            event_id=behavior_data.get("event_id")
         )
         db.add(behavior)
-        db.commit()
     
-    async def _record_feedback(self, db: Session, profile_id: int, feedback_data: Dict[str, Any]):
+    def _record_feedback(self, db: AsyncSession, profile_id: int, feedback_data: Dict[str, Any]):
         """記錄用戶反饋"""
         feedback = UserFeedback(
             profile_id=profile_id,
             feedback_type=feedback_data.get("feedback_type", "general"),
             feedback_value=feedback_data.get("feedback_value", ""),
             rating=feedback_data.get("rating"),
-            context=feedback_data.get("context", {})
+            context=feedback_data.get("context", {}),
+            event_id=(feedback_data.get("context") or {}).get("event_id")
         )
         db.add(feedback)
-        db.commit()
     
     def _create_default_profile_data(self, session_id: str) -> Dict[str, Any]:
         """創建默認用戶畫像數據"""
@@ -568,12 +749,13 @@ class UserProfileDBService:
             "visit_count": 1,
             "total_interactions": 0,
             "satisfaction_score": 0.0,
-            "last_activity": datetime.utcnow().isoformat(),
-            "created_at": datetime.utcnow().isoformat(),
+            "last_activity": ms_to_iso(now_ms()),
+            "created_at": ms_to_iso(now_ms()),
             "personality_traits": {},
             "communication_style": {},
             "engagement_patterns": {},
             "interests": [],
+            "interest_names": [],
             "activity_preferences": {
                 "preferred_categories": [],
                 "preferred_locations": [],
@@ -585,11 +767,11 @@ class UserProfileDBService:
             "feedback_history": []
         }
     
-    async def get_cross_session_profile(self, db: Session, ip_address: str) -> Dict[str, Any]:
+    async def get_cross_session_profile(self, db: AsyncSession, ip_address: str) -> Dict[str, Any]:
         """獲取跨session的用戶畫像"""
         try:
             # 查找該IP地址的所有session
-            profiles = db.query(UserProfile).filter(UserProfile.ip_address == ip_address).all()
+            profiles = (await db.scalars(select(UserProfile).where(UserProfile.ip_address == ip_address))).all()
             
             if not profiles:
                 return self._create_default_profile_data("unknown")
@@ -604,7 +786,7 @@ class UserProfileDBService:
 
     async def update_user_interest(
         self, 
-        db: Session, 
+        db: AsyncSession, 
         session_id: str, 
         interest: str, 
         confidence: float = 0.7, 
@@ -613,22 +795,22 @@ class UserProfileDBService:
         """更新用戶興趣"""
         try:
             # 獲取或創建用戶畫像
-            profile = db.query(UserProfile).filter(UserProfile.session_id == session_id).first()
+            profile = await db.scalar(select(UserProfile).where(UserProfile.session_id == session_id))
             if not profile:
                 profile = await self._create_user_profile(db, session_id)
             
             # 檢查是否已存在該興趣
-            existing_interest = db.query(UserInterest).filter(
+            existing_interest = await db.scalar(select(UserInterest).where(
                 and_(
                     UserInterest.profile_id == profile.id,
                     UserInterest.interest == interest
                 )
-            ).first()
+            ))
             
             if existing_interest:
                 # 更新現有興趣的信心度
                 existing_interest.confidence = max(existing_interest.confidence, confidence)
-                existing_interest.updated_at = datetime.utcnow()
+                existing_interest.updated_at = now_ms()
             else:
                 # 創建新的興趣記錄
                 new_interest = UserInterest(
@@ -636,21 +818,83 @@ class UserProfileDBService:
                     interest=interest,
                     confidence=confidence,
                     source=source,
-                    created_at=datetime.utcnow(),
-                    updated_at=datetime.utcnow()
+                    created_at=now_ms(),
+                    updated_at=now_ms()
                 )
                 db.add(new_interest)
             
-            db.commit()
+            await db.commit()
+            self.invalidate_profile(session_id)
             logger.info(f"Updated user interest '{interest}' for session {session_id}")
             
         except Exception as e:
             logger.error(f"Error updating user interest: {str(e)}")
-            db.rollback()
+            await db.rollback()
+
+    async def bulk_update_user_interests(
+        self,
+        db: AsyncSession,
+        session_id: str,
+        items: List[Tuple[str, float, str]]
+    ):
+        """
+        批次更新用戶興趣，一次查詢既有興趣並以單次提交寫入
+        
+        Args:
+            items: (興趣, 信心度, 來源) 組成的列表
+        """
+        if not items:
+            return
+        
+        try:
+            # 獲取或創建用戶畫像
+            profile = await db.scalar(select(UserProfile).where(UserProfile.session_id == session_id))
+            if not profile:
+                profile = await self._create_user_profile(db, session_id)
+            
+            # 一次查出所有已存在的興趣
+            existing_interests = {
+                interest.interest: interest
+                for interest in await db.scalars(select(UserInterest).where(
+                    and_(
+                        UserInterest.profile_id == profile.id,
+                        UserInterest.interest.in_([interest for interest, _, _ in items])
+                    )
+                ))
+            }
+            
+            now = now_ms()
+            new_interests = []
+            for interest, confidence, source in items:
+                existing_interest = existing_interests.get(interest)
+                if existing_interest:
+                    # 更新現有興趣的信心度
+                    existing_interest.confidence = max(existing_interest.confidence, confidence)
+                    existing_interest.updated_at = now
+                else:
+                    # 創建新的興趣記錄
+                    existing_interests[interest] = UserInterest(
+                        profile_id=profile.id,
+                        interest=interest,
+                        confidence=confidence,
+                        source=source,
+                        created_at=now,
+                        updated_at=now
+                    )
+                    new_interests.append(existing_interests[interest])
+            
+            db.add_all(new_interests)
+            await db.commit()
+            self.invalidate_profile(session_id)
+            logger.info(f"Updated {len(items)} user interests for session {session_id}")
+            
+        except Exception as e:
+            logger.error(f"Error bulk updating user interests: {str(e)}")
+            await db.rollback()
 
     async def update_activity_preference(
         self, 
-        db: Session, 
+        db: AsyncSession, 
         session_id: str, 
         preference_type: str, 
         preference_values: List[str]
@@ -658,17 +902,17 @@ class UserProfileDBService:
         """更新活動偏好"""
         try:
             # 獲取或創建用戶畫像
-            profile = db.query(UserProfile).filter(UserProfile.session_id == session_id).first()
+            profile = await db.scalar(select(UserProfile).where(UserProfile.session_id == session_id))
             if not profile:
                 profile = await self._create_user_profile(db, session_id)
             
             # 檢查是否已存在該偏好類型
-            existing_preference = db.query(UserPreference).filter(
+            existing_preference = await db.scalar(select(UserPreference).where(
                 and_(
                     UserPreference.profile_id == profile.id,
                     UserPreference.preference_type == preference_type
                 )
-            ).first()
+            ))
             
             if existing_preference:
                 # 更新現有偏好值
@@ -679,46 +923,110 @@ class UserProfileDBService:
                 # 合併新值，避免重複
                 updated_values = list(set(current_values + preference_values))
                 existing_preference.preference_value = updated_values
-                existing_preference.updated_at = datetime.utcnow()
+                existing_preference.updated_at = now_ms()
             else:
                 # 創建新的偏好記錄
                 new_preference = UserPreference(
                     profile_id=profile.id,
                     preference_type=preference_type,
                     preference_value=preference_values,
-                    created_at=datetime.utcnow(),
-                    updated_at=datetime.utcnow()
+                    created_at=now_ms(),
+                    updated_at=now_ms()
                 )
                 db.add(new_preference)
             
-            db.commit()
+            await db.commit()
+            self.invalidate_profile(session_id)
             logger.info(f"Updated activity preference '{preference_type}' for session {session_id}")
             
         except Exception as e:
             logger.error(f"Error updating activity preference: {str(e)}")
-            db.rollback()
+            await db.rollback()
+
+    async def update_activity_preferences(
+        self,
+        db: AsyncSession,
+        session_id: str,
+        preferences: Dict[str, List[str]]
+    ):
+        """
+        批次更新多種活動偏好，一次查詢既有偏好並以單次提交寫入
+        
+        Args:
+            preferences: 偏好類型對應偏好值列表
+        """
+        if not preferences:
+            return
+        
+        try:
+            # 獲取或創建用戶畫像
+            profile = await db.scalar(select(UserProfile).where(UserProfile.session_id == session_id))
+            if not profile:
+                profile = await self._create_user_profile(db, session_id)
+            
+            # 一次查出所有相關的偏好類型
+            existing_preferences = {
+                preference.preference_type: preference
+                for preference in await db.scalars(select(UserPreference).where(
+                    and_(
+                        UserPreference.profile_id == profile.id,
+                        UserPreference.preference_type.in_(list(preferences))
+                    )
+                ))
+            }
+            
+            now = now_ms()
+            for preference_type, preference_values in preferences.items():
+                existing_preference = existing_preferences.get(preference_type)
+                if existing_preference:
+                    # 更新現有偏好值
+                    current_values = existing_preference.preference_value or []
+                    if isinstance(current_values, str):
+                        current_values = [current_values]
+                    
+                    # 合併新值，避免重複
+                    existing_preference.preference_value = list(set(current_values + preference_values))
+                    existing_preference.updated_at = now
+                else:
+                    # 創建新的偏好記錄
+                    db.add(UserPreference(
+                        profile_id=profile.id,
+                        preference_type=preference_type,
+                        preference_value=preference_values,
+                        created_at=now,
+                        updated_at=now
+                    ))
+            
+            await db.commit()
+            self.invalidate_profile(session_id)
+            logger.info(f"Updated activity preferences {list(preferences)} for session {session_id}")
+            
+        except Exception as e:
+            logger.error(f"Error updating activity preferences: {str(e)}")
+            await db.rollback()
 
-    async def update_interaction_stats(self, db: Session, session_id: str):
+    async def update_interaction_stats(self, db: AsyncSession, session_id: str):
         """更新互動統計"""
         try:
             # 獲取或創建用戶畫像
-            profile = db.query(UserProfile).filter(UserProfile.session_id == session_id).first()
+            profile = await db.scalar(select(UserProfile).where(UserProfile.session_id == session_id))
             if not profile:
                 profile = await self._create_user_profile(db, session_id)
             
             # 更新互動次數
             profile.total_interactions = (profile.total_interactions or 0) + 1
-            profile.last_activity = datetime.utcnow()
-            profile.updated_at = datetime.utcnow()
+            profile.last_activity = now_ms()
+            profile.updated_at = now_ms()
             
-            db.commit()
+            await db.commit()
+            self.invalidate_profile(session_id)
             logger.info(f"Updated interaction stats for session {session_id}")
             
         except Exception as e:
             logger.error(f"Error updating interaction stats: {str(e)}")
-            db.rollback()
+            await db.rollback()
 
-    async def _integrate_profiles(self, db: Session, profiles: List[UserProfile]) -> Dict[str, Any]:
+    async def _integrate_profiles(self, db: AsyncSession, profiles: List[UserProfile]) -> Dict[str, Any]:
         """整合多個session的用戶畫像數據"""
         try:
             if not profiles:
@@ -773,8 +1081,9 @@ class UserProfileDBService:
                 "visit_count": total_visit_count,
                 "total_interactions": total_interactions,
                 "satisfaction_score": avg_satisfaction,
-                "last_activity": last_activity.isoformat() if last_activity else None,
+                "last_activity": ms_to_iso(last_activity),
                 "interests": sorted_interests,
+                "interest_names": [interest.get("interest") for interest in sorted_interests],
                 "activity_preferences": all_preferences,
                 "personality_traits": {},
                 "communication_style": {},
@@ -785,4 +1094,11 @@ class UserProfileDBService:
             
         except Exception as e:
             logger.error(f"Error integrating profiles: {str(e)}")
-            return self._create_default_profile_data("unknown") 
\ No newline at end of file
+            return self._create_default_profile_data("unknown") 
+
+
+async def flush_pending_behaviors():
+    """應用程式關閉前呼叫：等待排程中的延遲寫入完成，並寫入佇列中剩餘的互動行為"""
+    if _flush_task is not None and not _flush_task.done():
+        await _flush_task
+    await UserProfileDBService().flush()
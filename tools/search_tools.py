@@ -1,21 +1,48 @@
-from typing import Dict, Any
+from typing import Dict, Any, Tuple
 import json
 from datetime import datetime, timedelta
-from openai import OpenAI
+from openai import AsyncOpenAI
 import re
 from utils.config import OPENAI_API_KEY, DEFAULT_EVENTS_PER_PAGE
 from utils.logger import logger
+from utils.single_flight import SingleFlightCache, cache_key
+from llm_handler import recommend_events
 
-client = OpenAI(api_key=OPENAI_API_KEY)
+# 非同步客戶端：等待模型回應時不會阻塞事件迴圈，相同的並行請求才能共用同一次呼叫
+aclient = AsyncOpenAI(api_key=OPENAI_API_KEY)
+
+# 搜尋參數提取結果快取；參數中含有當下時間戳，因此只保留 60 秒，相同的並行請求共用同一次 LLM 呼叫
+_extraction_cache = SingleFlightCache(maxsize=1024, ttl=60)
 
 class SearchParamsExtractor:
     """搜尋參數提取器"""
     
     @staticmethod
     async def extract_search_params(message: str, context: Dict[str, Any] = None) -> Dict[str, Any]:
+        """
+        從用戶消息中提取搜尋參數（帶快取）
+        context: 已存在的搜尋參數（例如從前端傳來的排序參數）
+        """
+        key = cache_key(message.strip(), context)
+        
+        params = _extraction_cache.get(key)
+        if params is None:
+            # 規則回退的結果只是暫時的替代，不寫入快取，下次請求重新呼叫模型
+            params = await _extraction_cache.get_or_compute(
+                key, lambda: SearchParamsExtractor._extract_search_params(message, context)
+            )
+        else:
+            logger.info(f"Search params cache hit for message: {message}")
+        
+        # 回傳副本，呼叫端會修改分頁等參數
+        return dict(params)
+
+    @staticmethod
+    async def _extract_search_params(message: str, context: Dict[str, Any] = None) -> Tuple[Dict[str, Any], bool]:
         """
         從用戶消息中提取搜尋參數
         context: 已存在的搜尋參數（例如從前端傳來的排序參數）
+        回傳 (搜尋參數, 是否可快取)；使用規則回退時不可快取
         """
         logger.info(f"Extracting search parameters from message: {message}")
         logger.info(f"Existing parameters: {context}")
@@ -95,7 +122,7 @@ class SearchParamsExtractor:
         """
         
         try:
-            response = client.chat.completions.create(
+            response = await aclient.chat.completions.create(
                 model="gpt-4",
                 messages=[
                     {"role": "system", "content": "你是一個專業的活動搜尋助手，請從用戶訊息中提取搜尋參數，並以JSON格式返回。請確保返回的是純JSON格式，不要添加任何markdown標記或其他文字。必須正確識別活動類別和時間範圍。"},
@@ -181,7 +208,7 @@ class SearchParamsExtractor:
                 SearchParamsExtractor._validate_search_params(params, message)
                 
                 logger.info(f"Final search parameters: {params}")
-                return params
+                return params, True
                 
             except json.JSONDecodeError as e:
                 logger.error(f"Failed to parse JSON: {str(e)}")
@@ -190,7 +217,7 @@ class SearchParamsExtractor:
                 # 使用規則基礎的回退機制
                 fallback_params = SearchParamsExtractor._extract_params_with_rules(message, today_timestamp, next_month_timestamp, next_month_end_timestamp)
                 logger.info(f"Using rule-based fallback parameters: {fallback_params}")
-                return fallback_params
+                return fallback_params, False
                 
         except Exception as e:
             logger.error(f"Error extracting search parameters: {str(e)}", exc_info=True)
@@ -198,7 +225,7 @@ class SearchParamsExtractor:
             # 使用規則基礎的回退機制
             fallback_params = SearchParamsExtractor._extract_params_with_rules(message, today_timestamp, next_month_timestamp, next_month_end_timestamp)
             logger.info(f"Using rule-based fallback parameters due to error: {fallback_params}")
-            return fallback_params
+            return fallback_params, False
 
     @staticmethod
     def _extract_params_with_rules(message: str, today_timestamp: int, next_month_timestamp: int, next_month_end_timestamp: int) -> Dict[str, Any]:
@@ -284,7 +311,6 @@ class EventSearchService:
         執行活動搜尋
         """
         try:
-            from llm_handler import recommend_events
             return await recommend_events(params)
         except Exception as e:
             logger.error(f"Error searching events: {str(e)}", exc_info=True)
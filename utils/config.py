@@ -14,6 +14,10 @@ EVENTGO_API_BASE = os.getenv("EVENTGO_API_BASE", "https://eventgo.widm.csie.ncu.
 
 # Database Configuration
 DATABASE_URL = "sqlite:///./event_chatbot.db"
+# 應用程式使用的非同步驅動連線字串（同步的 DATABASE_URL 保留給遷移腳本）
+ASYNC_DATABASE_URL = os.getenv("ASYNC_DATABASE_URL", "sqlite+aiosqlite:///./event_chatbot.db")
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "20"))
+DB_MAX_OVERFLOW = int(os.getenv("DB_MAX_OVERFLOW", "40"))
 
 # API Configuration
 API_PREFIX = "/api"
@@ -22,4 +26,7 @@ API_DESCRIPTION = "A FastAPI-based backend service for an event chatbot"
 API_VERSION = "1.0.0"
 
 # 分頁配置
-DEFAULT_EVENTS_PER_PAGE = 5 
\ No newline at end of file
+DEFAULT_EVENTS_PER_PAGE = 5 
+
+# 推薦API並行上限（所有請求共用）
+REC_MAX_CONCURRENCY = int(os.getenv("REC_MAX_CONCURRENCY", "16"))
@@ -0,0 +1,45 @@
+"""
+關鍵字比對工具
+將多組關鍵字預先編譯成單一正則表達式，只需掃描訊息一次即可找出所有命中的標籤
+"""
+
+import re
+from typing import Dict, FrozenSet, Hashable, Iterable, Iterator, Set, Tuple
+
+
+class KeywordMatcher:
+    """多關鍵字比對器，以單一預編譯的正則表達式取代逐一關鍵字的 `in` 掃描"""
+
+    def __init__(self, pairs: Iterable[Tuple[str, Hashable]]):
+        """
+        初始化比對器
+
+        Args:
+            pairs: (關鍵字, 標籤) 組成的序列，標籤可為任何可雜湊的值
+        """
+        keyword_labels: Dict[str, Set[Hashable]] = {}
+        for keyword, label in pairs:
+            keyword_labels.setdefault(keyword, set()).add(label)
+
+        # 長關鍵字優先；同一位置只會回報最長的關鍵字，因此將其前綴關鍵字的標籤一併併入
+        keywords = sorted(keyword_labels, key=len, reverse=True)
+        self._labels: Dict[str, FrozenSet[Hashable]] = {
+            keyword: frozenset().union(*(
+                labels for prefix, labels in keyword_labels.items() if keyword.startswith(prefix)
+            ))
+            for keyword in keywords
+        }
+        # 零寬度前瞻讓每個位置都能比對，重疊的關鍵字也不會遺漏
+        self._pattern = re.compile("(?=(" + "|".join(map(re.escape, keywords)) + "))")
+
+    def labels(self, text: str) -> Set[Hashable]:
+        """回傳文字中所有命中關鍵字對應的標籤"""
+        found: Set[Hashable] = set()
+        for match in self._pattern.finditer(text):
+            found |= self._labels[match.group(1)]
+        return found
+
+    def iter_labels(self, text: str) -> Iterator[Hashable]:
+        """依出現順序逐一產生命中的標籤（可能重複），呼叫端可在取得足夠結果後提前停止掃描"""
+        for match in self._pattern.finditer(text):
+            yield from self._labels[match.group(1)]
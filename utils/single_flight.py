@@ -0,0 +1,58 @@
+"""
+單一請求合併的 TTL 快取
+相同鍵的並行請求共用同一次計算，計算完成後在 TTL 內直接回傳快取結果
+"""
+
+import asyncio
+from typing import Any, Awaitable, Callable, Dict, Hashable, Tuple
+
+import orjson
+from cachetools import TTLCache
+
+
+def cache_key(*parts: Any) -> bytes:
+    """將多個參數序列化為穩定的快取鍵（字典鍵排序，無法序列化的值轉為字串）"""
+    return orjson.dumps(parts, option=orjson.OPT_SORT_KEYS, default=str)
+
+
+class SingleFlightCache:
+    """TTL 快取加上進行中請求的合併"""
+
+    def __init__(self, maxsize: int, ttl: float):
+        self._cache = TTLCache(maxsize=maxsize, ttl=ttl)
+        # 進行中的計算，相同的並行請求共用同一個 Task
+        self._pending: Dict[Hashable, asyncio.Task] = {}
+
+    def get(self, key: Hashable) -> Any:
+        """取得快取結果，不存在時回傳 None"""
+        return self._cache.get(key)
+
+    def clear(self):
+        """清除所有快取結果（進行中的計算不受影響）"""
+        self._cache.clear()
+
+    def __len__(self) -> int:
+        return len(self._cache)
+
+    async def get_or_compute(self, key: Hashable, compute: Callable[[], Awaitable[Tuple[Any, bool]]]) -> Any:
+        """
+        取得快取結果，不存在時執行計算
+
+        Args:
+            key: 快取鍵
+            compute: 回傳 (結果, 是否可快取) 的協程函式；回退等暫時性的結果應標記為不可快取
+        """
+        result = self._cache.get(key)
+        if result is not None:
+            return result
+
+        task = self._pending.get(key)
+        if task is None:
+            task = asyncio.create_task(compute())
+            self._pending[key] = task
+            task.add_done_callback(lambda _: self._pending.pop(key, None))
+        # shield 讓單一呼叫端被取消時不會中斷其他呼叫端共用的計算
+        result, cacheable = await asyncio.shield(task)
+        if cacheable:
+            self._cache[key] = result
+        return result